@@ -0,0 +1,671 @@
+#!/usr/bin/env python
+"""Benchmarks of cgwire_checks against a local stand-in of Kitsu and Zou.
+
+The suite benchmark measures the wall time of the default checks,
+requests per second, wait convergence time and the memory peak of the
+checker in sequential, pooled and concurrent configurations. The
+startup benchmark measures, for every transport, the time to start the
+interpreter and import what the transport needs, and the total time of
+a one-shot run of cgwire_checks.py.
+
+Results are printed as JSON, and written to a file that compare() reads
+back to show the changes between two commits.
+"""
+
+import contextlib
+import copy
+import gzip
+import hashlib
+import io
+import json
+import os
+import platform
+import queue
+import random
+import statistics
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cgwire_checks
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cgwire_checks.py")
+VERSION = "0.17.30"
+TOKEN = "stand-in"
+USER = {"id": "stand-in-user", "timezone": "Europe/Paris"}
+AUTHENTICATED = ("/api/auth/logout", "/api/data/", "/api/pictures/")
+PROJECT = {"id": "stand-in-project", "name": "Stand-in", "project_status_name": "Open"}
+ASSETS = {
+    "/assets/index.js": (b"console.log('Kitsu');\n" * 1500, "text/javascript"),
+    "/assets/index.css": (b".kitsu { color: #00b242; }\n" * 800, "text/css"),
+}
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+INDEX_ASSETS = (
+    b'<script type="module" crossorigin src="/assets/index.js"></script>'
+    b'<link rel="stylesheet" crossorigin href="/assets/index.css">'
+)
+COMPONENTS = ("database", "key-value-store", "event-stream", "job-queue", "indexer")
+RESOURCES = {
+    "date": "2026-10-17T08:00:00",
+    "cpu": {
+        "percent": [10.0, 30.0],
+        "loadavg": {"last 1 min": 0.5, "last 5 min": 0.4, "last 10 min": 0.3},
+    },
+    "memory": {"total": 8589934592, "used": 3435973837, "percent": 40.0},
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Kitsu front, Zou API and events service answering the default checks.
+
+    Every answer is delayed by the latency of the server and is a 502
+    with probability error_rate, or until the server is ready. With
+    workers, at most that many answers are delayed at once, the others
+    wait for a free worker as behind gunicorn. The first cold_hits
+    answers of each path are delayed by cold_latency more, as from cold
+    workers and caches. The front page references the bundles of ASSETS
+    and is padded to payload bytes. The bundles have an ETag, the
+    asset_headers of the server, and are gzipped when accepted unless
+    compress is unset.
+
+    The events service speaks Engine.IO 4 over long-polling. Updating a
+    person emits person:update to the sessions connected to /events,
+    event_delay seconds later, or never with probability drop_rate.
+
+    Previews can be added to comments of any task, their file is
+    uploaded and downloaded, with ranges, through a temporary file. An
+    uploaded preview is queued for queue_delay seconds, then processing
+    for processing_delay seconds, then ready, or broken if it is an .avi
+    file that is not a RIFF one.
+
+    The status of Zou reports the health of the components of the server,
+    its resources their usage. The user context, open projects and tasks
+    to check of a journey list a single project and task, the tasks to
+    check are the tasks_to_check of the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in one segment, as from a real front
+    disable_nagle_algorithm = True
+    wbufsize = 65536
+
+    def send(self, status, body, content_type="application/json", headers=None):
+        server = self.server
+        path = self.path.partition("?")[0]
+        with server.lock:
+            server.hits += 1
+            cold = server.path_hits.get(path, 0) < server.cold_hits
+            server.path_hits[path] = server.path_hits.get(path, 0) + 1
+            failed = (
+                time.monotonic() < server.ready_at
+                or server.random.random() < server.error_rate
+            )
+        with server.workers:
+            if server.latency:
+                time.sleep(server.latency)
+            if cold:
+                time.sleep(server.cold_latency)
+        if failed:
+            status, body, content_type, headers = (
+                502,
+                b"<html>502 Bad Gateway</html>",
+                "text/html",
+                None,
+            )
+        self.send_response(status)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        return self.headers.get("Authorization") == f"Bearer {TOKEN}"
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/":
+            body = b"<title>Kitsu</title>" + INDEX_ASSETS
+            self.send(200, body.ljust(self.server.payload, b" "), "text/html")
+        elif path in ASSETS:
+            self.asset(path)
+        elif path == "/api":
+            self.send(200, json.dumps({"api": "Zou", "version": VERSION}).encode())
+        elif path == "/.version.txt":
+            self.send(200, f"{VERSION}\n".encode(), "text/plain")
+        elif path == "/api/status":
+            components = {
+                f"{component}-up": up
+                for component, up in self.server.components.items()
+            }
+            body = {"name": "Zou", "version": VERSION, **components}
+            self.send(200, json.dumps(body).encode())
+        elif path == "/api/status/resources":
+            self.send(200, json.dumps(self.server.resources).encode())
+        elif path == "/socket.io/":
+            self.poll(urllib.parse.parse_qs(query).get("sid", [None])[0])
+        elif path.startswith(AUTHENTICATED) and not self.authorized():
+            self.send(401, b'{"msg": "Missing Authorization Header"}')
+        elif path == "/api/auth/logout":
+            self.send(200, b'{"logout": true}')
+        elif path == "/api/data/user/context":
+            body = {"projects": [PROJECT], "notifications": []}
+            self.send(200, json.dumps(body).encode())
+        elif path == "/api/data/persons":
+            self.send(200, json.dumps([USER]).encode())
+        elif path == "/api/data/projects/open":
+            self.send(200, json.dumps([PROJECT]).encode())
+        elif path == "/api/data/user/tasks-to-check":
+            self.send(200, json.dumps(self.server.tasks_to_check).encode())
+        elif match := re.fullmatch(r"/api/data/preview-files/([^/]+)", path):
+            self.preview_status(match[1])
+        elif match := re.fullmatch(r"/api/data/tasks/([^/]+)", path):
+            task = {"id": match[1], "task_status_id": "todo"}
+            self.send(200, json.dumps(task).encode())
+        elif match := re.fullmatch(
+            r"/api/pictures/originals/preview-files/([^/]+)/download", path
+        ):
+            self.download(match[1])
+        else:
+            self.send(404, b'{"error": true}')
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        if path == "/socket.io/":
+            sid = urllib.parse.parse_qs(query).get("sid", [None])[0]
+            self.receive(sid, self.body().decode().split("\x1e"))
+            return
+        if path == "/api/auth/login":
+            data = json.loads(self.body())
+            if data.get("password") == "mysecretpassword":
+                body = {"login": True, "access_token": TOKEN, "user": USER}
+                self.send(200, json.dumps(body).encode())
+            else:
+                self.send(400, b'{"login": false}')
+            return
+        if not self.authorized():
+            self.send(401, b'{"msg": "Missing Authorization Header"}')
+            return
+        server = self.server
+        if re.fullmatch(r"/api/actions/tasks/[^/]+/comment", path):
+            self.body()
+            comment = uuid.uuid4().hex
+            with server.lock:
+                server.comments[comment] = []
+            self.send(201, json.dumps({"id": comment}).encode())
+        elif match := re.fullmatch(
+            r"/api/actions/tasks/[^/]+/comments/([^/]+)/add-preview", path
+        ):
+            preview = uuid.uuid4().hex
+            with server.lock:
+                server.comments[match[1]].append(preview)
+            self.send(201, json.dumps({"id": preview}).encode())
+        elif match := re.fullmatch(r"/api/pictures/preview-files/([^/]+)", path):
+            self.upload(match[1])
+        else:
+            self.send(404, b'{"error": true}')
+
+    def do_DELETE(self):
+        match = re.fullmatch(r"/api/data/tasks/[^/]+/comments/([^/]+)", self.path)
+        if match is None:
+            self.send(404, b'{"error": true}')
+            return
+        if not self.authorized():
+            self.send(401, b'{"msg": "Missing Authorization Header"}')
+            return
+        with self.server.lock:
+            previews = self.server.comments.pop(match[1], [])
+            for preview in previews:
+                self.server.uploads.pop(preview, None)
+                file = self.server.previews.pop(preview, None)
+                if file is not None:
+                    file.close()
+        self.send(204, b"")
+
+    def asset(self, path):
+        """Send a front bundle, gzipped if accepted and compress is set.
+
+        asset_headers override the default ones, None leaves one out.
+        """
+        body, content_type = ASSETS[path]
+        headers = {
+            "ETag": f'"{hashlib.sha256(body).hexdigest()[:16]}"',
+            **self.server.asset_headers,
+        }
+        headers = {name: value for name, value in headers.items() if value}
+        if self.server.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self.send(200, body, content_type, headers)
+
+    def upload(self, preview):
+        """Stream the file of a multipart upload to a temporary file."""
+        boundary = self.headers["Content-Type"].partition("boundary=")[2]
+        remaining = int(self.headers["Content-Length"])
+        filename = ""
+        # The headers of the part end with an empty line
+        while (line := self.rfile.readline()) != b"\r\n":
+            remaining -= len(line)
+            if match := re.search(rb'filename="([^"]*)"', line):
+                filename = match[1].decode()
+        remaining -= len(line) + len(f"\r\n--{boundary}--\r\n")
+        file = tempfile.TemporaryFile()
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            file.write(chunk)
+            remaining -= len(chunk)
+        self.rfile.readline()
+        self.rfile.readline()
+        file.seek(0)
+        broken = filename.endswith(".avi") and file.read(4) != b"RIFF"
+        with self.server.lock:
+            self.server.previews[preview] = file
+            self.server.uploads[preview] = (time.monotonic(), broken)
+        self.send(201, json.dumps({"id": preview}).encode())
+
+    def preview_status(self, preview):
+        server = self.server
+        if preview not in server.uploads:
+            self.send(200, json.dumps({"id": preview, "status": "processing"}).encode())
+            return
+        uploaded_at, broken = server.uploads[preview]
+        elapsed = time.monotonic() - uploaded_at
+        if elapsed < server.queue_delay:
+            status = "queued"
+        elif elapsed < server.queue_delay + server.processing_delay:
+            status = "processing"
+        else:
+            status = "broken" if broken else "ready"
+        self.send(200, json.dumps({"id": preview, "status": status}).encode())
+
+    def download(self, preview):
+        """Stream the file of a preview, or the range asked for."""
+        file = self.server.previews.get(preview)
+        if file is None:
+            self.send(404, b'{"error": true}')
+            return
+        size = file.seek(0, os.SEEK_END)
+        start, end = 0, size - 1
+        if match := re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", "")):
+            start, end = int(match[1]), int(match[2] or end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        # The storage check downloads one range of a preview at a time
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(remaining, 65536))
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def do_PUT(self):
+        data = json.loads(self.body())
+        person_id = self.path.rpartition("/")[2]
+        if not self.authorized():
+            self.send(401, b'{"msg": "Missing Authorization Header"}')
+            return
+        self.send(200, json.dumps({**USER, **data, "id": person_id}).encode())
+        event = json.dumps(["person:update", {"person_id": person_id}])
+        server = self.server
+        with server.lock:
+            sessions = [
+                session
+                for sid, session in server.sessions.items()
+                if sid in server.connected
+                and server.random.random() >= server.drop_rate
+            ]
+        for session in sessions:
+            threading.Timer(
+                server.event_delay, session.put, [f"42/events,{event}"]
+            ).start()
+
+    def poll(self, sid):
+        """Open an events session, or answer its poll with its packets."""
+        server = self.server
+        if sid is None:
+            sid = uuid.uuid4().hex
+            with server.lock:
+                server.sessions[sid] = queue.Queue()
+            handshake = {
+                "sid": sid,
+                "upgrades": [],
+                "pingInterval": int(server.ping_interval * 1000),
+                "pingTimeout": 1000,
+                "maxPayload": 1000000,
+            }
+            self.send(200, f"0{json.dumps(handshake)}".encode(), "text/plain")
+            return
+        session = server.sessions.get(sid)
+        if session is None:
+            self.send(400, b'{"code": 1, "message": "Session ID unknown"}')
+            return
+        try:
+            packets = [session.get(timeout=server.ping_interval)]
+        except queue.Empty:
+            packets = ["2"]
+        while not session.empty():
+            packets.append(session.get())
+        self.send(200, "\x1e".join(packets).encode(), "text/plain")
+
+    def receive(self, sid, packets):
+        """Handle the packets posted to an events session."""
+        server = self.server
+        session = server.sessions.get(sid)
+        if session is None:
+            self.send(400, b'{"code": 1, "message": "Session ID unknown"}')
+            return
+        for packet in packets:
+            if packet == "40/events,":
+                if self.authorized():
+                    with server.lock:
+                        server.connected.add(sid)
+                    session.put(f'40/events,{{"sid": "{sid}"}}')
+                else:
+                    session.put('44/events,{"message": "Unauthorized"}')
+            elif packet == "41/events,":
+                with server.lock:
+                    server.connected.discard(sid)
+            elif packet == "1":
+                with server.lock:
+                    server.connected.discard(sid)
+                    server.sessions.pop(sid, None)
+                session.put("1")
+        self.send(200, b"ok", "text/html")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn:
+    """Stand-in server on a free local port, served from a thread.
+
+    latency is in seconds, payload in bytes, and the server answers 502
+    for the first ready_after seconds. The first cold_hits answers of
+    each path take cold_latency seconds more. workers bounds the answers
+    delayed at once, None does not. Events are delivered after
+    event_delay seconds, and polls held up to ping_interval seconds.
+    Previews are queued for queue_delay seconds, then processed for
+    processing_delay seconds.
+    """
+
+    def __init__(
+        self,
+        latency=0,
+        payload=0,
+        error_rate=0,
+        ready_after=0,
+        seed=0,
+        handler=StandInHandler,
+        event_delay=0,
+        drop_rate=0,
+        ping_interval=5,
+        queue_delay=0,
+        processing_delay=0,
+        workers=None,
+        cold_hits=0,
+        cold_latency=0,
+    ):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.hits = 0
+        self.server.latency = latency
+        self.server.payload = payload
+        self.server.error_rate = error_rate
+        self.server.ready_at = time.monotonic() + ready_after
+        self.server.path_hits = {}
+        self.server.compress = True
+        self.server.asset_headers = {"Cache-Control": ASSET_CACHE_CONTROL}
+        self.server.cold_hits = cold_hits
+        self.server.cold_latency = cold_latency
+        self.server.random = random.Random(seed)
+        self.server.event_delay = event_delay
+        self.server.drop_rate = drop_rate
+        self.server.ping_interval = ping_interval
+        self.server.sessions = {}
+        self.server.connected = set()
+        self.server.comments = {}
+        self.server.tasks_to_check = [{"id": "stand-in-task", "task_status_id": "wfa"}]
+        self.server.previews = {}
+        self.server.uploads = {}
+        self.server.components = dict.fromkeys(COMPONENTS, True)
+        self.server.resources = copy.deepcopy(RESOURCES)
+        self.server.queue_delay = queue_delay
+        self.server.processing_delay = processing_delay
+        self.server.workers = (
+            threading.BoundedSemaphore(workers) if workers else contextlib.nullcontext()
+        )
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def hits(self):
+        return self.server.hits
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def timed(args, env=None):
+    """Run args in a subprocess, return its wall time in ms."""
+    start = time.perf_counter()
+    subprocess.run(
+        args,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def summary(times):
+    return {
+        "min": round(min(times), 1),
+        "median": round(statistics.median(times), 1),
+        "max": round(max(times), 1),
+    }
+
+
+CONFIGURATIONS = {
+    "sequential": {"workers": 1, "pool_size": 1, "keep_alive": False},
+    "pooled": {"workers": 1, "pool_size": 1, "keep_alive": True},
+    "concurrent": {"workers": 8, "pool_size": 8, "keep_alive": True},
+}
+
+
+def checker(url, transport, configuration):
+    t = cgwire_checks.CheckURL(url)
+    t.kitsu_version = t.zou_version = VERSION
+    t.transport_name = transport
+    t.pool_size = configuration["pool_size"]
+    t.keep_alive = configuration["keep_alive"]
+    return t
+
+
+def suite(
+    rounds=20,
+    transport="requests",
+    configurations=None,
+    latency=0,
+    payload=0,
+    error_rate=0,
+    ready_after=0.5,
+):
+    """Benchmark the default checks and wait per configuration.
+
+    Each configuration runs the suite rounds times on one checker, its
+    cache and validators cleared between rounds, as in watch mode.
+    wait_convergence is how long wait took to see a server ready after
+    ready_after seconds, beyond that delay.
+    """
+    results = {}
+    for name in configurations or CONFIGURATIONS:
+        configuration = CONFIGURATIONS[name]
+        with StandIn(latency, payload, error_rate) as stand_in:
+            t = checker(stand_in.url, transport, configuration)
+            # Imports of the transport are not part of the footprint
+            t.transport
+            times = []
+            failed = 0
+            tracemalloc.start()
+            for _ in range(rounds):
+                t.cache.clear()
+                t.validators.clear()
+                start = time.perf_counter()
+                messages = list(run_suite(t, configuration["workers"]))
+                times.append((time.perf_counter() - start) * 1000)
+                failed += sum(not message.startswith("✅") for message in messages)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            hits = stand_in.hits
+            t.close()
+        with StandIn(latency, ready_after=ready_after) as stand_in:
+            t = checker(stand_in.url, transport, configuration)
+            start = time.monotonic()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ready = t.wait({"front": "/", "api": "/api"})
+            convergence = time.monotonic() - start - ready_after
+            t.close()
+        results[name] = {
+            "suite_ms": summary(times),
+            "requests_per_second": round(hits / sum(times) * 1000, 1),
+            "failed_checks": failed,
+            "wait_convergence_ms": round(convergence * 1000, 1) if ready else None,
+            "memory_peak_kb": round(peak / 1024, 1),
+        }
+    return results
+
+
+def run_suite(checker, workers):
+    return cgwire_checks.run_checks(
+        checker, cgwire_checks.default_checks(checker), workers
+    )
+
+
+def compare(old, new, path=()):
+    """Yield (metric, old, new, change in %) for the numbers of two results."""
+    for key, value in new.items():
+        if key not in old:
+            continue
+        if isinstance(value, dict):
+            yield from compare(old[key], value, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(old[key], (int, float)):
+            change = (value - old[key]) / old[key] * 100 if old[key] else None
+            yield ".".join(path + (key,)), old[key], value, change
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(SCRIPT),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def startup(repeat=5, transports=None):
+    """Benchmark interpreter start, imports and healthy runs per transport."""
+    transports = transports or list(cgwire_checks.TRANSPORTS)
+    cwd = os.path.dirname(SCRIPT)
+    results = {
+        "python": summary(
+            [timed([sys.executable, "-c", "pass"]) for _ in range(repeat)]
+        )
+    }
+    with StandIn() as stand_in:
+        for name in transports:
+            code = (
+                "import cgwire_checks;"
+                f"cgwire_checks.TRANSPORTS[{name!r}](cgwire_checks.CheckURL(''))"
+            )
+            env = {
+                "KITSU_URL": stand_in.url,
+                "KITSU_VERSION": VERSION,
+                "ZOU_VERSION": VERSION,
+                "TRANSPORT": name,
+                "PYTHONPATH": cwd,
+            }
+            results[name] = {
+                "import": summary(
+                    [
+                        timed([sys.executable, "-c", code], {"PYTHONPATH": cwd})
+                        for _ in range(repeat)
+                    ]
+                ),
+                "run": summary(
+                    [timed([sys.executable, SCRIPT], env) for _ in range(repeat)]
+                ),
+            }
+    return results
+
+
+if __name__ == "__main__":  # pragma: nocover
+    benchmarks = os.getenv("BENCHMARKS", "suite,startup").split(",")
+    transports = os.getenv("TRANSPORTS", None)
+    transports = transports.split(",") if transports else None
+    configurations = os.getenv("CONFIGURATIONS", None)
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "parameters": {
+            "rounds": int(os.getenv("ROUNDS", 20)),
+            "repeat": int(os.getenv("REPEAT", 5)),
+            "latency": float(os.getenv("LATENCY", 0)),
+            "payload": int(os.getenv("PAYLOAD", 0)),
+            "error_rate": float(os.getenv("ERROR_RATE", 0)),
+        },
+    }
+    parameters = results["parameters"]
+    if "suite" in benchmarks:
+        results["suite"] = {
+            transport: suite(
+                parameters["rounds"],
+                transport,
+                configurations.split(",") if configurations else None,
+                parameters["latency"],
+                parameters["payload"],
+                parameters["error_rate"],
+            )
+            for transport in transports or cgwire_checks.TRANSPORTS
+        }
+    if "startup" in benchmarks:
+        results["startup"] = startup(parameters["repeat"], transports)
+    print(json.dumps(results, indent=2))
+    output = os.getenv("OUTPUT", None)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    baseline = os.getenv("BASELINE", None)
+    if baseline:
+        with open(baseline) as f:
+            old = json.load(f)
+        print(f"Changes since {old.get('commit')}:")
+        for metric, before, after, change in compare(old, results):
+            if change is not None:
+                print(f"{metric}: {before} -> {after} ({change:+.1f}%)")
@@ -1,9 +1,1297 @@
 #!/usr/bin/env python
+import base64
+import copy
+import datetime
+import functools
+import hashlib
+import itertools
+import json
+import math
 import os
+import queue
+import random
+import socket
+import statistics
+import struct
 import sys
+import threading
 import time
+import zlib
+from collections import OrderedDict
+from concurrent import futures
 
-import requests
+# requests, httpx and asyncio are imported by the transports and the
+# async engine that need them, to keep the start of a run fast.
+
+TIMINGS = ("dns", "connect", "tls", "ttfb", "total")
+
+_timings = threading.local()
+
+
+def record_timing(key, seconds):
+    """Add seconds to the timing key of the request sent by this thread."""
+    timings = getattr(_timings, "current", None)
+    if timings is not None:
+        timings[key] = timings.get(key, 0) + seconds * 1000
+
+
+def format_timings(timings):
+    return ", ".join(
+        f"{key} {timings[key]:.1f} ms" for key in TIMINGS if key in timings
+    )
+
+
+@functools.cache
+def timed_requests_classes():
+    """Return urllib3 connections and a requests adapter recording timings.
+
+    The new connections of the adapter record their dns, connect and tls
+    times. The classes are built on first use so that requests is only
+    imported by the requests transport.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class TimedConnection:
+        def _new_conn(self):
+            host = self._dns_host
+            start = time.perf_counter()
+            try:
+                addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+            except OSError:
+                return super()._new_conn()
+            self._dns_time = time.perf_counter() - start
+            record_timing("dns", self._dns_time)
+            start = time.perf_counter()
+            try:
+                for address in addresses[:-1]:
+                    self._dns_host = address[4][0]
+                    try:
+                        return super()._new_conn()
+                    except Exception:
+                        pass
+                self._dns_host = addresses[-1][4][0]
+                return super()._new_conn()
+            finally:
+                self._dns_host = host
+                self._connect_time = time.perf_counter() - start
+                record_timing("connect", self._connect_time)
+
+    class TimedHTTPConnection(TimedConnection, HTTPConnection):
+        pass
+
+    class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+        def connect(self):
+            start = time.perf_counter()
+            self._dns_time = self._connect_time = 0
+            super().connect()
+            elapsed = time.perf_counter() - start
+            record_timing("tls", elapsed - self._dns_time - self._connect_time)
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    class TimedHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": TimedHTTPConnectionPool,
+                "https": TimedHTTPSConnectionPool,
+            }
+
+    return TimedHTTPConnection, TimedHTTPSConnection, TimedHTTPAdapter
+
+
+HTTP_VERSIONS = {10: "HTTP/1.0", 11: "HTTP/1.1", 20: "HTTP/2"}
+
+
+class Transport:
+    """Base of the transports, counting the protocols of the responses."""
+
+    def __init__(self):
+        self.protocols = {}
+        self._protocols_lock = threading.Lock()
+
+    def negotiated(self, protocol):
+        if protocol is None:
+            return
+        with self._protocols_lock:
+            self.protocols[protocol] = self.protocols.get(protocol, 0) + 1
+
+    def iter_raw(self, response, chunk_size):
+        """Yield the body of response as received, without decoding it."""
+        return response.iter_raw(chunk_size)
+
+
+class RequestsTransport(Transport):
+    """Transport sending requests through a keep-alive requests.Session.
+
+    The session has its own adapter, built from the pool_size,
+    keep_alive, max_retries and backoff_factor of the checker.
+    """
+
+    def __init__(self, checker):
+        import requests
+        from urllib3.util.retry import Retry
+
+        super().__init__()
+        _, _, adapter_class = timed_requests_classes()
+        adapter = adapter_class(
+            pool_connections=checker.pool_size,
+            pool_maxsize=checker.pool_size,
+            max_retries=Retry(
+                total=checker.max_retries,
+                read=False,
+                backoff_factor=checker.backoff_factor,
+            ),
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not checker.keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.errors = (requests.exceptions.RequestException,)
+        self.connection_errors = (requests.exceptions.ConnectionError,)
+        self.timeout_errors = (requests.exceptions.Timeout,)
+        self._response_class = requests.Response
+
+    def request(
+        self,
+        method,
+        url,
+        data=None,
+        headers=None,
+        timeout=None,
+        stream=True,
+        content=None,
+    ):
+        kwargs = {"timeout": timeout}
+        if data:
+            kwargs["json"] = data
+        if content is not None:
+            kwargs["data"] = content
+        if headers:
+            kwargs["headers"] = headers
+        if stream:
+            kwargs["stream"] = True
+        if method == "POST":
+            response = self.session.post(url, **kwargs)
+        elif method == "GET":
+            response = self.session.get(url, **kwargs)
+        else:
+            response = self.session.request(method, url, **kwargs)
+        version = getattr(getattr(response, "raw", None), "version", None)
+        if isinstance(version, int):
+            self.negotiated(HTTP_VERSIONS.get(version))
+        return response
+
+    def is_streamed(self, response):
+        return isinstance(response, self._response_class)
+
+    def iter_raw(self, response, chunk_size):
+        return response.raw.stream(chunk_size, decode_content=False)
+
+    def stats(self):
+        stats = {"requests": 0, "opened": 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats["requests"] += pool.num_requests
+                stats["opened"] += pool.num_connections
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class StdlibResponse:
+    """http.client response with the parts of the requests API CheckURL uses."""
+
+    def __init__(self, transport, key, connection, response, elapsed):
+        self.status_code = response.status
+        self.headers = response.headers
+        self.encoding = response.headers.get_content_charset()
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+        self._transport = transport
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    @property
+    def cookies(self):
+        """Cookies set by the response, by name."""
+        import http.cookies
+
+        cookies = http.cookies.SimpleCookie()
+        for header in self.headers.get_all("Set-Cookie") or ():
+            cookies.load(header)
+        return {name: morsel.value for name, morsel in cookies.items()}
+
+    def iter_content(self, chunk_size):
+        while True:
+            chunk = self._response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+
+    # http.client does not decode bodies
+    iter_raw = iter_content
+
+    def close(self):
+        """Give the connection back to the pool if the body was read."""
+        if self._connection is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._transport.release(self._key, self._connection)
+        else:
+            self._connection.close()
+        self._connection = None
+
+
+class StdlibTransport(Transport):
+    """Transport built on http.client, needing no third-party import.
+
+    Connections are kept alive in a pool per host, up to pool_size idle
+    ones. A connection failing to open is retried max_retries times, an
+    idle one the server closed is replaced. A request that may have
+    reached the server is not sent again.
+    """
+
+    def __init__(self, checker):
+        import http.client
+        import urllib.parse
+
+        super().__init__()
+        self.http = http.client
+        self.urlsplit = urllib.parse.urlsplit
+        self.pool_size = checker.pool_size
+        self.keep_alive = checker.keep_alive
+        self.max_retries = checker.max_retries
+        self.backoff_factor = checker.backoff_factor
+        self.errors = (OSError, http.client.HTTPException)
+        self.connection_errors = (ConnectionError,)
+        self.timeout_errors = (TimeoutError,)
+        self.stale_errors = (
+            http.client.RemoteDisconnected,
+            BrokenPipeError,
+            ConnectionResetError,
+        )
+        self.opened = 0
+        self.requests = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def connect(self, key, timeout):
+        """Open a connection to key, recording dns, connect and tls times.
+
+        timeout bounds the tcp connection and the tls handshake.
+        """
+        scheme, host, port = key
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except OSError as e:
+            raise ConnectionError(f"Failed to resolve {host}: {e}") from e
+        record_timing("dns", time.perf_counter() - start)
+        start = time.perf_counter()
+        error = None
+        for family, kind, protocol, _, address in addresses:
+            sock = socket.socket(family, kind, protocol)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(address)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                break
+            except OSError as e:
+                sock.close()
+                error = e
+        else:
+            raise ConnectionError(f"Failed to connect to {host}:{port}: {error}")
+        record_timing("connect", time.perf_counter() - start)
+        if scheme == "https":
+            start = time.perf_counter()
+            if self._ssl_context is None:
+                import ssl
+
+                self._ssl_context = ssl.create_default_context()
+            try:
+                sock = self._ssl_context.wrap_socket(sock, server_hostname=host)
+            except OSError as e:
+                sock.close()
+                raise ConnectionError(f"TLS handshake with {host} failed: {e}")
+            record_timing("tls", time.perf_counter() - start)
+            connection = self.http.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            connection = self.http.HTTPConnection(host, port, timeout=timeout)
+        connection.sock = sock
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(
+        self,
+        method,
+        url,
+        data=None,
+        headers=None,
+        timeout=None,
+        stream=True,
+        content=None,
+    ):
+        parts = self.urlsplit(url)
+        key = (
+            parts.scheme,
+            parts.hostname,
+            parts.port or (443 if parts.scheme == "https" else 80),
+        )
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        headers = {"User-Agent": "cgwire-checks", **(headers or {})}
+        body = content
+        if data:
+            body = json.dumps(data).encode()
+            headers["Content-Type"] = "application/json"
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+
+        # A streamed body is read once, so it is never sent again
+        rewindable = body is None or isinstance(body, bytes)
+        connect_timeout, read_timeout = split_timeout(timeout)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            connection = self.acquire(key) if rewindable else None
+            reused = connection is not None
+            sent = False
+            try:
+                if connection is None:
+                    connection = self.connect(key, connect_timeout)
+                connection.timeout = read_timeout
+                connection.sock.settimeout(read_timeout)
+                sent = True
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                break
+            except self.errors as e:
+                if connection is not None:
+                    connection.close()
+                # An idle connection may have been closed by the server
+                # before it got the request, which is then sent again
+                if reused and isinstance(e, self.stale_errors):
+                    continue
+                # Otherwise only a request that was not sent is retried
+                if sent or attempt >= self.max_retries:
+                    if isinstance(e, (ConnectionError, TimeoutError)):
+                        raise
+                    raise ConnectionError(f"{url}: {e!r}") from e
+                attempt += 1
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+        with self._lock:
+            self.requests += 1
+        self.negotiated(HTTP_VERSIONS.get(response.version))
+        response = StdlibResponse(
+            self, key, connection, response, time.perf_counter() - start
+        )
+        if not stream:
+            for _ in response.iter_content(65536):
+                pass
+        return response
+
+    def is_streamed(self, response):
+        return True
+
+    def stats(self):
+        return {"requests": self.requests, "opened": self.opened}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class HttpxResponse:
+    """httpx response with the parts of the requests API CheckURL uses."""
+
+    def __init__(self, response, elapsed):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.charset_encoding
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+        self.http_version = response.http_version
+        self._response = response
+
+    def __bool__(self):
+        return not self._response.is_error
+
+    @property
+    def cookies(self):
+        return dict(self._response.cookies)
+
+    def iter_content(self, chunk_size):
+        yield from self._response.iter_bytes(chunk_size)
+        self.close()
+
+    def iter_raw(self, chunk_size):
+        yield from self._response.iter_raw(chunk_size)
+        self.close()
+
+    def close(self):
+        self._response.close()
+
+
+class HttpxTransport(Transport):
+    """Transport multiplexing requests over HTTP/2 with an httpx.Client.
+
+    Every request to a target shares one connection when the server
+    negotiates HTTP/2 through ALPN, or with h2c for http:// targets
+    known to speak HTTP/2 in clear text. Otherwise pool_size HTTP/1.1
+    connections are kept alive. It needs the http2 extra of httpx.
+    """
+
+    def __init__(self, checker):
+        super().__init__()
+        httpx = import_httpx(http2=True)
+        self.httpx = httpx
+        self.client = httpx.Client(
+            http1=not checker.h2c,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=checker.pool_size,
+                max_keepalive_connections=(
+                    checker.pool_size if checker.keep_alive else 0
+                ),
+            ),
+            transport=httpx.HTTPTransport(
+                http1=not checker.h2c, http2=True, retries=checker.max_retries
+            ),
+        )
+        self.errors = (httpx.TransportError,)
+        self.connection_errors = (httpx.NetworkError, httpx.RemoteProtocolError)
+        self.timeout_errors = (httpx.TimeoutException,)
+        self.opened = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def trace(self, event, started):
+        """Record the connect and tls times of new connections.
+
+        started holds the start times of the steps of one request.
+        """
+        now = time.perf_counter()
+        step, _, state = event.rpartition(".")
+        if state == "started":
+            started[step] = now
+        elif state == "complete" and step in started:
+            elapsed = now - started.pop(step)
+            if step == "connection.connect_tcp":
+                record_timing("connect", elapsed)
+                with self._lock:
+                    self.opened += 1
+            elif step == "connection.start_tls":
+                record_timing("tls", elapsed)
+
+    def request(
+        self,
+        method,
+        url,
+        data=None,
+        headers=None,
+        timeout=None,
+        stream=True,
+        content=None,
+    ):
+        connect, read = split_timeout(timeout)
+        start = time.perf_counter()
+        started = {}
+
+        def trace(event, info):
+            self.trace(event, started)
+
+        request = self.client.build_request(
+            method,
+            url,
+            json=data or None,
+            content=content,
+            headers=headers,
+            timeout=self.httpx.Timeout(read, connect=connect),
+            extensions={"trace": trace},
+        )
+        response = self.client.send(request, stream=stream)
+        with self._lock:
+            self.requests += 1
+        self.negotiated(response.http_version)
+        return HttpxResponse(response, time.perf_counter() - start)
+
+    def is_streamed(self, response):
+        return True
+
+    def stats(self):
+        return {"requests": self.requests, "opened": self.opened}
+
+    def close(self):
+        self.client.close()
+
+
+TRANSPORTS = {
+    "requests": RequestsTransport,
+    "stdlib": StdlibTransport,
+    "http2": HttpxTransport,
+}
+
+
+def token_expired(token, margin=10):
+    """Whether a JWT expires within margin seconds, False if unreadable."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + -len(payload) % 4 * "="))
+        return claims["exp"] - margin <= time.time()
+    except (IndexError, KeyError, TypeError, ValueError):
+        return False
+
+
+def split_timeout(timeout):
+    """Return the (connect, read) timeouts of a number or a pair."""
+    if isinstance(timeout, (tuple, list)):
+        return tuple(timeout)
+    return timeout, timeout
+
+
+def percentile(values, q):
+    """Return the q quantile of values, by nearest rank."""
+    values = sorted(values)
+    return values[max(math.ceil(q * len(values)) - 1, 0)]
+
+
+class Histogram:
+    """Counts of latencies in ms, in buckets growing by precision.
+
+    A latency is counted in the bucket of its logarithm, so quantiles are
+    within precision of the samples and the buckets stay a few hundred
+    however many are added. Histograms of the same precision merge by
+    adding their counts.
+    """
+
+    floor = 0.001
+
+    def __init__(self, precision=0.01):
+        self.precision = precision
+        self.base = math.log1p(precision)
+        self.buckets = {}
+        self.count = 0
+        self.max = 0
+
+    def add(self, value):
+        bucket = math.ceil(math.log(max(value, self.floor)) / self.base)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Return the q quantile by nearest rank, None without samples."""
+        if not self.count:
+            return None
+        rank = max(math.ceil(q * self.count), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                break
+        return min(math.exp(bucket * self.base), self.max)
+
+
+READINESS = {
+    "front": "/",
+    "api": "/api",
+    "events": "/socket.io/?EIO=4&transport=polling",
+}
+
+
+def backoff(interval, max_interval):
+    """Return the jittered sleep for interval and the next interval."""
+    return random.uniform(interval / 2, interval), min(interval * 2, max_interval)
+
+
+class ParsedResponse:
+    """Response whose body is read once and shared by every assertion.
+
+    The body of a streamed response is only read as far as an assertion
+    needs, never beyond max_body bytes, and the connection is closed when
+    reading stops before the end. One of errors raised while reading
+    ends the body there, kept in error, and truncates it. Other
+    responses are read through their text and json().
+
+    timings holds the dns, connect, tls, ttfb and total times in ms that
+    could be measured for the request.
+    """
+
+    chunk_size = 16384
+
+    def __init__(
+        self,
+        response,
+        timings=None,
+        max_body=1048576,
+        excerpt_size=1024,
+        body=None,
+        streamed=False,
+        errors=(),
+    ):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.timings = {} if timings is None else timings
+        self.max_body = max_body
+        self.excerpt_size = excerpt_size
+        self.truncated = False
+        self.not_modified = False
+        self.size = None
+        self.errors = errors
+        self.error = None
+        self._body = bytearray(body or b"")
+        self._chunks = None
+        self._streamed = streamed or body is not None
+        if streamed:
+            self._chunks = response.iter_content(self.chunk_size)
+        self._text = None
+        self._json = None
+        self._json_error = None
+        self._lock = threading.RLock()
+
+    def __bool__(self):
+        return bool(self.response)
+
+    def read(self, size=None):
+        """Return the first size bytes of the body, max_body at most."""
+        limit = self.max_body if size is None else min(size, self.max_body)
+        with self._lock:
+            while self._chunks is not None and len(self._body) < limit:
+                try:
+                    chunk = next(self._chunks, None)
+                except self.errors as e:
+                    self.error = e
+                    self.truncated = True
+                    self.close()
+                    break
+                if chunk is None:
+                    self._chunks = None
+                else:
+                    self._body += chunk
+            if self._chunks is not None and len(self._body) >= self.max_body:
+                self.truncated = True
+                del self._body[self.max_body :]
+                self.close()
+            return bytes(self._body[:limit])
+
+    def revalidated(self, timings):
+        """Return this response again for a 304 Not Modified answer."""
+        request = copy.copy(self)
+        request.timings = timings
+        request.not_modified = True
+        return request
+
+    def close(self):
+        """Stop reading the body and release the connection."""
+        if self._chunks is not None:
+            self._chunks = None
+            self.response.close()
+
+    def contains(self, marker):
+        """Read the body until marker is found, or to its end."""
+        if not self._streamed:
+            return marker in self.text
+        marker = marker.encode()
+        with self._lock:
+            size = 0
+            while True:
+                size += self.chunk_size
+                body = self.read(size)
+                if marker in body:
+                    self.close()
+                    return True
+                if len(body) < size:
+                    return False
+
+    def decode(self, body):
+        encoding = getattr(self.response, "encoding", None)
+        if not isinstance(encoding, str):
+            encoding = "utf-8"
+        return body.decode(encoding, errors="replace")
+
+    @property
+    def text(self):
+        with self._lock:
+            if self._text is None:
+                if self._streamed:
+                    self._text = self.decode(self.read())
+                else:
+                    self._text = self.response.text
+            return self._text
+
+    def drain(self):
+        """Read the body to its end, past max_body, return its size.
+
+        Only the first max_body bytes are kept.
+        """
+        with self._lock:
+            size = len(self._body)
+            while self._chunks is not None:
+                try:
+                    chunk = next(self._chunks, None)
+                except self.errors as e:
+                    self.error = e
+                    self.truncated = True
+                    self.close()
+                    break
+                if chunk is None:
+                    self._chunks = None
+                    break
+                size += len(chunk)
+                self._body += chunk[: max(self.max_body - len(self._body), 0)]
+            if size > self.max_body:
+                self.truncated = True
+            return size
+
+    def measure(self, drain=False):
+        """Read the body to its end, or max_body, and keep its size.
+
+        The size of a truncated body is its Content-Length, if known. With
+        drain, the body past max_body is read and counted too, see drain.
+        """
+        if drain and self._streamed:
+            size = self.drain()
+        else:
+            size = len(self.read() if self._streamed else self.text.encode())
+            if self.truncated:
+                size = int(self.headers.get("Content-Length", size))
+        self.size = size
+        self.close()
+        return size
+
+    def cookies(self):
+        """Return the cookies set by the response, by name."""
+        return dict(getattr(self.response, "cookies", None) or {})
+
+    def excerpt(self):
+        """Return the start of the body, saying how much was omitted."""
+        if not self._streamed:
+            text = self.text
+            if len(text) <= self.excerpt_size:
+                return text
+            omitted = len(text[self.excerpt_size :].encode())
+            return f"{text[: self.excerpt_size]}\n[... {omitted} bytes omitted]"
+        with self._lock:
+            body = self.read(self.excerpt_size + 1)
+            if len(body) <= self.excerpt_size:
+                return self.decode(body)
+            if self._chunks is None and not self.truncated:
+                omitted = f"{len(self._body) - self.excerpt_size}"
+            elif self.headers.get("Content-Length") and not self.headers.get(
+                "Content-Encoding"
+            ):
+                omitted = f"{int(self.headers['Content-Length']) - self.excerpt_size}"
+            else:
+                omitted = "more"
+            self.close()
+            excerpt = self.decode(body[: self.excerpt_size])
+            return f"{excerpt}\n[... {omitted} bytes omitted]"
+
+    def json(self):
+        with self._lock:
+            if self._json is None and self._json_error is None:
+                try:
+                    if self._streamed:
+                        self._json = json.loads(self.text)
+                    else:
+                        self._json = self.response.json()
+                except ValueError as e:
+                    self._json_error = e
+        if self._json_error is not None:
+            raise self._json_error
+        return self._json
+
+
+class ResponseCache:
+    """Responses of a run, keyed by method, url and body.
+
+    Entries expire after ttl seconds and the least recently used ones
+    are dropped beyond size entries. A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, ttl=60, size=128):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, data=None):
+        body = json.dumps(data, sort_keys=True) if data is not None else None
+        return (method, url, body)
+
+    def get(self, key, fetch):
+        """Return the cached response for key, or store the one of fetch().
+
+        Concurrent calls for the same key wait for a single fetch.
+        """
+        if self.ttl <= 0:
+            return fetch()
+        with self._lock:
+            fetching = self._fetching.setdefault(key, threading.Lock())
+        with fetching:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            response = fetch()
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = (time.monotonic(), response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    dropped, _ = self._entries.popitem(last=False)
+                    self._fetching.pop(dropped, None)
+            return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fetching.clear()
+
+
+class EventsClient:
+    """Socket.IO client of the Kitsu events service, over HTTP long-polling.
+
+    It speaks Engine.IO 4 through the transport of the checker with the
+    session of the last login, so it needs no websocket library. Once
+    connected to namespace, a thread polls the service and queues its
+    events with the time they arrived.
+    """
+
+    separator = "\x1e"
+
+    def __init__(self, checker, path="/socket.io/", namespace="/events"):
+        self.checker = checker
+        self.url = f"{checker.base_url}{path}?EIO=4&transport=polling"
+        self.namespace = namespace
+        self.sid = None
+        self.poll_timeout = None
+        self.events = queue.Queue()
+        self.closed = threading.Event()
+        self._thread = None
+
+    def request(self, method, body=None, timeout=None):
+        """Send packets in body, or poll for packets without one."""
+        url = self.url if self.sid is None else f"{self.url}&sid={self.sid}"
+        headers = self.checker.auth_headers()
+        content = None
+        if body is not None:
+            headers["Content-Type"] = "text/plain;charset=UTF-8"
+            content = body.encode()
+        response = self.checker.transport.request(
+            method,
+            url,
+            headers=headers,
+            timeout=timeout or self.checker.timeouts(),
+            content=content,
+        )
+        text = b"".join(response.iter_content(65536)).decode(errors="replace")
+        if not response:
+            raise ValueError(f"events service answered {response.status_code}")
+        return text
+
+    def send(self, *packets):
+        self.request("POST", self.separator.join(packets))
+
+    def poll(self):
+        """Return the packets of the next poll, which the server may hold.
+
+        The server answers at least every ping interval, a poll can take
+        as long plus the ping timeout.
+        """
+        connect, _ = split_timeout(self.checker.timeouts())
+        text = self.request("GET", timeout=(connect, self.poll_timeout))
+        return text.split(self.separator) if text else []
+
+    def connect(self, timeout=5):
+        """Open a session and connect to the namespace, return the ms it took.
+
+        Raises ValueError if the service refuses the connection or does
+        not accept it within timeout seconds.
+        """
+        start = time.perf_counter()
+        packet = self.request("GET").split(self.separator)[0]
+        if not packet.startswith("0"):
+            raise ValueError(f"unexpected events handshake {packet[:100]!r}")
+        handshake = json.loads(packet[1:])
+        self.sid = handshake["sid"]
+        self.poll_timeout = (
+            handshake.get("pingInterval", 25000) + handshake.get("pingTimeout", 20000)
+        ) / 1000
+        self.send(f"40{self.namespace},")
+        while time.perf_counter() - start < timeout:
+            for packet in self.poll():
+                if packet.startswith(f"40{self.namespace},"):
+                    elapsed = (time.perf_counter() - start) * 1000
+                    self._thread = threading.Thread(target=self.receive, daemon=True)
+                    self._thread.start()
+                    return elapsed
+                refused = f"44{self.namespace},"
+                if packet.startswith(refused):
+                    reason = packet[len(refused) :][:100]
+                    raise ValueError(f"events connection refused: {reason}")
+                if packet == "2":
+                    self.send("3")
+        raise ValueError(f"events connection not accepted within {timeout}s")
+
+    def event(self, packet):
+        """Return the name and data of an event of the namespace, or None."""
+        prefix = f"42{self.namespace},"
+        if not packet.startswith(prefix):
+            return None
+        # An event may carry an acknowledgement id before its arguments
+        name, *args = json.loads(packet[len(prefix) :].lstrip("0123456789"))
+        return name, args[0] if args else None
+
+    def receive(self):
+        """Poll and queue events until closed, answering pings."""
+        errors = self.checker.transport.errors + (ValueError,)
+        while not self.closed.is_set():
+            try:
+                packets = self.poll()
+                arrival = time.perf_counter()
+                for packet in packets:
+                    if packet == "1":
+                        return
+                    if packet == "2":
+                        self.send("3")
+                    event = self.event(packet)
+                    if event is not None:
+                        self.events.put((arrival, *event))
+            except errors:
+                return
+
+    def wait_event(self, name, data, start, timeout):
+        """Return the ms from start to the arrival of the event name, or None.
+
+        The event must carry the items of data, and arrive after start and
+        before timeout seconds.
+        """
+        deadline = start + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            try:
+                arrival, event, event_data = self.events.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if (
+                arrival >= start
+                and event == name
+                and isinstance(event_data, dict)
+                and all(event_data.get(key) == value for key, value in data.items())
+            ):
+                return (arrival - start) * 1000
+
+    def close(self):
+        """Leave the namespace and close the session."""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        if self.sid is not None:
+            try:
+                self.send(f"41{self.namespace},", "1")
+            except self.checker.transport.errors + (ValueError,):
+                pass
+        if self._thread is not None:
+            self._thread.join(split_timeout(self.checker.timeouts())[1])
+
+
+def format_events(events):
+    details = f"connect {events['connect_ms']:.1f} ms"
+    latencies = events["latencies_ms"]
+    if latencies:
+        details += "".join(
+            f", {label} {percentile(latencies, q):.1f} ms"
+            for label, q in (("p50", 0.5), ("p95", 0.95), ("max", 1))
+        )
+    return f"{details}, {events['dropped']}/{events['sent']} dropped"
+
+
+class GeneratedFile:
+    """Content of size bytes, generated chunk by chunk, never held whole.
+
+    Every chunk is a random block of the seed starting with its index, so
+    any range of the content can be generated again to check a download.
+    """
+
+    chunk_size = 1048576
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self._block = random.Random(seed).randbytes(self.chunk_size)
+
+    def chunks(self, start=0, end=None):
+        """Yield the content from start to end, chunk by chunk."""
+        end = self.size if end is None else min(end, self.size)
+        index = start // self.chunk_size
+        while index * self.chunk_size < end:
+            offset = index * self.chunk_size
+            chunk = index.to_bytes(8, "big") + self._block[8:]
+            yield chunk[max(start - offset, 0) : end - offset]
+            index += 1
+
+    def digest(self, start=0, end=None):
+        """Return the sha256 of the content from start to end."""
+        digest = hashlib.sha256()
+        for chunk in self.chunks(start, end):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+class MultipartBody:
+    """multipart/form-data body of one file, streamed from its chunks.
+
+    requests and http.client read it like a file, httpx iterates it. Its
+    length is known, so it is sent with a Content-Length, not chunked.
+    """
+
+    def __init__(self, field, filename, chunks, size):
+        self.boundary = os.urandom(16).hex()
+        head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"'
+            "\r\nContent-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.length = len(head) + size + len(tail)
+        self._parts = itertools.chain((head,), chunks, (tail,))
+        self._part = memoryview(b"")
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        """Return at most size bytes, the rest of the current part by default."""
+        while not self._part:
+            part = next(self._parts, None)
+            if part is None:
+                return b""
+            self._part = memoryview(part)
+        if size < 0:
+            size = len(self._part)
+        data, self._part = self._part[:size], self._part[size:]
+        return bytes(data)
+
+    def __iter__(self):
+        while chunk := self.read():
+            yield chunk
+
+
+def format_throughput(size, seconds):
+    return f"{size / max(seconds, 1e-9) / 1000000:.1f} MB/s"
+
+
+def riff_chunk(fourcc, data):
+    return fourcc + struct.pack("<I", len(data)) + data + b"\0" * (len(data) % 2)
+
+
+def generate_avi(width=64, height=48, frames=25, fps=25):
+    """Return an uncompressed AVI video of a gradient moving frame by frame."""
+    stride = (width * 3 + 3) & ~3
+    frame_size = stride * height
+    avih = struct.pack(
+        "<14I",
+        1000000 // fps,
+        frame_size * fps,
+        0,
+        0x10,  # AVIF_HASINDEX
+        frames,
+        0,
+        1,
+        frame_size,
+        width,
+        height,
+        0,
+        0,
+        0,
+        0,
+    )
+    strh = struct.pack(
+        "<4s4sI2H8I4h",
+        b"vids",
+        b"DIB ",
+        0,
+        0,
+        0,
+        0,
+        1,
+        fps,
+        0,
+        frames,
+        frame_size,
+        0xFFFFFFFF,
+        0,
+        0,
+        0,
+        width,
+        height,
+    )
+    strf = struct.pack(
+        "<IiiHHIIiiII", 40, width, height, 1, 24, 0, frame_size, 0, 0, 0, 0
+    )
+    hdrl = riff_chunk(
+        b"LIST",
+        b"hdrl"
+        + riff_chunk(b"avih", avih)
+        + riff_chunk(
+            b"LIST", b"strl" + riff_chunk(b"strh", strh) + riff_chunk(b"strf", strf)
+        ),
+    )
+    chunks = []
+    index = []
+    offset = 4
+    for frame in range(frames):
+        row = bytes((x * 4 + frame * 8) % 256 for x in range(width) for _ in range(3))
+        chunk = riff_chunk(b"00db", row.ljust(stride, b"\0") * height)
+        index.append(struct.pack("<4s3I", b"00db", 0x10, offset, frame_size))
+        chunks.append(chunk)
+        offset += len(chunk)
+    movi = riff_chunk(b"LIST", b"movi" + b"".join(chunks))
+    idx1 = riff_chunk(b"idx1", b"".join(index))
+    return riff_chunk(b"RIFF", b"AVI " + hdrl + movi + idx1)
+
+
+RESOURCE_UNITS = {"cpu": "%", "memory": "%", "load": ""}
+
+
+def usage_figure(value, combine=statistics.fmean):
+    """Return a number, the first value of a dict, or combine of a list."""
+    if isinstance(value, dict):
+        value = next(iter(value.values()), None)
+    if isinstance(value, list):
+        value = combine(value) if value else None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def resource_usage(body):
+    """Return the cpu, memory and load figures of /api/status/resources."""
+    cpu = body.get("cpu") or {}
+    figures = {
+        "cpu": usage_figure(cpu.get("percent")),
+        "memory": usage_figure((body.get("memory") or {}).get("percent")),
+        # Load averages are listed from the last minute to the last 15
+        "load": usage_figure(cpu.get("loadavg"), lambda values: values[0]),
+    }
+    return {name: value for name, value in figures.items() if value is not None}
+
+
+def body_decoder(encoding):
+    """Return a function decompressing the chunks of a body, in order.
+
+    encoding is a Content-Encoding. Returns None for an encoding that
+    can't be decoded, brotli needing the brotli or brotlicffi package.
+    """
+    if encoding in ("", "identity"):
+        return bytes
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # Detect the gzip or zlib header
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 32).decompress
+    if encoding == "br":
+        try:
+            import brotli
+        except ImportError:
+            try:
+                import brotlicffi as brotli
+            except ImportError:
+                return None
+        decompressor = brotli.Decompressor()
+        return getattr(decompressor, "decompress", None) or decompressor.process
+    return None
+
+
+def long_lived(cache_control):
+    """Tell if Cache-Control makes a response immutable or fresh for a day."""
+    directives = [d.strip() for d in cache_control.lower().split(",")]
+    if "no-store" in directives or "no-cache" in directives:
+        return False
+    if "immutable" in directives:
+        return True
+    return any(
+        d.startswith("max-age=") and d[8:].isdigit() and int(d[8:]) >= 86400
+        for d in directives
+    )
+
+
+def asset_problems(asset, budget):
+    """Return what is wrong with the delivery of an asset, see fetch_asset.
+
+    Bodies of 1 KiB and more should be compressed with gzip or brotli.
+    """
+    problems = []
+    size = asset["decoded_bytes"] or asset["wire_bytes"]
+    if asset["encoding"] not in ("gzip", "br") and size >= 1024:
+        problems.append(f"not compressed ({asset['encoding']})")
+    if not long_lived(asset["cache_control"]):
+        problems.append(f"Cache-Control {asset['cache_control'] or 'missing'}")
+    if not asset["etag"]:
+        problems.append("no ETag")
+    if asset["wire_bytes"] > budget:
+        problems.append(f"above {budget} bytes")
+    return problems
+
+
+def format_size(size):
+    return "?" if size is None else f"{size / 1000:.1f} kB"
+
+
+# Statuses of a preview waiting for a worker of the job queue
+QUEUED_STATUSES = ("queued",)
 
 
 class CheckURL:
@@ -11,129 +1299,3047 @@ class CheckURL:
         self.base_url = base_url
         self.status = 0
         self.request = None
+        self.responses = {}
         self.kitsu_version = None
         self.zou_version = None
         self.retry = 10
         self.timeout = 5
+        self.connect_timeout = None
+        self.read_timeout = None
+        self.check_timeouts = {}
+        self.run_deadline = None
+        self.deadline = None
         self.sleep = 1
+        self.wait_deadline = None
+        self.poll_interval = 0.1
+        self.readiness = dict(READINESS)
+        self.ready_times = {}
+        self.pool_size = 10
+        self.keep_alive = True
+        self.max_retries = 0
+        self.backoff_factor = 0
+        self.cache = ResponseCache()
+        self.slo_ms = {}
+        self.max_body = 1048576
+        self.prefetch = 65536
+        self.excerpt_size = 1024
+        # Revalidating only pays off across runs, see watch
+        self.conditional = set()
+        self.validators = {}
+        self.not_modified = 0
+        self.deep_probes = False
+        self.tokens = {}
+        self.cookies = {}
+        self.user = {}
+        self.events_probe = False
+        self.events_samples = 5
+        self.events_timeout = 5
+        self.events = None
+        self.storage_task = None
+        self.storage_size = 10485760
+        self.storage = None
+        self.processing_task = None
+        self.processing_deadline = 300
+        self.processing = None
+        self.health_probe = False
+        self.assets_probe = False
+        self.asset_budget = 2000000
+        self.assets_budget = 5000000
+        self.assets = None
+        self.resource_limits = {}
+        self.components = {}
+        self.resources = {}
+        self.refreshes = 0
+        self._auth_lock = threading.Lock()
+        self.transport_name = "requests"
+        self.h2c = False
+        self._transport = None
+        self._transport_lock = threading.Lock()
+
+    @property
+    def transport(self):
+        """Transport shared by every check and by wait.
+
+        It is built on first use from transport_name, pool_size,
+        keep_alive, max_retries and backoff_factor.
+        """
+        with self._transport_lock:
+            if self._transport is None:
+                self._transport = TRANSPORTS[self.transport_name](self)
+        return self._transport
+
+    @property
+    def session(self):
+        """requests.Session of the requests transport."""
+        return self.transport.session
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def reset(self):
+        """Forget the results of the previous run, keep the connections."""
+        self.status = 0
+        self.request = None
+        self.responses = {}
+        self.deadline = None
+        self.events = None
+        self.storage = None
+        self.processing = None
+        self.components = {}
+        self.resources = {}
+        self.assets = None
+        self.cache.clear()
+
+    def start_deadline(self):
+        """Start the run deadline, run_deadline seconds from now.
+
+        It is kept if already running, so that wait and the checks share
+        it, and restarts after reset.
+        """
+        if self.deadline is None and self.run_deadline is not None:
+            self.deadline = time.monotonic() + self.run_deadline
+
+    def remaining(self):
+        """Seconds left before the deadline, None without one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def timeouts(self, timeout=None, budget=None):
+        """Return the timeout of a request, a number or a (connect, read) pair.
+
+        timeout overrides connect_timeout and read_timeout, both
+        defaulting to self.timeout. They are bounded by budget and by the
+        time left before the deadline.
+        """
+        if timeout is None:
+            timeout = (
+                self.timeout if self.connect_timeout is None else self.connect_timeout,
+                self.timeout if self.read_timeout is None else self.read_timeout,
+            )
+        connect, read = split_timeout(timeout)
+        for limit in (budget, self.remaining()):
+            if limit is not None:
+                limit = max(limit, 0.001)
+                connect = min(connect, limit)
+                read = min(read, limit)
+        if connect == read:
+            return connect
+        return connect, read
+
+    def protocols(self):
+        """Count the responses by the HTTP version negotiated for them."""
+        if self._transport is None:
+            return {}
+        return dict(self._transport.protocols)
+
+    def connection_stats(self):
+        """Count the requests sent and the connections opened or reused."""
+        if self._transport is None:
+            return {"requests": 0, "opened": 0, "reused": 0}
+        stats = self._transport.stats()
+        stats["reused"] = max(stats["requests"] - stats["opened"], 0)
+        return stats
+
+    def send(self, url, data=None, timeout=None, headers=None, method=None):
+        """Request url, posting data as JSON if any, and time the request.
+
+        method overrides POST or GET, data is then sent as its body. The
+        body is streamed, only its first prefetch bytes are read. GET
+        requests of the conditional paths are revalidated.
+        """
+        if timeout is None:
+            timeout = self.timeouts()
+        if method is None:
+            method = "POST" if data else "GET"
+        if method == "GET":
+            headers = {**self.conditional_headers(url), **(headers or {})}
+        # Building the transport imports its library, which is not timed
+        transport = self.transport
+        timings = _timings.current = {}
+        start = time.perf_counter()
+        try:
+            response = transport.request(
+                method,
+                url,
+                data,
+                headers,
+                timeout,
+            )
+        finally:
+            _timings.current = None
+        request = ParsedResponse(
+            response,
+            timings,
+            self.max_body,
+            self.excerpt_size,
+            streamed=transport.is_streamed(response),
+            errors=transport.errors,
+        )
+        # Small bodies are read at once so the connection goes back to the pool
+        request.read(self.prefetch)
+        timings["total"] = (time.perf_counter() - start) * 1000
+        elapsed = getattr(response, "elapsed", None)
+        if isinstance(elapsed, datetime.timedelta):
+            timings["ttfb"] = elapsed.total_seconds() * 1000
+        if method == "GET" and url[len(self.base_url) :] in self.conditional:
+            return self.revalidate(url, request)
+        return request
+
+    def conditional_headers(self, url):
+        stored = self.validators.get(url)
+        if stored is None:
+            return {}
+        headers = {}
+        if "ETag" in stored.headers:
+            headers["If-None-Match"] = stored.headers["ETag"]
+        if "Last-Modified" in stored.headers:
+            headers["If-Modified-Since"] = stored.headers["Last-Modified"]
+        return headers
+
+    def revalidate(self, url, request):
+        """Keep the validators of url, reuse its stored body on a 304."""
+        stored = self.validators.get(url)
+        if request.status_code == 304 and stored is not None:
+            self.not_modified += 1
+            return stored.revalidated(request.timings)
+        if request.status_code == 200 and (
+            "ETag" in request.headers or "Last-Modified" in request.headers
+        ):
+            request.read()
+            request.close()
+            self.validators[url] = request
+        else:
+            self.validators.pop(url, None)
+        return request
+
+    def keep_login(self, request):
+        """Keep the tokens and cookies of a successful login response."""
+        body = request.json()
+        with self._auth_lock:
+            self.tokens = {
+                key: body[key]
+                for key in ("access_token", "refresh_token")
+                if body.get(key)
+            }
+            self.cookies = request.cookies()
+            self.user = body.get("user") or {}
+
+    def auth_headers(self):
+        headers = {}
+        if "access_token" in self.tokens:
+            headers["Authorization"] = f"Bearer {self.tokens['access_token']}"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(
+                f"{name}={value}" for name, value in self.cookies.items()
+            )
+        return headers
+
+    def refresh(self, access_token):
+        """Renew access_token with the refresh token, return if it was.
+
+        Probes failing together with the same token renew it only once.
+        """
+        with self._auth_lock:
+            if self.tokens.get("access_token") != access_token:
+                return True
+            refresh_token = self.tokens.get("refresh_token")
+            if not refresh_token:
+                return False
+            request = self.send(
+                f"{self.base_url}/api/auth/refresh-token",
+                headers={"Authorization": f"Bearer {refresh_token}"},
+            )
+            return self.renew(request)
+
+    def renew(self, request):
+        """Keep the access token of a refresh response, return if any."""
+        try:
+            token = request.json().get("access_token") if request else None
+        except ValueError:
+            token = None
+        if not token:
+            return False
+        self.tokens["access_token"] = token
+        self.cookies.update(request.cookies())
+        self.refreshes += 1
+        return True
+
+    def send_authenticated(
+        self, url, timeout=None, data=None, method=None, drain=False
+    ):
+        """GET url with the login tokens and cookies, measuring the body.
+
+        data and method are sent as by send(). An expired access token is
+        renewed before sending, a rejected one after, and the request is
+        sent again. With drain, the body is read past max_body.
+        """
+        access_token = self.tokens.get("access_token")
+        if access_token and token_expired(access_token):
+            self.refresh(access_token)
+            access_token = self.tokens.get("access_token")
+        request = self.send(url, data, timeout, self.auth_headers(), method)
+        if request.status_code == 401 and self.refresh(access_token):
+            request.close()
+            request = self.send(url, data, timeout, self.auth_headers(), method)
+        request.measure(drain)
+        return request
+
+    def call_api(self, path, data=None, method=None):
+        """Send an authenticated request to path, raise ValueError on errors."""
+        request = self.send_authenticated(
+            f"{self.base_url}{path}", data=data, method=method
+        )
+        if not request:
+            raise ValueError(
+                f"{method or 'GET'} {path} answered {request.status_code}\n"
+                + request.excerpt()
+            )
+        return request
+
+    def add_comment(self, task, text):
+        """Comment task with its current status, return the comment id."""
+        task_status_id = self.call_api(f"/api/data/tasks/{task}").json()[
+            "task_status_id"
+        ]
+        return self.call_api(
+            f"/api/actions/tasks/{task}/comment",
+            {"task_status_id": task_status_id, "comment": text},
+        ).json()["id"]
+
+    def add_preview(self, task, comment):
+        """Add a preview to a comment of task, return the preview file id."""
+        return self.call_api(
+            f"/api/actions/tasks/{task}/comments/{comment}/add-preview",
+            method="POST",
+        ).json()["id"]
+
+    def upload(self, url, chunks, size, filename="cgwire-checks.bin"):
+        """Stream chunks of size bytes as the file of a multipart POST.
+
+        Returns the seconds it took.
+        """
+        body = MultipartBody("file", filename, chunks, size)
+        headers = {
+            **self.auth_headers(),
+            "Content-Type": body.content_type,
+            "Content-Length": str(len(body)),
+        }
+        start = time.perf_counter()
+        response = self.transport.request(
+            "POST", url, headers=headers, timeout=self.timeouts(), content=body
+        )
+        for _ in response.iter_content(65536):
+            pass
+        elapsed = time.perf_counter() - start
+        if not response:
+            raise ValueError(f"upload answered {response.status_code}")
+        return elapsed
+
+    def download(self, url, headers=None):
+        """Stream url, return its status code, sha256, size and seconds."""
+        start = time.perf_counter()
+        response = self.transport.request(
+            "GET",
+            url,
+            headers={**self.auth_headers(), **(headers or {})},
+            timeout=self.timeouts(),
+        )
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in response.iter_content(GeneratedFile.chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        return response.status_code, digest.hexdigest(), size, elapsed
+
+    def check_storage(self, message_ok, message_ko, name=None):
+        """Upload a generated file as a preview of storage_task, download it.
+
+        The file of storage_size bytes is streamed as the preview of a new
+        comment on the task, then downloaded whole and as a range of its
+        middle, both checked against the sha256 of what was sent. Neither
+        direction holds the file in memory. The comment and its preview
+        are deleted afterwards. The throughputs are kept in self.storage.
+        """
+        task = self.storage_task
+        comment = None
+        try:
+            comment = self.add_comment(task, "cgwire-checks storage check")
+            preview = self.add_preview(task, comment)
+            generated = GeneratedFile(self.storage_size)
+            upload = self.upload(
+                f"{self.base_url}/api/pictures/preview-files/{preview}",
+                generated.chunks(),
+                generated.size,
+            )
+            url = (
+                f"{self.base_url}/api/pictures/originals/preview-files/"
+                f"{preview}/download"
+            )
+            status_code, digest, size, download = self.download(url)
+            if status_code != 200 or digest != generated.digest():
+                raise ValueError(
+                    f"download answered {status_code}, {size} bytes"
+                    " not matching the upload"
+                )
+            start = generated.size // 2
+            end = min(start + GeneratedFile.chunk_size, generated.size)
+            status_code, digest, size, _ = self.download(
+                url, {"Range": f"bytes={start}-{end - 1}"}
+            )
+            if status_code != 206 or digest != generated.digest(start, end):
+                raise ValueError(
+                    f"range download answered {status_code}, {size} bytes"
+                    " not matching the upload"
+                )
+        except self.transport.errors + (ValueError, KeyError, TypeError) as e:
+            self.status = 1
+            return f"{message_ko}\n{e}"
+        finally:
+            if comment is not None:
+                self.delete_comment(task, comment)
+        self.storage = {"size": generated.size, "upload": upload, "download": download}
+        details = (
+            f"{generated.size / 1000000:.1f} MB,"
+            f" upload {format_throughput(generated.size, upload)},"
+            f" download {format_throughput(generated.size, download)}"
+        )
+        return f"{message_ok} ({details})"
+
+    def wait_processing(self, preview):
+        """Poll the status of preview until it is ready or broken.
+
+        Polls back off from poll_interval to sleep seconds, for at most
+        processing_deadline seconds or until the run deadline. Returns
+        the last status and the perf_counter times the preview left the
+        queue and was done, None if it did not.
+        """
+        budget = self.processing_deadline
+        remaining = self.remaining()
+        if remaining is not None:
+            budget = min(budget, remaining)
+        deadline = time.perf_counter() + budget
+        interval = self.poll_interval
+        started = None
+        while True:
+            status = (
+                self.call_api(f"/api/data/preview-files/{preview}").json().get("status")
+            )
+            now = time.perf_counter()
+            if started is None and status not in QUEUED_STATUSES:
+                started = now
+            if status in ("ready", "broken"):
+                return status, started, now
+            if now >= deadline:
+                return status, started, None
+            delay, interval = backoff(interval, self.sleep)
+            time.sleep(min(delay, deadline - now))
+
+    def check_processing(self, message_ok, message_ko, name=None):
+        """Upload a generated video as a preview of processing_task, time it.
+
+        The preview waits in the job queue while its status is queued,
+        then is processed until it is ready. Zou versions that only report
+        processing count the queue wait as processing. The check fails
+        when the preview is broken, not ready in time, or when the total
+        time from the start of the upload is above the processing SLO.
+        The times are kept in self.processing.
+        """
+        task = self.processing_task
+        comment = None
+        try:
+            comment = self.add_comment(task, "cgwire-checks processing check")
+            preview = self.add_preview(task, comment)
+            video = generate_avi()
+            start = time.perf_counter()
+            self.upload(
+                f"{self.base_url}/api/pictures/preview-files/{preview}",
+                [video],
+                len(video),
+                "cgwire-checks.avi",
+            )
+            uploaded = time.perf_counter()
+            status, started, done = self.wait_processing(preview)
+        except self.transport.errors + (ValueError, KeyError, TypeError) as e:
+            self.status = 1
+            return f"{message_ko}\n{e}"
+        finally:
+            if comment is not None:
+                self.delete_comment(task, comment)
+        if done is None:
+            self.status = 1
+            return f"{message_ko}\nstill {status} after {self.processing_deadline}s"
+        self.processing = {
+            "upload_ms": (uploaded - start) * 1000,
+            "queue_ms": (started - uploaded) * 1000,
+            "processing_ms": (done - started) * 1000,
+            "total_ms": (done - start) * 1000,
+        }
+        details = ", ".join(
+            f"{phase} {self.processing[f'{phase}_ms']:.1f} ms"
+            for phase in ("upload", "queue", "processing", "total")
+        )
+        slo_ms = self.slo_ms.get("processing")
+        if status == "broken":
+            self.status = 1
+            return f"{message_ko} ({details})\npreview broken"
+        if slo_ms and self.processing["total_ms"] > slo_ms:
+            self.status = 1
+            return f"{message_ko} ({details})\nslower than {slo_ms} ms"
+        return f"{message_ok} ({details})"
+
+    def fetch_asset(self, path):
+        """Fetch the front asset path, offering brotli and gzip.
+
+        Returns its status code, its body size on the wire and decoded,
+        None if it can't be decoded, its Content-Encoding, Cache-Control
+        and ETag, and the ms it took to read it.
+        """
+        start = time.perf_counter()
+        response = self.transport.request(
+            "GET",
+            f"{self.base_url}{path}",
+            headers={"Accept-Encoding": "br, gzip"},
+            timeout=self.timeouts(),
+        )
+        encoding = response.headers.get("Content-Encoding", "").strip().lower()
+        decompress = body_decoder(encoding)
+        wire_bytes = decoded_bytes = 0
+        try:
+            for chunk in self.transport.iter_raw(response, 65536):
+                wire_bytes += len(chunk)
+                if decompress is not None:
+                    decoded_bytes += len(decompress(chunk))
+        finally:
+            response.close()
+        return {
+            "status_code": response.status_code,
+            "wire_bytes": wire_bytes,
+            "decoded_bytes": decoded_bytes if decompress is not None else None,
+            "encoding": encoding or "identity",
+            "cache_control": response.headers.get("Cache-Control", ""),
+            "etag": response.headers.get("ETag"),
+            "ms": (time.perf_counter() - start) * 1000,
+        }
+
+    def check_assets(self, message_ok, message_ko, name=None):
+        """Fetch the bundles of the front page concurrently, audit them.
+
+        Each script and stylesheet should be compressed, long-lived,
+        have an ETag and be at most asset_budget bytes on the wire, see
+        asset_problems, and all of them at most assets_budget bytes. The
+        results are kept in self.assets.
+        """
+        request = self.response(name)
+        if request is None:
+            return message_ko
+        paths = asset_paths(request.text, self.base_url)
+        if not paths:
+            self.status = 1
+            if request.truncated:
+                return (
+                    f"{message_ko}\nno scripts or stylesheets referenced in the"
+                    f" first {len(request.read())} bytes, page truncated"
+                )
+            return f"{message_ko}\nno scripts or stylesheets referenced"
+
+        def fetch(path):
+            try:
+                return self.fetch_asset(path)
+            except self.transport.errors + (zlib.error,) as e:
+                return {"status_code": None, "error": f"{e}"}
+
+        with futures.ThreadPoolExecutor(max_workers=min(len(paths), 8)) as executor:
+            self.assets = dict(zip(paths, executor.map(fetch, paths)))
+        lines = []
+        failed = False
+        for path, asset in self.assets.items():
+            if "error" in asset or asset["status_code"] != 200:
+                failed = True
+                error = asset.get("error") or f"answered {asset['status_code']}"
+                lines.append(f"🔥 {path}: {error}")
+                continue
+            problems = asset_problems(asset, self.asset_budget)
+            failed = failed or bool(problems)
+            lines.append(
+                f"{'🔥' if problems else '✅'} {path}:"
+                f" {format_size(asset['wire_bytes'])} {asset['encoding']},"
+                f" {format_size(asset['decoded_bytes'])} decoded,"
+                f" {asset['ms']:.1f} ms"
+                + "".join(f", {problem}" for problem in problems)
+            )
+        fetched = [
+            asset for asset in self.assets.values() if asset["status_code"] == 200
+        ]
+        wire_bytes = sum(asset["wire_bytes"] for asset in fetched)
+        decoded = [asset["decoded_bytes"] for asset in fetched]
+        details = f"{len(paths)} assets, {format_size(wire_bytes)} on the wire"
+        if None not in decoded:
+            details += f", {format_size(sum(decoded))} decoded"
+        if wire_bytes > self.assets_budget:
+            failed = True
+            lines.append(f"🔥 total above {self.assets_budget} bytes")
+        if failed:
+            self.status = 1
+        message = message_ko if failed else message_ok
+        return f"{message} ({details})\n" + "\n".join(lines)
+
+    def delete_comment(self, task, comment):
+        """Delete a comment of task and its previews, warn if it fails."""
+        try:
+            self.call_api(f"/api/data/tasks/{task}/comments/{comment}", method="DELETE")
+        except self.transport.errors + (ValueError,) as e:
+            print(f"🔥 Comment {comment} of task {task} not deleted: {e}")
+
+    def check_url(
+        self,
+        url,
+        message_ok,
+        message_ko,
+        data=None,
+        error_code=200,
+        name=None,
+        slo_ms=None,
+        timeout=None,
+        auth=False,
+    ):
+        """Request url and compare its status code with error_code.
+
+        The response is kept in self.request, or in self.responses[name]
+        when the check is named, so checks can run concurrently. GET
+        responses are shared through self.cache for the run. A response
+        slower than slo_ms fails the check. timeout overrides
+        self.timeouts() for this request. With auth, the request carries
+        the session of the last login and the size of its body is kept.
+        """
+        url = f"{self.base_url}{url}"
+        if auth:
+            send = functools.partial(self.send_authenticated, url, timeout)
+        else:
+            send = functools.partial(self.send, url, None, timeout)
+        try:
+            if data:
+                request = self.send(url, data, timeout)
+            else:
+                request = self.cache.get(ResponseCache.key("GET", url), send)
+        except self.transport.connection_errors + self.transport.timeout_errors:
+            self.status = 1
+            return message_ko
+        return self.check_response(
+            request, message_ok, message_ko, error_code, name, slo_ms
+        )
+
+    def check_response(
+        self, request, message_ok, message_ko, error_code=200, name=None, slo_ms=None
+    ):
+        if name is None:
+            self.request = request
+        else:
+            self.responses[name] = request
+
+        if request.status_code != error_code:
+            self.status = 1
+            return message_ko + "\n" + request.excerpt()
+        if slo_ms and request.timings.get("total", 0) > slo_ms:
+            self.status = 1
+            return f"{message_ko}\nslower than {slo_ms} ms"
+        return message_ok
+
+    def with_timings(self, message, name):
+        """Add the timings of the check name to the first line of message."""
+        request = self.responses.get(name)
+        if request is None or not request.timings:
+            return message
+        first, newline, rest = message.partition("\n")
+        details = format_timings(request.timings)
+        if request.size is not None:
+            details += f", {request.size} bytes"
+        return f"{first} ({details}){newline}{rest}"
+
+    def response(self, name=None):
+        """Return the response of the check name, or the last one."""
+        if name is None:
+            return self.request
+        return self.responses.get(name)
+
+    def check_if_last_request_is_a_kitsu(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        if request and request.contains("Kitsu"):
+            return message_ok
+        else:
+            return message_ko
+
+    def check_if_last_request_is_a_zou(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        api = ""
+        if request:
+            api = request.json().get("api", "")
+        if api == "Zou":
+            return message_ok
+        else:
+            return message_ko
+
+    def check_if_error(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        if request is None:
+            return message_ko
+
+        try:
+            error = request.json().get("error", False)
+        except ValueError:
+            return message_ko + "\n" + request.excerpt()
+
+        if error:
+            return message_ko + "\n" + request.excerpt()
+        else:
+            return message_ok
+
+    def check_login(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        if request is None:
+            return message_ko
+
+        try:
+            error = request.json().get("login", False)
+        except ValueError:
+            return message_ko + "\n" + request.excerpt()
+
+        if error:
+            self.keep_login(request)
+            return message_ok
+        else:
+            return message_ko + "\n" + request.excerpt()
+
+    def check_bad_login(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        if request is None:
+            return message_ko
+
+        try:
+            error = request.json().get("login", False)
+        except ValueError:
+            return message_ko + "\n" + request.excerpt()
+
+        if error:
+            return message_ko
+        else:
+            return message_ok
+
+    def check_kitsu_version(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        if request is None:
+            return message_ko
+        if request.text.rstrip() == self.kitsu_version:
+            return message_ok + self.kitsu_version
+        else:
+            return message_ko + "\n" + request.excerpt()
+
+    def check_zou_version(self, message_ok, message_ko, name=None):
+        request = self.response(name)
+        if request is None:
+            return message_ko
+
+        try:
+            version = request.json().get("version")
+        except ValueError:
+            return message_ko + "\n" + request.excerpt()
+
+        if version == self.zou_version:
+            return message_ok + self.zou_version
+        else:
+            return f"{message_ko}\n{version}"
+
+    def check_components(self, message_ok, message_ko, name=None):
+        """Check that every component of the Zou status is up.
+
+        The components are the keys of the status ending with -up, their
+        health is kept in self.components.
+        """
+        request = self.response(name)
+        if request is None:
+            return message_ko
+        try:
+            self.components = {
+                key[: -len("-up")]: bool(value)
+                for key, value in request.json().items()
+                if key.endswith("-up")
+            }
+        except (ValueError, AttributeError):
+            self.components = {}
+        if not self.components:
+            self.status = 1
+            return message_ko + "\n" + request.excerpt()
+        details = ", ".join(
+            f"{component} {'up' if up else 'down'}"
+            for component, up in sorted(self.components.items())
+        )
+        down = [component for component, up in self.components.items() if not up]
+        if down:
+            self.status = 1
+            return f"{message_ko} ({details})"
+        return f"{message_ok} ({details})"
+
+    def check_resources(self, message_ok, message_ko, name=None):
+        """Check the resource usage of the Zou host against resource_limits.
+
+        cpu and memory are percentages, cpu averaged over the cores, and
+        load is the load average of the last minute. The usage is kept in
+        self.resources.
+        """
+        request = self.response(name)
+        if request is None:
+            return message_ko
+        try:
+            self.resources = resource_usage(request.json())
+        except (ValueError, AttributeError):
+            self.resources = {}
+        if not self.resources:
+            self.status = 1
+            return message_ko + "\n" + request.excerpt()
+        details = ", ".join(
+            f"{resource} {value:.1f}{RESOURCE_UNITS[resource]}"
+            for resource, value in self.resources.items()
+        )
+        exceeded = [
+            f"{resource} above {self.resource_limits[resource]}"
+            f"{RESOURCE_UNITS[resource]}"
+            for resource, value in self.resources.items()
+            if self.resource_limits.get(resource) is not None
+            and value > self.resource_limits[resource]
+        ]
+        if exceeded:
+            self.status = 1
+            return f"{message_ko} ({details})\n" + "\n".join(exceeded)
+        return f"{message_ok} ({details})"
+
+    def events_trigger(self):
+        """Return the url, data, event name and event data of a harmless change.
+
+        The timezone of the logged in user is set to its current value,
+        which Zou announces with a person:update event.
+        """
+        if not self.user.get("id"):
+            raise ValueError("no user in the login response")
+        return (
+            f"/api/data/persons/{self.user['id']}",
+            {"timezone": self.user.get("timezone")},
+            "person:update",
+            {"person_id": self.user["id"]},
+        )
+
+    def check_events(self, message_ok, message_ko, name=None):
+        """Measure how long changes made through Zou take to arrive as events.
+
+        The events service is subscribed to with the session of the last
+        login, then events_samples changes are triggered one after the
+        other. An event not arriving within events_timeout seconds is
+        dropped. The check fails on a dropped event or when the p95
+        delivery latency is above the events SLO. The results are kept in
+        self.events.
+        """
+        client = EventsClient(self)
+        latencies = []
+        try:
+            connect_ms = client.connect(self.events_timeout)
+            url, data, event, event_data = self.events_trigger()
+            for _ in range(self.events_samples):
+                start = time.perf_counter()
+                request = self.send_authenticated(
+                    f"{self.base_url}{url}", data=data, method="PUT"
+                )
+                if not request:
+                    self.status = 1
+                    return message_ko + "\n" + request.excerpt()
+                latency = client.wait_event(
+                    event, event_data, start, self.events_timeout
+                )
+                if latency is not None:
+                    latencies.append(latency)
+        except self.transport.errors + (ValueError,) as e:
+            self.status = 1
+            return f"{message_ko}\n{e}"
+        finally:
+            client.close()
+        self.events = {
+            "connect_ms": connect_ms,
+            "latencies_ms": latencies,
+            "sent": self.events_samples,
+            "dropped": self.events_samples - len(latencies),
+        }
+        details = format_events(self.events)
+        slo_ms = self.slo_ms.get("events")
+        if self.events["dropped"]:
+            self.status = 1
+            return f"{message_ko} ({details})"
+        if slo_ms and latencies and percentile(latencies, 0.95) > slo_ms:
+            self.status = 1
+            return f"{message_ko} ({details})\np95 slower than {slo_ms} ms"
+        return f"{message_ok} ({details})"
+
+    def wait_budget(self):
+        """Seconds wait may take, by default retry * (timeout + sleep).
+
+        It never goes beyond the run deadline.
+        """
+        if self.wait_deadline is not None:
+            budget = self.wait_deadline
+        else:
+            budget = self.retry * (self.timeout + self.sleep)
+        remaining = self.remaining()
+        if remaining is not None:
+            budget = min(budget, remaining)
+        return budget
+
+    def wait_urls(self, urls):
+        if urls is None:
+            urls = self.readiness
+        elif isinstance(urls, str):
+            urls = {urls: urls}
+        return urls
+
+    def wait(self, urls=None):
+        """Wait until every readiness url answers 200, before the deadline.
+
+        urls maps component names to paths, self.readiness by default, or
+        is a single path. They are probed concurrently, starting every
+        poll_interval seconds and backing off with jitter up to sleep
+        seconds. The time each component took is kept in ready_times.
+        Returns True once all are ready, None at the deadline, which is
+        bounded by the run deadline.
+        """
+        self.start_deadline()
+        urls = self.wait_urls(urls)
+        start = time.monotonic()
+        deadline = start + self.wait_budget()
+        with futures.ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            ready = executor.map(
+                lambda url: self.wait_component(url, start, deadline), urls.values()
+            )
+            self.ready_times = dict(zip(urls, ready))
+        print("")
+        for component, ready_time in self.ready_times.items():
+            if ready_time is None:
+                print(f"🔥 {component} not ready")
+            else:
+                print(f"✅ {component} ready in {ready_time:.2f}s")
+        if None in self.ready_times.values():
+            return None
+        return True
+
+    def wait_component(self, url, start, deadline):
+        interval = self.poll_interval
+        while True:
+            timeout = self.timeouts(budget=deadline - time.monotonic())
+            try:
+                r = self.transport.request(
+                    "GET", f"{self.base_url}{url}", timeout=timeout, stream=False
+                )
+                if r.status_code == 200:
+                    return time.monotonic() - start
+            except self.transport.errors:
+                pass
+            print(".", end="", flush=True)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            delay, interval = backoff(interval, self.sleep)
+            time.sleep(min(delay, remaining))
+
+
+def import_httpx(http2=False):
+    """Return the httpx module, imported on first use.
+
+    AsyncCheckURL needs the async extra of cgwire-checks, the http2
+    transport its http2 extra, which also installs h2.
+    """
+    extra = "http2" if http2 else "async"
+    try:
+        import httpx
+
+        if http2:
+            import h2  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError(
+            f"{e.name} is missing, install the {extra} extra of cgwire-checks"
+        ) from e
+    return httpx
+
+
+class AsyncParsedResponse(ParsedResponse):
+    """ParsedResponse of an httpx response, false on 4xx and 5xx like requests."""
+
+    def __bool__(self):
+        return not self.response.is_error
+
+
+class AsyncCheckURL(CheckURL):
+    """Asyncio counterpart of CheckURL built on httpx.
+
+    check_url and wait are coroutines with the same messages and status
+    as CheckURL, at most concurrency requests are in flight at once and
+    every request is bounded by timeout.
+    """
+
+    def __init__(self, base_url):
+        super().__init__(base_url)
+        self.concurrency = 20
+        self.client = None
+        self._semaphore = None
+        self._refresh_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url, data=None, timeout=None, headers=None):
+        """Send a request to url under the semaphore and the timeout.
+
+        timeout overrides self.timeouts(), the whole request is bounded
+        by the larger of its connect and read timeouts. At most max_body
+        bytes of the body are read. Timings are taken from the httpx
+        trace extension, dns is part of connect.
+        """
+        import asyncio
+
+        httpx = import_httpx()
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size)
+            )
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        events = {}
+
+        async def trace(event, info):
+            events[event] = time.perf_counter()
+
+        async with self._semaphore:
+            connect, read = split_timeout(
+                self.timeouts() if timeout is None else timeout
+            )
+            async with asyncio.timeout(max(connect, read)):
+                start = time.perf_counter()
+                body = bytearray()
+                async with self.client.stream(
+                    "POST" if data else "GET",
+                    url,
+                    json=data or None,
+                    headers=headers,
+                    timeout=httpx.Timeout(read, connect=connect),
+                    extensions={"trace": trace},
+                ) as response:
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) > self.max_body:
+                            break
+                timings = {"total": (time.perf_counter() - start) * 1000}
+        for key, step in (
+            ("connect", "connection.connect_tcp"),
+            ("tls", "connection.start_tls"),
+        ):
+            if f"{step}.complete" in events:
+                timings[key] = (
+                    events[f"{step}.complete"] - events[f"{step}.started"]
+                ) * 1000
+        for event, value in events.items():
+            if event.endswith("receive_response_headers.complete"):
+                timings["ttfb"] = (value - start) * 1000
+        request = AsyncParsedResponse(
+            response,
+            timings,
+            self.max_body,
+            self.excerpt_size,
+            bytes(body[: self.max_body]),
+        )
+        request.truncated = len(body) > self.max_body
+        return request
+
+    async def refresh(self, access_token):
+        import asyncio
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if self.tokens.get("access_token") != access_token:
+                return True
+            refresh_token = self.tokens.get("refresh_token")
+            if not refresh_token:
+                return False
+            request = await self.get(
+                f"{self.base_url}/api/auth/refresh-token",
+                headers={"Authorization": f"Bearer {refresh_token}"},
+            )
+            return self.renew(request)
+
+    async def get_authenticated(self, url, timeout=None):
+        access_token = self.tokens.get("access_token")
+        if access_token and token_expired(access_token):
+            await self.refresh(access_token)
+            access_token = self.tokens.get("access_token")
+        request = await self.get(url, None, timeout, self.auth_headers())
+        if request.status_code == 401 and await self.refresh(access_token):
+            request = await self.get(url, None, timeout, self.auth_headers())
+        request.measure()
+        return request
+
+    async def check_events(self, message_ok, message_ko, name=None):
+        """Run CheckURL.check_events in a thread, it holds long polls."""
+        import asyncio
+
+        return await asyncio.to_thread(
+            super().check_events, message_ok, message_ko, name
+        )
+
+    async def check_storage(self, message_ok, message_ko, name=None):
+        """Run CheckURL.check_storage in a thread, it streams large bodies."""
+        import asyncio
+
+        return await asyncio.to_thread(
+            super().check_storage, message_ok, message_ko, name
+        )
+
+    async def check_assets(self, message_ok, message_ko, name=None):
+        """Run CheckURL.check_assets in a thread, it fetches concurrently."""
+        import asyncio
+
+        return await asyncio.to_thread(
+            super().check_assets, message_ok, message_ko, name
+        )
+
+    async def check_processing(self, message_ok, message_ko, name=None):
+        """Run CheckURL.check_processing in a thread, it polls with sleeps."""
+        import asyncio
+
+        return await asyncio.to_thread(
+            super().check_processing, message_ok, message_ko, name
+        )
+
+    async def check_url(
+        self,
+        url,
+        message_ok,
+        message_ko,
+        data=None,
+        error_code=200,
+        name=None,
+        slo_ms=None,
+        timeout=None,
+        auth=False,
+    ):
+        httpx = import_httpx()
+        url = f"{self.base_url}{url}"
+        try:
+            if auth:
+                request = await self.get_authenticated(url, timeout)
+            else:
+                request = await self.get(url, data, timeout)
+        except (httpx.TransportError, TimeoutError):
+            self.status = 1
+            return message_ko
+        return self.check_response(
+            request, message_ok, message_ko, error_code, name, slo_ms
+        )
+
+    async def wait(self, urls=None):
+        import asyncio
+
+        self.start_deadline()
+        urls = self.wait_urls(urls)
+        start = time.monotonic()
+        deadline = start + self.wait_budget()
+        ready = await asyncio.gather(
+            *(self.wait_component(url, start, deadline) for url in urls.values())
+        )
+        self.ready_times = dict(zip(urls, ready))
+        print("")
+        if None in ready:
+            return None
+        return True
+
+    async def wait_component(self, url, start, deadline):
+        import asyncio
+
+        httpx = import_httpx()
+        interval = self.poll_interval
+        while True:
+            try:
+                async with asyncio.timeout(max(deadline - time.monotonic(), 0.001)):
+                    r = await self.get(f"{self.base_url}{url}")
+                if r.status_code == 200:
+                    return time.monotonic() - start
+            except (httpx.TransportError, TimeoutError):
+                pass
+            print(".", end="", flush=True)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            delay, interval = backoff(interval, self.sleep)
+            await asyncio.sleep(min(delay, remaining))
+
+
+class Check:
+    """A check of the suite, run once the checks it requires are done.
+
+    A check with an url requests it through CheckURL.check_url, a check
+    with an assertion calls that CheckURL method on the response of its
+    first requirement. timeout overrides the timeouts of the checker for
+    its request, a number or a (connect, read) pair. An auth check sends
+    its request with the session of the last login. A read_body check
+    reads its whole body, up to max_body, before the checks requiring it
+    run, as assertions stop reading once they found what they look for.
+    """
+
+    def __init__(
+        self,
+        name,
+        message_ok,
+        message_ko,
+        url=None,
+        data=None,
+        error_code=200,
+        assertion=None,
+        requires=(),
+        slo_ms=None,
+        timeout=None,
+        auth=False,
+        read_body=False,
+    ):
+        self.name = name
+        self.message_ok = message_ok
+        self.message_ko = message_ko
+        self.url = url
+        self.data = data
+        self.error_code = error_code
+        self.assertion = assertion
+        self.requires = tuple(requires)
+        self.slo_ms = slo_ms
+        self.timeout = timeout
+        self.auth = auth
+        self.read_body = read_body
+
+    def run(self, checker, budget=None):
+        if self.assertion:
+            message = getattr(checker, self.assertion)(
+                self.message_ok, self.message_ko, name=self.requires[0]
+            )
+            request = checker.response(self.requires[0])
+            error = getattr(request, "error", None)
+            if error is not None and not self.passed(message):
+                checker.status = 1
+                message += f"\nbody read failed: {error!r}"
+            return message
+        message = checker.check_url(
+            self.url,
+            self.message_ok,
+            self.message_ko,
+            self.data,
+            self.error_code,
+            name=self.name,
+            slo_ms=self.slo_ms,
+            timeout=checker.timeouts(self.timeout, budget),
+            auth=self.auth,
+        )
+        if hasattr(message, "__await__"):
+            return self._with_timings(checker, message)
+        request = checker.response(self.name)
+        if self.read_body and request is not None:
+            request.read()
+        return checker.with_timings(message, self.name)
+
+    async def _with_timings(self, checker, message):
+        return checker.with_timings(await message, self.name)
+
+    def passed(self, message):
+        return message.startswith(self.message_ok)
+
+    def skip(self, failed):
+        return f"{self.message_ko} (skipped, {', '.join(failed)} failed)"
+
+    def timed_out(self):
+        return f"{self.message_ko} (timed out)"
+
+    def raised(self, error):
+        return f"{self.message_ko}\n{error!r}"
+
+
+def check_requirements(checks):
+    """Raise ValueError if a check requires one not declared before it."""
+    names = set()
+    for check in checks:
+        for required in check.requires:
+            if required not in names:
+                raise ValueError(f"{check.name} requires unknown check {required}")
+        names.add(check.name)
+
+
+def run_checks(checker, checks, workers=8):
+    """Run checks on a thread pool and yield their messages in order.
+
+    Checks run as soon as all their requirements passed, the ones
+    requiring a failed check are skipped.
+
+    Under a run deadline, a request check gets an equal share of the
+    time left for the request checks still to run, workers at a time.
+    Once the deadline passes, all outstanding checks are timed out.
+    """
+    check_requirements(checks)
+    checker.start_deadline()
+    messages = {}
+    passed = {}
+    waiting = list(checks)
+    running = {}
+    index = 0
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        while waiting or running:
+            for check in list(waiting):
+                if not all(required in passed for required in check.requires):
+                    continue
+                waiting.remove(check)
+                failed = [r for r in check.requires if not passed[r]]
+                if failed:
+                    messages[check.name] = check.skip(failed)
+                    passed[check.name] = False
+                else:
+                    budget = run_budget(checker, [check, *waiting], workers)
+                    running[executor.submit(check.run, checker, budget)] = check
+
+            while index < len(checks) and checks[index].name in messages:
+                yield messages[checks[index].name]
+                index += 1
+
+            if running:
+                done, _ = futures.wait(
+                    running,
+                    timeout=checker.remaining(),
+                    return_when=futures.FIRST_COMPLETED,
+                )
+                if not done:
+                    for check in [*running.values(), *waiting]:
+                        messages[check.name] = check.timed_out()
+                    checker.status = 1
+                    running.clear()
+                    waiting.clear()
+                for future in done:
+                    check = running.pop(future)
+                    try:
+                        messages[check.name] = future.result()
+                    except Exception as e:
+                        # A failing check must not hide the results of the others
+                        messages[check.name] = check.raised(e)
+                        checker.status = 1
+                    passed[check.name] = check.passed(messages[check.name])
+    finally:
+        # Timed out requests end in the background, bounded by their timeouts
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for check in checks[index:]:
+        yield messages[check.name]
+
+
+def run_budget(checker, pending, workers):
+    """Seconds a request check may take, None without a run deadline.
+
+    The time left is split evenly across the pending request checks,
+    workers of them running at a time.
+    """
+    remaining = checker.remaining()
+    if remaining is None:
+        return None
+    requests = sum(check.url is not None for check in pending)
+    return remaining / math.ceil(max(requests, 1) / workers)
+
+
+async def run_checks_async(checker, checks):
+    """Run checks as asyncio tasks and yield their messages in order.
+
+    Same as run_checks for an AsyncCheckURL, the concurrency is bounded
+    by its semaphore. Once the run deadline passes, all outstanding
+    checks are timed out.
+    """
+    import asyncio
+
+    check_requirements(checks)
+    checker.start_deadline()
+    tasks = {}
+
+    async def run(check):
+        results = [await tasks[required] for required in check.requires]
+        failed = [r for r, (_, ok) in zip(check.requires, results) if not ok]
+        if failed:
+            return check.skip(failed), False
+        message = check.run(checker)
+        if hasattr(message, "__await__"):
+            message = await message
+        return message, check.passed(message)
+
+    for check in checks:
+        tasks[check.name] = asyncio.ensure_future(run(check))
+    try:
+        for index, check in enumerate(checks):
+            try:
+                message, _ = await asyncio.wait_for(
+                    asyncio.shield(tasks[check.name]), checker.remaining()
+                )
+            except TimeoutError:
+                checker.status = 1
+                for check in checks[index:]:
+                    yield check.timed_out()
+                return
+            yield message
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+
+DEEP_PROBES = (
+    ("08a", "authenticated", "/api/auth/authenticated"),
+    ("08b", "user context", "/api/data/user/context"),
+    ("08c", "open projects", "/api/data/projects/open"),
+    ("08d", "persons", "/api/data/persons"),
+)
+
+
+def default_checks(checker):
+    """Return the checks 01a..07b of a Kitsu instance.
+
+    The front, api, login and data entries of checker.slo_ms are the
+    latency budgets of the matching request checks, checker.check_timeouts
+    overrides the timeouts of checks by name. With checker.deep_probes,
+    the checks 08a..08d request heavier Zou routes with the session of
+    the login of 03a. With checker.events_probe, check 09a measures the
+    delivery of events by the events service, against the events SLO.
+    With checker.storage_task, check 10a measures the preview storage
+    throughput on that task. With checker.processing_task, check 11a
+    times the processing of a video preview on that task, against the
+    processing SLO. With checker.health_probe, checks 12a..13b check the
+    components and the resource usage reported by Zou. With
+    checker.assets_probe, check 01c audits the delivery of the front
+    bundles.
+    """
+    front_slo_ms = checker.slo_ms.get("front")
+    api_slo_ms = checker.slo_ms.get("api")
+    login_slo_ms = checker.slo_ms.get("login")
+    checks = [
+        # Check Kitsu
+        Check(
+            "01a",
+            "✅ 01a Check Kitsu /",
+            "🔥 01a Check Kitsu /",
+            url="/",
+            slo_ms=front_slo_ms,
+        ),
+        Check(
+            "01b",
+            "✅ 01b  Check if it's really a Kitsu",
+            "🔥 01b  Check if it's really a Kitsu",
+            assertion="check_if_last_request_is_a_kitsu",
+            requires=["01a"],
+        ),
+        # Check Kitsu API (Zou)
+        Check(
+            "02a",
+            "✅ 02a Check Kitsu API /api",
+            "🔥 02a Check Kitsu API /api",
+            url="/api",
+            slo_ms=api_slo_ms,
+        ),
+        Check(
+            "02b",
+            "✅ 02b  Check if it's really a Kitsu API",
+            "🔥 02b  Check if it's really a Kitsu API",
+            assertion="check_if_last_request_is_a_zou",
+            requires=["02a"],
+        ),
+        # Check good login
+        Check(
+            "03a",
+            "✅ 03a Check login /api/auth/login",
+            "🔥 03a Check login /api/auth/login",
+            url="/api/auth/login",
+            data={"email": "admin@example.com", "password": "mysecretpassword"},
+            slo_ms=login_slo_ms,
+        ),
+        Check(
+            "03b",
+            "✅ 03b  Check login /api/auth/login (check error status)",
+            "🔥 03b  Check login /api/auth/login (check error status)",
+            assertion="check_if_error",
+            requires=["03a"],
+        ),
+        Check(
+            "03c",
+            "✅ 03c  Check login /api/auth/login (check login status)",
+            "🔥 03c  Check login /api/auth/login (check login status)",
+            assertion="check_login",
+            requires=["03a"],
+        ),
+        # Check bad pass
+        Check(
+            "04a",
+            "✅ 04a Check login /api/auth/login",
+            "🔥 04a Check login /api/auth/login",
+            url="/api/auth/login",
+            data={"email": "admin@example.com", "password": "badpass"},
+            error_code=400,
+            slo_ms=login_slo_ms,
+        ),
+        Check(
+            "04b",
+            "✅ 04b  Check login /api/auth/login (check login status)",
+            "🔥 04b  Check login /api/auth/login (check login status)",
+            assertion="check_bad_login",
+            requires=["04a"],
+        ),
+        # Check with a bad account
+        Check(
+            "05a",
+            "✅ 05a Check login /api/auth/login",
+            "🔥 05a Check login /api/auth/login",
+            url="/api/auth/login",
+            data={"email": "not-a-user@example.com", "password": "badpass"},
+            error_code=400,
+            slo_ms=login_slo_ms,
+        ),
+        Check(
+            "05b",
+            "✅ 05b  Check login /api/auth/login (check login status)",
+            "🔥 05b  Check login /api/auth/login (check login status)",
+            assertion="check_bad_login",
+            requires=["05a"],
+        ),
+        # Check Kitsu version
+        Check(
+            "06a",
+            "✅ 06a Kitsu version",
+            "🔥 06a Kitsu version",
+            url="/.version.txt",
+            slo_ms=front_slo_ms,
+        ),
+    ]
+    if checker.kitsu_version:
+        checks.append(
+            Check(
+                "06b",
+                f"✅ 06b Kitsu version {checker.kitsu_version} == ",
+                f"🔥 06b Kitsu {checker.kitsu_version} != ",
+                assertion="check_kitsu_version",
+                requires=["06a"],
+            )
+        )
+    # Check Zou version
+    checks.append(
+        Check(
+            "07a",
+            "✅ 07a Zou version",
+            "🔥 07a Zou version",
+            url="/api",
+            slo_ms=api_slo_ms,
+        )
+    )
+    if checker.zou_version:
+        checks.append(
+            Check(
+                "07b",
+                f"✅ 07b Zou version {checker.zou_version} == ",
+                f"🔥 07b Zou {checker.zou_version} != ",
+                assertion="check_zou_version",
+                requires=["07a"],
+            )
+        )
+    if checker.assets_probe:
+        # Audit the front bundles, next to the other checks of /, whose
+        # body 01b would otherwise stop reading once it found Kitsu
+        checks[0].read_body = True
+        checks.insert(
+            2,
+            Check(
+                "01c",
+                "✅ 01c  Check front assets",
+                "🔥 01c  Check front assets",
+                assertion="check_assets",
+                requires=["01a"],
+            ),
+        )
+    if checker.deep_probes:
+        # Check authenticated routes
+        for name, label, url in DEEP_PROBES:
+            checks.append(
+                Check(
+                    name,
+                    f"✅ {name} Check {label} {url}",
+                    f"🔥 {name} Check {label} {url}",
+                    url=url,
+                    requires=["03c"],
+                    slo_ms=checker.slo_ms.get("data"),
+                    auth=True,
+                )
+            )
+    if checker.events_probe:
+        # Check events service
+        checks.append(
+            Check(
+                "09a",
+                "✅ 09a Check events /socket.io",
+                "🔥 09a Check events /socket.io",
+                assertion="check_events",
+                requires=["03c"],
+            )
+        )
+    if checker.storage_task:
+        # Check preview storage
+        checks.append(
+            Check(
+                "10a",
+                "✅ 10a Check storage /api/pictures/preview-files",
+                "🔥 10a Check storage /api/pictures/preview-files",
+                assertion="check_storage",
+                requires=["03c"],
+            )
+        )
+    if checker.processing_task:
+        # Check preview processing
+        checks.append(
+            Check(
+                "11a",
+                "✅ 11a Check preview processing /api/data/preview-files",
+                "🔥 11a Check preview processing /api/data/preview-files",
+                assertion="check_processing",
+                requires=["03c"],
+            )
+        )
+    if checker.health_probe:
+        # Check Zou components and resources
+        checks += [
+            Check(
+                "12a",
+                "✅ 12a Check status /api/status",
+                "🔥 12a Check status /api/status",
+                url="/api/status",
+                slo_ms=api_slo_ms,
+            ),
+            Check(
+                "12b",
+                "✅ 12b  Check components",
+                "🔥 12b  Check components",
+                assertion="check_components",
+                requires=["12a"],
+            ),
+            Check(
+                "13a",
+                "✅ 13a Check resources /api/status/resources",
+                "🔥 13a Check resources /api/status/resources",
+                url="/api/status/resources",
+            ),
+            Check(
+                "13b",
+                "✅ 13b  Check resource usage",
+                "🔥 13b  Check resource usage",
+                assertion="check_resources",
+                requires=["13a"],
+            ),
+        ]
+    for check in checks:
+        check.timeout = checker.check_timeouts.get(check.name)
+    return checks
+
+
+def detected_versions(checker):
+    """Return the Kitsu and Zou versions answered to checks 06a and 07a."""
+    kitsu_version = zou_version = None
+    request = checker.responses.get("06a")
+    if request is not None and request.status_code == 200:
+        kitsu_version = request.text.strip() or None
+    request = checker.responses.get("07a")
+    if request is not None and request.status_code == 200:
+        try:
+            zou_version = request.json().get("version")
+        except (ValueError, AttributeError):
+            pass
+    return kitsu_version, zou_version
+
+
+def run_suite(checker, workers=8, metrics=None, history=None):
+    """Run the default checks and yield their messages.
+
+    Once all of them are done, the results are recorded in metrics and
+    in history, then the latency regressions history detects are
+    yielded and set the status to REGRESSION if all checks passed.
+    """
+    checks = default_checks(checker)
+    messages = []
+    for message in run_checks(checker, checks, workers):
+        messages.append(message)
+        yield message
+    if metrics is not None:
+        metrics.observe(checker, checks, messages)
+    if history is not None:
+        history.record(checker, checks, messages)
+        regressions = history.regressions(checker.base_url)
+        for regression in regressions:
+            yield format_regression(regression)
+        if regressions and checker.status == 0:
+            checker.status = REGRESSION
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    return ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+
+
+class Metrics:
+    """Check results and latencies in the Prometheus text format.
+
+    Results are kept per target, durations of the request checks are
+    accumulated in histograms across runs.
+    """
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.success = {}
+        self.durations = {}
+        self.sizes = {}
+        self.ready = {}
+        self.versions = {}
+        self.status = {}
+        self.events = {}
+        self.storage = {}
+        self.processing = {}
+        self.components = {}
+        self.resources = {}
+        self.assets = {}
+        self._lock = threading.Lock()
+
+    def observe(self, checker, checks, messages):
+        """Record the messages of checks run by checker."""
+        target = checker.base_url
+        observed = set()
+        with self._lock:
+            self.status[target] = checker.status
+            for check, message in zip(checks, messages):
+                self.success[(target, check.name)] = int(check.passed(message))
+                request = checker.responses.get(check.name) if check.url else None
+                if request is None or "total" not in request.timings:
+                    continue
+                if request.size is not None:
+                    self.sizes[(target, check.name)] = request.size
+                # 07a shares the cached response of 02a
+                if id(request) in observed:
+                    continue
+                observed.add(id(request))
+                self.observe_duration((target, check.name), request.timings["total"])
+            self.versions[target] = detected_versions(checker)
+            if checker.events is not None:
+                self.events[target] = checker.events
+            if checker.storage is not None:
+                self.storage[target] = checker.storage
+            if checker.processing is not None:
+                self.processing[target] = checker.processing
+            for component, up in checker.components.items():
+                self.components[(target, component)] = int(up)
+            for resource, value in checker.resources.items():
+                self.resources[(target, resource)] = value
+            for path, asset in (checker.assets or {}).items():
+                if asset["status_code"] == 200:
+                    self.assets[(target, path)] = asset
+
+    def observe_duration(self, key, milliseconds):
+        seconds = milliseconds / 1000
+        histogram = self.durations.setdefault(
+            key, {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+        )
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+    def observe_wait(self, checker):
+        """Record the time-to-ready of the components checker waited for."""
+        with self._lock:
+            for component, seconds in checker.ready_times.items():
+                self.ready[(checker.base_url, component)] = seconds
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            metric("kitsu_check_success", "gauge", "Whether the check passed.")
+            for (target, check), value in sorted(self.success.items()):
+                labels = format_labels([("target", target), ("check", check)])
+                lines.append(f"kitsu_check_success{{{labels}}} {value}")
+
+            metric(
+                "kitsu_check_duration_seconds",
+                "histogram",
+                "Duration of the check requests.",
+            )
+            for (target, check), histogram in sorted(self.durations.items()):
+                labels = [("target", target), ("check", check)]
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    bucket = format_labels(labels + [("le", bound)])
+                    lines.append(
+                        f"kitsu_check_duration_seconds_bucket{{{bucket}}} {count}"
+                    )
+                bucket = format_labels(labels + [("le", "+Inf")])
+                lines.append(
+                    f"kitsu_check_duration_seconds_bucket{{{bucket}}} {histogram['count']}"
+                )
+                labels = format_labels(labels)
+                lines.append(
+                    f"kitsu_check_duration_seconds_sum{{{labels}}} {histogram['sum']}"
+                )
+                lines.append(
+                    f"kitsu_check_duration_seconds_count{{{labels}}} {histogram['count']}"
+                )
+
+            metric(
+                "kitsu_check_response_bytes",
+                "gauge",
+                "Body size of the authenticated probes.",
+            )
+            for (target, check), size in sorted(self.sizes.items()):
+                labels = format_labels([("target", target), ("check", check)])
+                lines.append(f"kitsu_check_response_bytes{{{labels}}} {size}")
+
+            metric(
+                "kitsu_component_ready",
+                "gauge",
+                "Whether the component was ready before the wait deadline.",
+            )
+            for (target, component), seconds in sorted(self.ready.items()):
+                labels = format_labels([("target", target), ("component", component)])
+                lines.append(
+                    f"kitsu_component_ready{{{labels}}} {int(seconds is not None)}"
+                )
+            metric(
+                "kitsu_component_ready_seconds",
+                "gauge",
+                "Time the component took to be ready.",
+            )
+            for (target, component), seconds in sorted(self.ready.items()):
+                if seconds is not None:
+                    labels = format_labels(
+                        [("target", target), ("component", component)]
+                    )
+                    lines.append(f"kitsu_component_ready_seconds{{{labels}}} {seconds}")
+
+            metric(
+                "kitsu_events_connect_seconds",
+                "gauge",
+                "Time to connect to the events service.",
+            )
+            for target, events in sorted(self.events.items()):
+                labels = format_labels([("target", target)])
+                lines.append(
+                    f"kitsu_events_connect_seconds{{{labels}}}"
+                    f" {events['connect_ms'] / 1000}"
+                )
+            metric(
+                "kitsu_events_latency_seconds",
+                "summary",
+                "Delivery latency of the events of the last probe.",
+            )
+            for target, events in sorted(self.events.items()):
+                latencies = events["latencies_ms"]
+                for q in (0.5, 0.95, 1) if latencies else ():
+                    labels = format_labels([("target", target), ("quantile", q)])
+                    lines.append(
+                        f"kitsu_events_latency_seconds{{{labels}}}"
+                        f" {percentile(latencies, q) / 1000}"
+                    )
+                labels = format_labels([("target", target)])
+                lines.append(
+                    f"kitsu_events_latency_seconds_sum{{{labels}}}"
+                    f" {sum(latencies) / 1000}"
+                )
+                lines.append(
+                    f"kitsu_events_latency_seconds_count{{{labels}}} {len(latencies)}"
+                )
+            metric(
+                "kitsu_events_dropped",
+                "gauge",
+                "Events of the last probe that did not arrive.",
+            )
+            for target, events in sorted(self.events.items()):
+                labels = format_labels([("target", target)])
+                lines.append(f"kitsu_events_dropped{{{labels}}} {events['dropped']}")
+
+            metric(
+                "kitsu_storage_throughput_bytes_per_second",
+                "gauge",
+                "Throughput of the last preview upload and download.",
+            )
+            for target, storage in sorted(self.storage.items()):
+                for direction in ("upload", "download"):
+                    labels = format_labels(
+                        [("target", target), ("direction", direction)]
+                    )
+                    throughput = storage["size"] / max(storage[direction], 1e-9)
+                    lines.append(
+                        f"kitsu_storage_throughput_bytes_per_second{{{labels}}}"
+                        f" {throughput}"
+                    )
 
-    def check_url(self, url, message_ok, message_ko, data=None, error_code=200):
-        try:
-            if data:
-                self.request = requests.post(
-                    f"{self.base_url}{url}", json=data, timeout=self.timeout
+            metric(
+                "kitsu_preview_processing_seconds",
+                "gauge",
+                "Time of the phases of the last preview processing.",
+            )
+            for target, processing in sorted(self.processing.items()):
+                for phase in ("upload", "queue", "processing", "total"):
+                    labels = format_labels([("target", target), ("phase", phase)])
+                    lines.append(
+                        f"kitsu_preview_processing_seconds{{{labels}}}"
+                        f" {processing[f'{phase}_ms'] / 1000}"
+                    )
+
+            metric(
+                "kitsu_component_up",
+                "gauge",
+                "Whether the component is up according to Zou.",
+            )
+            for (target, component), up in sorted(self.components.items()):
+                labels = format_labels([("target", target), ("component", component)])
+                lines.append(f"kitsu_component_up{{{labels}}} {up}")
+            metric(
+                "kitsu_resource_usage",
+                "gauge",
+                "CPU and memory percentages and load average of the Zou host.",
+            )
+            for (target, resource), value in sorted(self.resources.items()):
+                labels = format_labels([("target", target), ("resource", resource)])
+                lines.append(f"kitsu_resource_usage{{{labels}}} {value}")
+            metric(
+                "kitsu_asset_bytes",
+                "gauge",
+                "Size of the front bundles on the wire and decoded.",
+            )
+            for (target, path), asset in sorted(self.assets.items()):
+                for kind in ("wire", "decoded"):
+                    if asset[f"{kind}_bytes"] is None:
+                        continue
+                    labels = format_labels(
+                        [("target", target), ("asset", path), ("kind", kind)]
+                    )
+                    lines.append(
+                        f"kitsu_asset_bytes{{{labels}}} {asset[f'{kind}_bytes']}"
+                    )
+
+            metric("kitsu_info", "gauge", "Kitsu and Zou versions of the target.")
+            for target, (kitsu_version, zou_version) in sorted(self.versions.items()):
+                labels = format_labels(
+                    [
+                        ("target", target),
+                        ("kitsu_version", kitsu_version or ""),
+                        ("zou_version", zou_version or ""),
+                    ]
                 )
-            else:
-                self.request = requests.get(
-                    f"{self.base_url}{url}", timeout=self.timeout
+                lines.append(f"kitsu_info{{{labels}}} 1")
+
+            metric("kitsu_checker_status", "gauge", "Error code of the last run.")
+            for target, status in sorted(self.status.items()):
+                labels = format_labels([("target", target)])
+                lines.append(f"kitsu_checker_status{{{labels}}} {status}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics for the node exporter textfile collector."""
+        with open(f"{path}.tmp", "w") as f:
+            f.write(self.render())
+        os.replace(f"{path}.tmp", path)
+
+
+def serve_metrics(metrics, port, address="", collect=None):
+    """Serve metrics on /metrics from a thread, return the server.
+
+    collect, if given, is called before rendering each scrape.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            if collect is not None:
+                collect()
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+REGRESSION = 2
+
+
+def regression(new, base, min_samples=5, min_increase=0.2, threshold=3):
+    """Return the z-score of a latency regression from base to new, or None.
+
+    The median of new must be min_increase above the median of base and
+    threshold robust standard errors away from it, the spread of base
+    being its median absolute deviation.
+    """
+    if len(base) < min_samples or not new:
+        return None
+    new_median = statistics.median(new)
+    base_median = statistics.median(base)
+    if new_median < base_median * (1 + min_increase):
+        return None
+    mad = statistics.median(abs(value - base_median) for value in base)
+    # Identical samples still have the resolution of the timings
+    spread = max(1.4826 * mad, base_median * 0.01, 0.1)
+    z = (new_median - base_median) / spread * math.sqrt(len(new))
+    return z if z >= threshold else None
+
+
+def format_regression(regression):
+    check, versions, new, previous, base, z = regression
+    return (
+        f"🐢 {check} slower on Kitsu {versions[0]} / Zou {versions[1]}:"
+        f" {new:.1f} ms, was {base:.1f} ms on Kitsu {previous[0]}"
+        f" / Zou {previous[1]} (z {z:.1f})"
+    )
+
+
+class History:
+    """Results of past runs in a SQLite database, to detect regressions.
+
+    Each run keeps the outcome and total time of every check, with the
+    target and the Kitsu and Zou versions it detected. The latencies of
+    the last window runs on the current versions of a target are compared
+    with those of its last window runs on the previous versions.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            target TEXT NOT NULL,
+            time REAL NOT NULL,
+            kitsu_version TEXT,
+            zou_version TEXT,
+            status INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS runs_target ON runs (target, id);
+        CREATE TABLE IF NOT EXISTS results (
+            run INTEGER NOT NULL REFERENCES runs (id),
+            check_name TEXT NOT NULL,
+            passed INTEGER NOT NULL,
+            total_ms REAL,
+            PRIMARY KEY (run, check_name)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, window=20, **thresholds):
+        import sqlite3
+
+        self.window = window
+        self.thresholds = thresholds
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.db:
+            self.db.executescript(self.schema)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, checker, checks, messages):
+        """Append the results of a run of checks, return its id."""
+        kitsu_version, zou_version = detected_versions(checker)
+        rows = []
+        observed = set()
+        for check, message in zip(checks, messages):
+            request = checker.responses.get(check.name) if check.url else None
+            total = None
+            # 07a shares the cached response of 02a
+            if request is not None and id(request) not in observed:
+                observed.add(id(request))
+                total = request.timings.get("total")
+            rows.append((check.name, int(check.passed(message)), total))
+        with self._lock, self.db:
+            run = self.db.execute(
+                "INSERT INTO runs (target, time, kitsu_version, zou_version, status)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    checker.base_url,
+                    time.time(),
+                    kitsu_version,
+                    zou_version,
+                    checker.status,
+                ),
+            ).lastrowid
+            self.db.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?)",
+                [(run, *row) for row in rows],
+            )
+        return run
+
+    def runs(self, target, versions, limit):
+        """Ids of the last limit runs of target on versions."""
+        return [
+            row[0]
+            for row in self.db.execute(
+                "SELECT id FROM runs WHERE target = ? AND kitsu_version IS ?"
+                " AND zou_version IS ? ORDER BY id DESC LIMIT ?",
+                (target, *versions, limit),
+            )
+        ]
+
+    def latencies(self, runs):
+        """Total times of the passed checks of runs, by check."""
+        latencies = {}
+        placeholders = ", ".join("?" * len(runs))
+        for check, total in self.db.execute(
+            f"SELECT check_name, total_ms FROM results WHERE run IN ({placeholders})"
+            " AND passed AND total_ms IS NOT NULL",
+            runs,
+        ):
+            latencies.setdefault(check, []).append(total)
+        return latencies
+
+    def regressions(self, target):
+        """Return the checks of target that got slower with its versions.
+
+        A regression is (check, versions, new median, previous versions,
+        previous median, z-score), see regression() for the test.
+        """
+        with self._lock:
+            last = self.db.execute(
+                "SELECT kitsu_version, zou_version FROM runs WHERE target = ?"
+                " ORDER BY id DESC LIMIT 1",
+                (target,),
+            ).fetchone()
+            if last is None:
+                return []
+            previous = self.db.execute(
+                "SELECT kitsu_version, zou_version FROM runs WHERE target = ?"
+                " AND NOT (kitsu_version IS ? AND zou_version IS ?)"
+                " ORDER BY id DESC LIMIT 1",
+                (target, *last),
+            ).fetchone()
+            if previous is None:
+                return []
+            new = self.latencies(self.runs(target, last, self.window))
+            base = self.latencies(self.runs(target, previous, self.window))
+        regressions = []
+        for check in sorted(new):
+            z = regression(new[check], base.get(check, []), **self.thresholds)
+            if z is not None:
+                regressions.append(
+                    (
+                        check,
+                        tuple(last),
+                        statistics.median(new[check]),
+                        tuple(previous),
+                        statistics.median(base[check]),
+                        z,
+                    )
                 )
+        return regressions
+
+
+def check_groups(checks):
+    """Split checks into a request check and the checks requiring it."""
+    groups = {}
+    group_of = {}
+    for check in checks:
+        group = group_of[check.requires[0]] if check.requires else check.name
+        group_of[check.name] = group
+        groups.setdefault(group, []).append(check)
+    return list(groups.values())
+
+
+CONDITIONAL = {"/", "/.version.txt"}
+
+
+def watch(
+    checker, interval=60, fail_interval=10, workers=8, metrics=None, history=None
+):
+    """Run the default checks forever, yielding the messages of each cycle.
 
-            if self.request.status_code == error_code:
-                return message_ok
+    A group of checks that passed runs again after interval seconds, a
+    failing one after fail_interval seconds until it recovers. The
+    session and the validators of conditional requests, of CONDITIONAL
+    unless checker.conditional is set, are kept between cycles.
+    checker.status tells if a group is failing or, if none is, if
+    history detected a regression.
+    """
+    if not checker.conditional:
+        checker.conditional = set(CONDITIONAL)
+    groups = check_groups(default_checks(checker))
+    due = {group[0].name: 0 for group in groups}
+    failing = set()
+    while True:
+        now = time.monotonic()
+        checks = [
+            check for group in groups if due[group[0].name] <= now for check in group
+        ]
+        checker.reset()
+        messages = list(run_checks(checker, checks, workers))
+        if metrics is not None:
+            metrics.observe(checker, checks, messages)
+        regressions = []
+        if history is not None:
+            history.record(checker, checks, messages)
+            regressions = history.regressions(checker.base_url)
+        passed = {
+            check.name: check.passed(message)
+            for check, message in zip(checks, messages)
+        }
+        for group in groups:
+            name = group[0].name
+            if due[name] > now:
+                continue
+            if all(passed[check.name] for check in group):
+                failing.discard(name)
+                due[name] = now + interval
             else:
-                self.status = 1
-                return message_ko + "\n" + self.request.text
-        except requests.exceptions.ConnectionError:
-            self.status = 1
-            return message_ko
+                failing.add(name)
+                due[name] = now + fail_interval
+        checker.status = int(bool(failing))
+        if regressions and not failing:
+            checker.status = REGRESSION
+        yield messages + [format_regression(regression) for regression in regressions]
+        time.sleep(max(min(due.values()) - time.monotonic(), 0))
 
-    def check_if_last_request_is_a_kitsu(self, message_ok, message_ko):
-        if self.request and "Kitsu" in self.request.text:
-            return message_ok
-        else:
-            return message_ko
 
-    def check_if_last_request_is_a_zou(self, message_ok, message_ko):
-        api = ""
-        if self.request:
-            api = self.request.json().get("api", "")
-        if api == "Zou":
-            return message_ok
-        else:
-            return message_ko
+def login_step(checker, concurrency, duration):
+    """Log in from concurrency threads for duration seconds.
 
-    def check_if_error(self, message_ok, message_ko):
-        if self.request is None:
-            return message_ko
+    Each thread repeats the login of checks 03a and 03c. Returns the
+    latencies in ms of the logins that passed, the number of failed
+    ones and the seconds the step took.
+    """
+    checks = {check.name: check for check in default_checks(checker)}
+    login, login_status = checks["03a"], checks["03c"]
+    # Building the transport imports its library, which is not timed
+    checker.transport
+    start = time.perf_counter()
+    end = start + duration
+
+    def worker(index):
+        # Each thread keeps its responses apart from the others
+        name = f"{login.name}-{index}"
+        latencies = []
+        failed = 0
+        while time.perf_counter() < end:
+            sent = time.perf_counter()
+            message = checker.check_url(
+                login.url,
+                login.message_ok,
+                login.message_ko,
+                login.data,
+                login.error_code,
+                name=name,
+                timeout=checker.timeouts(login.timeout),
+            )
+            latency = (time.perf_counter() - sent) * 1000
+            if login.passed(message) and login_status.passed(
+                checker.check_login(
+                    login_status.message_ok, login_status.message_ko, name=name
+                )
+            ):
+                latencies.append(latency)
+            else:
+                failed += 1
+        checker.responses.pop(name, None)
+        return latencies, failed
+
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    latencies = [latency for passed, _ in results for latency in passed]
+    return latencies, sum(failed for _, failed in results), time.perf_counter() - start
 
+
+def find_capacity(checker, levels, duration=10, max_error_rate=0.01, max_p95_ms=1000):
+    """Ramp concurrent logins through levels, yield the result of each step.
+
+    A step logs in with as many threads as its concurrency for duration
+    seconds, see login_step. The ramp stops after the first step whose
+    error rate or p95 latency is above its limit. A result has the
+    concurrency, the logins per second that passed, their p50, p95 and
+    max latencies in ms, the error rate and whether it is sustainable.
+
+    The connection pool of checker is grown to the highest level, so
+    each thread keeps its connection alive.
+    """
+    if checker.pool_size < max(levels):
+        checker.pool_size = max(levels)
+        # The transport is built again with the larger pool
+        checker.close()
+    for concurrency in levels:
+        latencies, failed, elapsed = login_step(checker, concurrency, duration)
+        total = len(latencies) + failed
+        step = {
+            "concurrency": concurrency,
+            "throughput": len(latencies) / elapsed,
+            "error_rate": failed / total if total else 1,
+        }
+        for label, q in (("p50", 0.5), ("p95", 0.95), ("max", 1)):
+            step[f"{label}_ms"] = percentile(latencies, q) if latencies else None
+        step["sustainable"] = step["error_rate"] <= max_error_rate and (
+            step["p95_ms"] is not None and step["p95_ms"] <= max_p95_ms
+        )
+        yield step
+        if not step["sustainable"]:
+            return
+
+
+def format_capacity_step(step):
+    latencies = ", ".join(
+        f"{label} {step[f'{label}_ms']:.1f} ms"
+        for label in ("p50", "p95", "max")
+        if step[f"{label}_ms"] is not None
+    )
+    return (
+        f"{'✅' if step['sustainable'] else '🔥'} Concurrency"
+        f" {step['concurrency']}: {step['throughput']:.1f} logins/s,"
+        f" {latencies + ', ' if latencies else ''}"
+        f"{step['error_rate']:.1%} errors"
+    )
+
+
+class SoakWindow:
+    """Latencies, failed checks and resource usage of a soak time window.
+
+    start and length are in seconds from the start of the soak. The
+    resources are sums of the usage figures and how many were sampled.
+    """
+
+    def __init__(self, start, length):
+        self.start = start
+        self.length = length
+        self.latency = Histogram()
+        self.checks = 0
+        self.failed = 0
+        self.resources = {}
+
+    def record(self, checker, checks, messages):
+        """Count a run of checks and the total time of their requests."""
+        observed = set()
+        for check, message in zip(checks, messages):
+            self.checks += 1
+            if not check.passed(message):
+                self.failed += 1
+            request = checker.responses.get(check.name) if check.url else None
+            # 07a shares the cached response of 02a
+            if request is None or id(request) in observed:
+                continue
+            observed.add(id(request))
+            if "total" in request.timings:
+                self.latency.add(request.timings["total"])
+
+    def sample(self, usage):
+        for resource, value in usage.items():
+            total, count = self.resources.get(resource, (0, 0))
+            self.resources[resource] = (total + value, count + 1)
+
+    def merge(self, other):
+        self.length = other.start + other.length - self.start
+        self.latency.merge(other.latency)
+        self.checks += other.checks
+        self.failed += other.failed
+        for resource, (total, count) in other.resources.items():
+            mine = self.resources.get(resource, (0, 0))
+            self.resources[resource] = (mine[0] + total, mine[1] + count)
+
+    def usage(self):
+        """Return the mean usage of each resource sampled."""
+        return {
+            resource: total / count
+            for resource, (total, count) in self.resources.items()
+        }
+
+
+def merge_windows(windows):
+    merged = SoakWindow(windows[0].start, windows[0].length)
+    for window in windows:
+        merged.merge(window)
+    return merged
+
+
+def format_soak_window(window):
+    details = [f"{window.checks} checks", f"{window.failed} failed"]
+    for label, q in (("p50", 0.5), ("p95", 0.95), ("max", 1)):
+        value = window.latency.quantile(q)
+        if value is not None:
+            details.append(f"{label} {value:.1f} ms")
+    details += [
+        f"{resource} {value:.1f}{RESOURCE_UNITS[resource]}"
+        for resource, value in window.usage().items()
+    ]
+    return (
+        f"{'🔥' if window.failed else '✅'} Soak"
+        f" {datetime.timedelta(seconds=round(window.start))}"
+        f" +{window.length:.0f}s: " + ", ".join(details)
+    )
+
+
+class Soak:
+    """Replay of the checks 01a..07b at a fixed request rate.
+
+    The checks run in cycles spaced so their requests average rate per
+    second, for duration seconds. Each window seconds, the latencies of
+    the requests are kept in a histogram and the resource usage of the
+    Zou host is sampled. Past max_windows windows, pairs of windows are
+    merged and the next ones last twice as long, so the memory of a soak
+    does not grow with its duration.
+
+    The drift compares the first and last quarters of the soak. It fails
+    when the p95 latency increased by more than max_drift, or when the
+    usage of a resource rose by more than its max_resource_drift.
+    """
+
+    def __init__(
+        self,
+        checker,
+        duration,
+        rate=1,
+        window=60,
+        workers=8,
+        max_windows=60,
+        max_drift=0.2,
+        max_resource_drift=None,
+    ):
+        self.checker = checker
+        self.duration = duration
+        self.rate = rate
+        self.window = window
+        self.workers = workers
+        self.max_windows = max_windows
+        self.max_drift = max_drift
+        if max_resource_drift is None:
+            max_resource_drift = {"memory": 5}
+        self.max_resource_drift = max_resource_drift
+        self.windows = []
+
+    def usage(self):
+        """Return the resource usage of the Zou host, {} if unavailable."""
+        url = f"{self.checker.base_url}/api/status/resources"
         try:
-            error = self.request.json().get("error", False)
-        except requests.exceptions.JSONDecodeError:
-            return message_ko + "\n" + self.request.text
+            request = self.checker.send(url)
+            if request.status_code != 200:
+                return {}
+            return resource_usage(request.json())
+        except self.checker.transport.errors + (ValueError, AttributeError):
+            return {}
 
-        if error:
-            return message_ko + "\n" + self.request.text
-        else:
-            return message_ok
+    def close(self, window, now):
+        window.length = now - window.start
+        window.sample(self.usage())
+        self.windows.append(window)
+        if len(self.windows) >= self.max_windows:
+            self.windows = [
+                merge_windows(self.windows[i : i + 2])
+                for i in range(0, len(self.windows), 2)
+            ]
+            self.window *= 2
+        return window
 
-    def check_login(self, message_ok, message_ko):
-        if self.request is None:
-            return message_ko
+    def run(self):
+        """Run the soak, yielding each window when it ends."""
+        checks = [check for check in default_checks(self.checker) if check.name < "08"]
+        # GET checks of the same url share one cached request per cycle
+        gets = {check.url for check in checks if check.url and not check.data}
+        posts = [check for check in checks if check.url and check.data]
+        interval = (len(gets) + len(posts)) / self.rate
+        start = time.monotonic()
+        window = SoakWindow(0, self.window)
+        next_cycle = 0
+        while next_cycle < self.duration:
+            time.sleep(max(start + next_cycle - time.monotonic(), 0))
+            self.checker.reset()
+            messages = list(run_checks(self.checker, checks, self.workers))
+            window.record(self.checker, checks, messages)
+            now = time.monotonic() - start
+            # A late cycle delays the next ones instead of bursting
+            next_cycle = max(next_cycle + interval, now)
+            if now >= window.start + window.length or next_cycle >= self.duration:
+                yield self.close(window, now)
+                window = SoakWindow(now, self.window)
+
+    def report(self):
+        """Return the drift messages and the failed checks of the soak.
 
+        Sets checker.status when a drift is above its limit or a check
+        failed, or when no window was recorded.
+        """
+        if not self.windows:
+            self.checker.status = 1
+            return ["🔥 Soak: no window recorded"]
+        quarter = max(len(self.windows) // 4, 1)
+        first = merge_windows(self.windows[:quarter])
+        last = merge_windows(self.windows[-quarter:])
+        failed = sum(window.failed for window in self.windows)
+        checks = sum(window.checks for window in self.windows)
+        status = int(bool(failed))
+        messages = []
+        before, after = first.latency.quantile(0.95), last.latency.quantile(0.95)
+        if before and after:
+            drift = after / before - 1
+            ok = drift <= self.max_drift
+            status |= not ok
+            messages.append(
+                f"{'✅' if ok else '🔥'} Soak latency p95 {before:.1f} ms"
+                f" → {after:.1f} ms ({drift:+.1%})"
+            )
+        first_usage, last_usage = first.usage(), last.usage()
+        for resource, before in first_usage.items():
+            if resource not in last_usage:
+                continue
+            drift = last_usage[resource] - before
+            limit = self.max_resource_drift.get(resource)
+            ok = limit is None or drift <= limit
+            status |= not ok
+            unit = RESOURCE_UNITS[resource]
+            messages.append(
+                f"{'✅' if ok else '🔥'} Soak {resource} {before:.1f}{unit}"
+                f" → {last_usage[resource]:.1f}{unit} ({drift:+.1f})"
+            )
+        messages.append(
+            f"{'🔥' if failed else '✅'} Soak checks: {failed} failed out of {checks}"
+        )
+        self.checker.status = status
+        return messages
+
+
+def json_path(body, path):
+    """Return the value at path in body, dot separated keys and indexes."""
+    for key in path.split("."):
+        body = body[int(key)] if isinstance(body, list) else body[key]
+    return body
+
+
+class Step:
+    """A request of a journey, sent by a virtual user.
+
+    url and the string values of data are formatted with the values kept
+    by the previous steps of the journey. keep maps names to the paths of
+    values in the JSON body of the response, see json_path, an optional
+    step leaves out the values missing from the body instead of failing.
+    A step is skipped when one of the values it requires was not kept.
+    assertion is a CheckURL assertion called on the response. An auth
+    step carries the session of the last login of its virtual user.
+    """
+
+    def __init__(
+        self,
+        name,
+        url,
+        method="GET",
+        data=None,
+        error_code=200,
+        assertion=None,
+        keep=None,
+        auth=True,
+        optional=False,
+        requires=(),
+    ):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.data = data
+        self.error_code = error_code
+        self.assertion = assertion
+        self.keep = keep or {}
+        self.auth = auth
+        self.optional = optional
+        self.requires = requires
+
+    def run(self, user, values):
+        """Send the step as user, return if it passed, None if it was skipped.
+
+        The values it keeps are added to values.
+        """
+        if any(name not in values for name in self.requires):
+            return None
+        try:
+            url = user.base_url + self.url.format_map(values)
+            data = self.data and {
+                key: value.format_map(values) if isinstance(value, str) else value
+                for key, value in self.data.items()
+            }
+        except KeyError:
+            return False
         try:
-            error = self.request.json().get("login", False)
-        except requests.exceptions.JSONDecodeError:
-            return message_ko + "\n" + self.request.text
+            if self.auth:
+                request = user.send_authenticated(url, data=data, method=self.method)
+            else:
+                request = user.send(url, data, method=self.method)
+        except user.transport.errors:
+            return False
+        message = user.check_response(
+            request, "✅", "🔥", self.error_code, name=self.name
+        )
+        if message == "✅" and self.assertion:
+            message = getattr(user, self.assertion)("✅", "🔥", name=self.name)
+        if message != "✅":
+            return False
+        try:
+            body = request.json() if self.keep else None
+        except ValueError:
+            return False
+        for name, path in self.keep.items():
+            try:
+                values[name] = json_path(body, path)
+            except (KeyError, IndexError, TypeError):
+                if not self.optional:
+                    return False
+        return True
 
-        if error:
-            return message_ok
-        else:
-            return message_ko + "\n" + self.request.text
 
-    def check_bad_login(self, message_ok, message_ko):
-        if self.request is None:
-            return message_ko
+def default_journey(checker):
+    """Return the steps of an artist reviewing the tasks to check.
+
+    The artist logs in with the credentials of check 03a, loads its
+    context and the open projects, comments the first task to check,
+    deletes the comment so the journey leaves no trace, and logs out.
+    Without a task to check, the comment steps are skipped.
+    """
+    login = next(check for check in default_checks(checker) if check.name == "03a")
+    return [
+        Step(
+            "login",
+            login.url,
+            "POST",
+            login.data,
+            assertion="check_login",
+            auth=False,
+        ),
+        Step("context", "/api/data/user/context"),
+        Step("projects", "/api/data/projects/open"),
+        Step(
+            "tasks",
+            "/api/data/user/tasks-to-check",
+            keep={"task": "0.id", "task_status": "0.task_status_id"},
+            optional=True,
+        ),
+        Step(
+            "comment",
+            "/api/actions/tasks/{task}/comment",
+            "POST",
+            {"task_status_id": "{task_status}", "comment": "cgwire-checks journey"},
+            error_code=201,
+            keep={"comment": "id"},
+            requires=("task", "task_status"),
+        ),
+        Step(
+            "uncomment",
+            "/api/data/tasks/{task}/comments/{comment}",
+            "DELETE",
+            error_code=204,
+            requires=("comment",),
+        ),
+        Step("logout", "/api/auth/logout"),
+    ]
+
+
+def read_journey(file):
+    """Parse the steps of a journey from a JSON list of Step arguments."""
+    return [Step(**step) for step in json.load(file)]
+
+
+def virtual_user(checker):
+    """Return a checker with the settings of checker, and its own session.
+
+    A virtual user has its own tokens, cache and connections, as the
+    browser of a user would.
+    """
+    user = copy.copy(checker)
+    user.status = 0
+    user.request = None
+    user.responses = {}
+    user.cache = ResponseCache(checker.cache.ttl, checker.cache.size)
+    user.validators = {}
+    user.not_modified = 0
+    user.tokens = {}
+    user.cookies = {}
+    user.user = {}
+    user.refreshes = 0
+    user._auth_lock = threading.Lock()
+    user._transport = None
+    user._transport_lock = threading.Lock()
+    return user
+
+
+class JourneyStats:
+    """Latencies of the steps and journeys of virtual users, mergeable.
+
+    The latency of a journey is the sum of the latencies of its steps,
+    without the think time.
+    """
+
+    def __init__(self, steps):
+        self.steps = {step.name: Histogram() for step in steps}
+        self.failed = dict.fromkeys(self.steps, 0)
+        self.skipped = dict.fromkeys(self.steps, 0)
+        self.journeys = Histogram()
+        self.failed_journeys = 0
+
+    def merge(self, other):
+        for name, histogram in other.steps.items():
+            self.steps[name].merge(histogram)
+            self.failed[name] += other.failed[name]
+            self.skipped[name] += other.skipped[name]
+        self.journeys.merge(other.journeys)
+        self.failed_journeys += other.failed_journeys
+
+    def report(self, elapsed):
+        """Return a message per step and for the journeys, over elapsed seconds."""
 
+        def line(label, histogram, failed, skipped=0):
+            details = [f"{histogram.count} passed", f"{failed} failed"]
+            if skipped:
+                details.append(f"{skipped} skipped")
+            details.append(f"{histogram.count / elapsed:.1f}/s")
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("max", 1)):
+                value = histogram.quantile(q)
+                if value is not None:
+                    details.append(f"{name} {value:.1f} ms")
+            return f"{'🔥' if failed else '✅'} {label}: " + ", ".join(details)
+
+        messages = [
+            line(
+                f"Journey step {name}",
+                histogram,
+                self.failed[name],
+                self.skipped[name],
+            )
+            for name, histogram in self.steps.items()
+        ]
+        messages.append(line("Journeys", self.journeys, self.failed_journeys))
+        return messages
+
+
+def run_journeys(checker, steps, users=10, duration=60, think_time=(1, 3)):
+    """Run the journey of steps with users virtual users for duration seconds.
+
+    Each virtual user repeats the journey, sleeping a random think time
+    after each step, within the think_time range in seconds. A journey
+    stops at its first failed step. The journeys still running at the
+    end are finished without think time, so that they clean up after
+    themselves. Returns the JourneyStats of the users and the
+    seconds they ran.
+    """
+    start = time.perf_counter()
+    end = start + duration
+
+    def think():
+        delay = min(random.uniform(*think_time), end - time.perf_counter())
+        time.sleep(max(delay, 0))
+
+    def run_user(index):
+        user = virtual_user(checker)
+        stats = JourneyStats(steps)
         try:
-            error = self.request.json().get("login", False)
-        except requests.exceptions.JSONDecodeError:
-            return message_ko + "\n" + self.request.text
+            while time.perf_counter() < end:
+                values = {}
+                total = 0
+                for step in steps:
+                    sent = time.perf_counter()
+                    passed = step.run(user, values)
+                    if passed is None:
+                        stats.skipped[step.name] += 1
+                        continue
+                    latency = (time.perf_counter() - sent) * 1000
+                    # Users think after a failed step too, then start over
+                    think()
+                    if not passed:
+                        stats.failed[step.name] += 1
+                        stats.failed_journeys += 1
+                        break
+                    stats.steps[step.name].add(latency)
+                    total += latency
+                else:
+                    stats.journeys.add(total)
+            return stats
+        finally:
+            user.close()
 
-        if error:
-            return message_ko
-        else:
-            return message_ok
+    stats = JourneyStats(steps)
+    with futures.ThreadPoolExecutor(max_workers=users) as executor:
+        for user_stats in executor.map(run_user, range(users)):
+            stats.merge(user_stats)
+    return stats, time.perf_counter() - start
 
-    def check_kitsu_version(self, message_ok, message_ko):
-        if self.request is None:
-            return message_ko
-        if self.request.text.rstrip() == self.kitsu_version:
-            return message_ok + self.kitsu_version
-        else:
-            return message_ko + "\n" + self.request.text
 
-    def check_zou_version(self, message_ok, message_ko):
-        if self.request is None:
-            return message_ko
+def asset_paths(html, base_url):
+    """Return the paths of the scripts and stylesheets html references.
+
+    Module preloads count as scripts. The paths are relative to base_url,
+    assets of other origins are left out.
+    """
+    import urllib.parse
+    from html.parser import HTMLParser
 
+    base = urllib.parse.urlsplit(base_url.rstrip("/") + "/")
+    paths = []
+
+    class AssetParser(HTMLParser):
+        def handle_starttag(self, tag, attrs):
+            attrs = dict(attrs)
+            rel = set((attrs.get("rel") or "").lower().split())
+            if tag == "script" and attrs.get("src"):
+                url = attrs["src"]
+            elif tag == "link" and attrs.get("href") and rel & ASSET_RELS:
+                url = attrs["href"]
+            else:
+                return
+            parts = urllib.parse.urlsplit(urllib.parse.urljoin(base.geturl(), url))
+            if parts.netloc != base.netloc or not parts.path.startswith(base.path):
+                return
+            path = "/" + parts.path[len(base.path) :]
+            if parts.query:
+                path += f"?{parts.query}"
+            if path not in paths:
+                paths.append(path)
+
+    AssetParser().feed(html)
+    return paths
+
+
+ASSET_RELS = {"stylesheet", "modulepreload"}
+WARM_ROUTES = tuple(url for _, _, url in DEEP_PROBES if url.startswith("/api/data/"))
+
+
+def is_warm(latencies, window, tolerance):
+    """Tell if the spread of the last window latencies is within tolerance.
+
+    The tolerance is relative to their median, with 5 ms at least.
+    """
+    last = latencies[-window:]
+    if len(last) < window:
+        return False
+    return max(last) - min(last) <= max(statistics.median(last) * tolerance, 5)
+
+
+def warm_up(checker, routes, workers=8, window=3, tolerance=0.2, max_rounds=20):
+    """Fetch routes concurrently, round after round, until they are warm.
+
+    The routes are requested with the session of the login of checks
+    03a and 03c, their bodies read to the end, past max_body. A warm
+    route, see is_warm, or one answering an error is left out of the next
+    rounds. Returns per route its first latency, the median of its last
+    window latencies, the rounds it took, its last status code and body
+    size, and if it is warm.
+    """
+    login = [check for check in default_checks(checker) if check.name in ("03a", "03c")]
+    list(run_checks(checker, login, workers))
+    latencies = {route: [] for route in routes}
+    rounds = dict.fromkeys(routes, 0)
+    status_codes = dict.fromkeys(routes)
+    sizes = dict.fromkeys(routes)
+    done = set()
+
+    def fetch(route):
+        start = time.perf_counter()
         try:
-            version = self.request.json().get("version")
-        except requests.exceptions.JSONDecodeError:
-            return message_ko + "\n" + self.request.text
+            request = checker.send_authenticated(
+                f"{checker.base_url}{route}", drain=True
+            )
+        except checker.transport.errors:
+            return None, None, None
+        latency = (time.perf_counter() - start) * 1000
+        return request.status_code, latency, request.size
 
-        if version == self.zou_version:
-            return message_ok + self.zou_version
-        else:
-            return message_ko + "\n" + self.request.json().get("version")
+    for _ in range(max_rounds):
+        pending = [route for route in routes if route not in done]
+        if not pending:
+            break
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = list(executor.map(fetch, pending))
+        for route, (status_code, latency, size) in zip(pending, fetched):
+            rounds[route] += 1
+            status_codes[route] = status_code
+            sizes[route] = size
+            if status_code not in (200, 304):
+                done.add(route)
+                continue
+            latencies[route].append(latency)
+            if is_warm(latencies[route], window, tolerance):
+                done.add(route)
+    return {
+        route: {
+            "cold_ms": latencies[route][0] if latencies[route] else None,
+            "warm_ms": (
+                statistics.median(latencies[route][-window:])
+                if latencies[route]
+                else None
+            ),
+            "rounds": rounds[route],
+            "status_code": status_codes[route],
+            "size": sizes[route],
+            "warm": status_codes[route] in (200, 304)
+            and is_warm(latencies[route], window, tolerance),
+        }
+        for route in routes
+    }
 
-    def wait(self, url):
-        status = 0
-        retry = self.retry
-        while status != 1 and retry > 0:
+
+def format_warm_up(route, result):
+    if result["status_code"] is None:
+        return f"🔥 Warm-up {route}: no answer"
+    if result["status_code"] not in (200, 304):
+        return f"🔥 Warm-up {route}: answered {result['status_code']}"
+    details = (
+        f"cold {result['cold_ms']:.1f} ms, warm {result['warm_ms']:.1f} ms"
+        f" after {result['rounds']} rounds"
+    )
+    if not result["warm"]:
+        return f"🔥 Warm-up {route}: {details}, not stable"
+    return f"✅ Warm-up {route}: {details}"
+
+
+def read_targets(lines):
+    """Parse fleet targets from an iterable of lines, lazily.
+
+    A target is either "url [kitsu_version [zou_version]]" or a JSON
+    object with url, kitsu_version and zou_version keys. Blank lines and
+    lines starting with # are ignored. A malformed line is yielded as a
+    target with the line as url and an error, see check_target.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
             try:
-                r = requests.get(f"{self.base_url}{url}", timeout=self.timeout)
-                print(".", end="", flush=True)
-                if r.status_code == 200:
-                    print("")
-                    return True
-            except requests.exceptions.ConnectionError:
-                print(".", end="", flush=True)
-                retry -= 1
-            except requests.exceptions.ReadTimeout:
-                print(".", end="", flush=True)
-                retry -= 1
-            time.sleep(self.sleep)
-        return None
+                target = json.loads(line)
+            except ValueError as e:
+                yield {"url": line, "error": f"invalid JSON: {e}"}
+                continue
+            if not isinstance(target, dict) or not isinstance(target.get("url"), str):
+                yield {"url": line, "error": "no url"}
+                continue
+            yield target
+        else:
+            yield dict(zip(("url", "kitsu_version", "zou_version"), line.split()))
+
+
+def check_target(target, workers=8, options=None):
+    """Run the default checks against a fleet target.
+
+    options are CheckURL attributes set before the run. Returns a
+    picklable dict with the url, status, messages, failed checks and the
+    negotiated protocols. A target with an error, or failing before its
+    checks ran, has the single failed check "error".
+    """
+
+    def failed(url, error):
+        return {
+            "url": url,
+            "status": 1,
+            "messages": [f"🔥 {url} {error}"],
+            "failed": ["error"],
+            "protocols": {},
+        }
+
+    if "error" in target:
+        return failed(target.get("url"), target["error"])
+    checker = None
+    try:
+        checker = CheckURL(target["url"])
+        checker.kitsu_version = target.get("kitsu_version")
+        checker.zou_version = target.get("zou_version")
+        for key, value in (options or {}).items():
+            setattr(checker, key, value)
+        checks = default_checks(checker)
+        messages = list(run_checks(checker, checks, workers))
+        protocols = checker.protocols()
+    except Exception as e:
+        return failed(checker.base_url if checker else target.get("url"), f"{e!r}")
+    finally:
+        if checker is not None:
+            checker.close()
+    return {
+        "url": checker.base_url,
+        "status": checker.status,
+        "messages": messages,
+        "protocols": protocols,
+        "failed": [
+            check.name
+            for check, message in zip(checks, messages)
+            if not check.passed(message)
+        ],
+    }
+
+
+def run_fleet(targets, processes=None, concurrency=None, workers=8, options=None):
+    """Check targets on a process pool and yield results as they finish.
+
+    At most concurrency targets are read ahead of the finished ones, so
+    memory stays flat whatever the number of targets.
+    """
+    processes = processes or os.cpu_count()
+    concurrency = concurrency or 2 * processes
+    targets = iter(targets)
+    running = set()
+    with futures.ProcessPoolExecutor(processes) as executor:
+        while True:
+            for target in targets:
+                running.add(executor.submit(check_target, target, workers, options))
+                if len(running) >= concurrency:
+                    break
+            if not running:
+                return
+            done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def report_fleet(results):
+    """Print fleet results as they come, then the failed targets.
+
+    The number of targets that negotiated each protocol is printed too.
+    Returns the aggregated error code.
+    """
+    status = 0
+    count = 0
+    failures = []
+    protocols = {}
+    for result in results:
+        count += 1
+        status = max(status, result["status"])
+        for protocol in result.get("protocols", ()):
+            protocols[protocol] = protocols.get(protocol, 0) + 1
+        if result["failed"]:
+            failures.append((result["url"], result["failed"]))
+            print(f"🔥 {result['url']} {', '.join(result['failed'])}", flush=True)
+        else:
+            print(f"✅ {result['url']}", flush=True)
+    for protocol, targets in sorted(protocols.items()):
+        print(f"{protocol}: {targets}/{count} targets")
+    print(f"Failed targets: {len(failures)}/{count}")
+    for url, failed in failures:
+        print(f"🔥 {url} {', '.join(failed)}")
+    return status
 
 
 if __name__ == "__main__":  # pragma: nocover
@@ -144,133 +4350,270 @@ if __name__ == "__main__":  # pragma: nocover
     timeout = os.getenv("TIMEOUT", None)
     retry = os.getenv("RETRY", None)
     sleep = os.getenv("SLEEP", None)
+    workers = int(os.getenv("WORKERS", 8))
+    t.transport_name = os.getenv("TRANSPORT", t.transport_name)
+    if t.transport_name not in TRANSPORTS:
+        print(f"🔥 Unknown transport {t.transport_name}: {', '.join(TRANSPORTS)}")
+        sys.exit(1)
+    t.h2c = os.getenv("H2C", "0") != "0"
+    t.pool_size = int(os.getenv("POOL_SIZE", t.pool_size))
+    t.max_retries = int(os.getenv("MAX_RETRIES", t.max_retries))
+    t.keep_alive = os.getenv("KEEP_ALIVE", "1") != "0"
+    try:
+        # Fails now rather than in the first check when a library is missing,
+        # the transport of the checker is built later with its final settings
+        TRANSPORTS[t.transport_name](t).close()
+    except RuntimeError as e:
+        print(f"🔥 Transport {t.transport_name}: {e}")
+        sys.exit(1)
+    t.cache.ttl = float(os.getenv("CACHE_TTL", t.cache.ttl))
+    t.cache.size = int(os.getenv("CACHE_SIZE", t.cache.size))
+    t.max_body = int(os.getenv("MAX_BODY", t.max_body))
+    t.excerpt_size = int(os.getenv("EXCERPT_SIZE", t.excerpt_size))
+    t.deep_probes = os.getenv("DEEP_PROBES", "0") != "0"
+    t.events_probe = os.getenv("EVENTS_PROBE", "0") != "0"
+    t.health_probe = os.getenv("HEALTH_PROBE", "0") != "0"
+    t.assets_probe = os.getenv("ASSETS_PROBE", "0") != "0"
+    t.asset_budget = int(os.getenv("ASSET_BUDGET", t.asset_budget))
+    t.assets_budget = int(os.getenv("ASSETS_BUDGET", t.assets_budget))
+    # e.g. RESOURCE_LIMITS=cpu=90,memory=85,load=8
+    for item in filter(None, os.getenv("RESOURCE_LIMITS", "").split(",")):
+        resource, value = item.split("=")
+        t.resource_limits[resource] = float(value)
+    t.events_samples = int(os.getenv("EVENTS_SAMPLES", t.events_samples))
+    t.events_timeout = float(os.getenv("EVENTS_TIMEOUT", t.events_timeout))
+    t.storage_task = os.getenv("STORAGE_TASK", None)
+    t.storage_size = int(os.getenv("STORAGE_SIZE", t.storage_size))
+    t.processing_task = os.getenv("PROCESSING_TASK", None)
+    t.processing_deadline = float(
+        os.getenv("PROCESSING_DEADLINE", t.processing_deadline)
+    )
+    for component in ("front", "api", "login", "data", "events", "processing"):
+        slo_ms = os.getenv(f"{component.upper()}_SLO_MS", None)
+        if slo_ms:
+            t.slo_ms[component] = float(slo_ms)
     if retry:
         t.retry = int(retry)
     if timeout:
         t.timeout = int(timeout)
+    connect_timeout = os.getenv("CONNECT_TIMEOUT", None)
+    if connect_timeout:
+        t.connect_timeout = float(connect_timeout)
+    read_timeout = os.getenv("READ_TIMEOUT", None)
+    if read_timeout:
+        t.read_timeout = float(read_timeout)
+    # e.g. CHECK_TIMEOUTS=03a=10,05a=2:8 for a connect:read pair
+    for item in filter(None, os.getenv("CHECK_TIMEOUTS", "").split(",")):
+        name, value = item.split("=")
+        connect, _, read = value.partition(":")
+        t.check_timeouts[name] = (float(connect), float(read or connect))
+    run_deadline = os.getenv("RUN_DEADLINE", None)
+    if run_deadline:
+        t.run_deadline = float(run_deadline)
     if sleep:
         t.sleep = int(sleep)
+    fleet = os.getenv("FLEET", None)
+    if fleet:
+        options = {
+            key: getattr(t, key)
+            for key in (
+                "timeout",
+                "connect_timeout",
+                "read_timeout",
+                "check_timeouts",
+                "run_deadline",
+                "retry",
+                "transport_name",
+                "h2c",
+                "pool_size",
+                "max_retries",
+                "keep_alive",
+                "slo_ms",
+                "deep_probes",
+                "events_probe",
+                "events_samples",
+                "health_probe",
+                "assets_probe",
+                "asset_budget",
+                "assets_budget",
+                "resource_limits",
+                "events_timeout",
+                "max_body",
+                "excerpt_size",
+            )
+        }
+        with open(sys.stdin.fileno() if fleet == "-" else fleet) as lines:
+            results = run_fleet(
+                read_targets(lines),
+                int(os.getenv("PROCESSES", 0)) or None,
+                int(os.getenv("CONCURRENCY", 0)) or None,
+                workers,
+                options,
+            )
+            status = report_fleet(results)
+        print(f"Error code: {status}")
+        sys.exit(status)
+    wait_deadline = os.getenv("WAIT_DEADLINE", None)
+    if wait_deadline:
+        t.wait_deadline = float(wait_deadline)
+    t.poll_interval = float(os.getenv("POLL_INTERVAL", t.poll_interval))
+    wait_for = os.getenv("WAIT_FOR", None)
+    if wait_for:
+        names = wait_for.split(",")
+        unknown = [name for name in names if name not in READINESS]
+        if unknown:
+            print(f"🔥 Unknown readiness {', '.join(unknown)}: {', '.join(READINESS)}")
+            sys.exit(1)
+        t.readiness = {name: READINESS[name] for name in names}
+    metrics_file = os.getenv("METRICS_FILE", None)
+    metrics_port = os.getenv("METRICS_PORT", None)
+    if metrics_port and not os.getenv("WATCH", None):
+        # A single run exports its results with METRICS_FILE instead
+        print("🔥 METRICS_PORT needs WATCH, scrapes serve the last watch cycle")
+        sys.exit(1)
+    metrics = Metrics() if metrics_file or metrics_port else None
     wait = os.getenv("WAIT", None)
-    if wait:
-        t.wait("/api")
+    warm = os.getenv("WARM_UP", "0") != "0"
+    ready = None
+    # The warm-up only starts once the stack is ready, WAIT or not
+    if wait or warm:
+        ready = t.wait()
+        if metrics:
+            metrics.observe_wait(t)
+    if warm:
+        if not ready:
+            print("🔥 Warm-up skipped, Kitsu is not ready")
+            print("Error code: 1")
+            sys.exit(1)
+        routes = os.getenv("WARM_ROUTES", None)
+        routes = routes.split(",") if routes else list(WARM_ROUTES)
+        try:
+            routes = asset_paths(t.send(f"{t.base_url}/").text, t.base_url) + routes
+        except t.transport.errors:
+            print("🔥 Kitsu / not available, front bundles not warmed up")
+        results = warm_up(
+            t,
+            routes,
+            workers,
+            int(os.getenv("WARM_WINDOW", 3)),
+            float(os.getenv("WARM_TOLERANCE", 0.2)),
+            int(os.getenv("WARM_MAX_ROUNDS", 20)),
+        )
+        for route, result in results.items():
+            print(format_warm_up(route, result))
+        status = int(not all(result["warm"] for result in results.values()))
+        print(f"Error code: {status}")
+        sys.exit(status)
     print(f"Kitsu URL: {t.base_url}")
     print(f"Kitsu version: {t.kitsu_version}")
     print(f"Zou version: {t.zou_version}")
-    # Check Kitsu
-    print(
-        t.check_url(
-            "/",
-            "✅ 01a Check Kitsu /",
-            "🔥 01a Check Kitsu /",
-        )
-    )
-    print(
-        t.check_if_last_request_is_a_kitsu(
-            "✅ 01b  Check if it's really a Kitsu",
-            "🔥 01b  Check if it's really a Kitsu",
-        )
-    )
-
-    # Check Kitsu API (Zou)
-    print(
-        t.check_url(
-            "/api",
-            "✅ 02a Check Kitsu API /api",
-            "🔥 02a Check Kitsu API /api",
-        )
-    )
-    print(
-        t.check_if_last_request_is_a_zou(
-            "✅ 02b  Check if it's really a Kitsu API",
-            "🔥 02b  Check if it's really a Kitsu API",
-        )
-    )
-
-    # Check good login
-    print(
-        t.check_url(
-            "/api/auth/login",
-            "✅ 03a Check login /api/auth/login",
-            "🔥 03a Check login /api/auth/login",
-            {"email": "admin@example.com", "password": "mysecretpassword"},
-        )
-    )
-    print(
-        t.check_if_error(
-            "✅ 03b  Check login /api/auth/login (check error status)",
-            "🔥 03b  Check login /api/auth/login (check error status)",
-        )
-    )
-    print(
-        t.check_login(
-            "✅ 03c  Check login /api/auth/login (check login status)",
-            "🔥 03c  Check login /api/auth/login (check login status)",
-        )
-    )
-
-    # Check bad pass
-    print(
-        t.check_url(
-            "/api/auth/login",
-            "✅ 04a Check login /api/auth/login",
-            "🔥 04a Check login /api/auth/login",
-            {"email": "admin@example.com", "password": "badpass"},
-            400,
-        )
-    )
-    print(
-        t.check_bad_login(
-            "✅ 04b  Check login /api/auth/login (check login status)",
-            "🔥 04b  Check login /api/auth/login (check login status)",
-        )
-    )
-
-    # Check with a bad account
-    print(
-        t.check_url(
-            "/api/auth/login",
-            "✅ 05a Check login /api/auth/login",
-            "🔥 05a Check login /api/auth/login",
-            {"email": "not-a-user@example.com", "password": "badpass"},
-            400,
-        )
-    )
-    print(
-        t.check_bad_login(
-            "✅ 05b  Check login /api/auth/login (check login status)",
-            "🔥 05b  Check login /api/auth/login (check login status)",
+    history_path = os.getenv("HISTORY", None)
+    history = None
+    if history_path:
+        history = History(
+            history_path,
+            int(os.getenv("HISTORY_WINDOW", 20)),
+            min_increase=float(os.getenv("REGRESSION_MIN_INCREASE", 0.2)),
+            threshold=float(os.getenv("REGRESSION_THRESHOLD", 3)),
         )
-    )
-
-    # Check Kitsu version
-    print(
-        t.check_url(
-            "/.version.txt",
-            "✅ 06a Kitsu version",
-            "🔥 06a Kitsu version",
+    # e.g. CAPACITY=1,2,4,8,16 ramps concurrent logins through these levels
+    capacity_levels = os.getenv("CAPACITY", None)
+    if capacity_levels:
+        levels = [int(level) for level in capacity_levels.split(",")]
+        sustainable = None
+        for step in find_capacity(
+            t,
+            levels,
+            float(os.getenv("CAPACITY_DURATION", 10)),
+            float(os.getenv("CAPACITY_MAX_ERROR_RATE", 0.01)),
+            float(os.getenv("CAPACITY_MAX_P95_MS", 1000)),
+        ):
+            print(format_capacity_step(step), flush=True)
+            if step["sustainable"]:
+                sustainable = step["concurrency"]
+        print(f"Maximum sustainable concurrency: {sustainable}")
+        status = 0 if sustainable else 1
+        print(f"Error code: {status}")
+        sys.exit(status)
+    soak_duration = os.getenv("SOAK", None)
+    if soak_duration:
+        # e.g. SOAK_RESOURCE_DRIFT=memory=5,load=2
+        resource_drift = {}
+        for item in filter(
+            None, os.getenv("SOAK_RESOURCE_DRIFT", "memory=5").split(",")
+        ):
+            resource, value = item.split("=")
+            resource_drift[resource] = float(value)
+        soak = Soak(
+            t,
+            float(soak_duration),
+            float(os.getenv("SOAK_RATE", 1)),
+            float(os.getenv("SOAK_WINDOW", 60)),
+            workers,
+            int(os.getenv("SOAK_MAX_WINDOWS", 60)),
+            float(os.getenv("SOAK_MAX_DRIFT", 0.2)),
+            resource_drift,
         )
-    )
-    if t.kitsu_version:
-        print(
-            t.check_kitsu_version(
-                f"✅ 06b Kitsu version {t.kitsu_version} == ",
-                f"🔥 06b Kitsu {t.kitsu_version} != ",
-            )
+        for window in soak.run():
+            print(format_soak_window(window), flush=True)
+        print("Soak trend:")
+        for window in soak.windows:
+            print(format_soak_window(window))
+        for message in soak.report():
+            print(message)
+        print(f"Error code: {t.status}")
+        sys.exit(t.status)
+    # JOURNEY=default, or the path of a JSON list of steps
+    journey = os.getenv("JOURNEY", None)
+    if journey:
+        if journey == "default":
+            steps = default_journey(t)
+        else:
+            with open(journey) as file:
+                steps = read_journey(file)
+        think_min, _, think_max = os.getenv("JOURNEY_THINK_TIME", "1:3").partition(":")
+        stats, elapsed = run_journeys(
+            t,
+            steps,
+            int(os.getenv("JOURNEY_USERS", 10)),
+            float(os.getenv("JOURNEY_DURATION", 60)),
+            (float(think_min), float(think_max or think_min)),
         )
+        for message in stats.report(elapsed):
+            print(message)
+        status = int(bool(stats.failed_journeys))
+        print(f"Error code: {status}")
+        sys.exit(status)
+    watch_interval = os.getenv("WATCH", None)
+    if watch_interval:
+        if metrics_port:
+            serve_metrics(metrics, int(metrics_port))
+        fail_interval = float(os.getenv("WATCH_FAIL_INTERVAL", 10))
+        for messages in watch(
+            t, float(watch_interval), fail_interval, workers, metrics, history
+        ):
+            print(datetime.datetime.now().isoformat(timespec="seconds"))
+            for message in messages:
+                print(message)
+            print(f"Error code: {t.status}", flush=True)
+            if metrics_file:
+                metrics.write(metrics_file)
+    for message in run_suite(t, workers, metrics, history):
+        print(message)
+    if metrics_file:
+        metrics.write(metrics_file)
 
-    # Check Zou version
+    stats = t.connection_stats()
     print(
-        t.check_url(
-            "/api",
-            "✅ 07a Zou version",
-            "🔥 07a Zou version",
-        )
+        f"Connections: {stats['opened']} opened, {stats['reused']} reused"
+        f" for {stats['requests']} requests, {t.not_modified} not modified"
     )
-    if t.zou_version:
+    protocols = t.protocols()
+    if protocols:
         print(
-            t.check_zou_version(
-                f"✅ 07b Zou version {t.zou_version} == ",
-                f"🔥 07b Zou {t.zou_version} != ",
+            "Protocols: "
+            + ", ".join(
+                f"{name} ({count})" for name, count in sorted(protocols.items())
             )
         )
 
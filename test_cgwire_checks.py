@@ -1,13 +1,63 @@
+import asyncio
+import base64
+import datetime
+import gzip
+import hashlib
+import io
 import json
-from unittest import TestCase
-from unittest.mock import patch, call
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import IsolatedAsyncioTestCase, TestCase, skipIf
+from itertools import islice
+from unittest.mock import MagicMock, patch, call
 
 import requests
 
-from cgwire_checks import CheckURL
+try:
+    import httpx
+except ImportError:  # pragma: nocover
+    httpx = None
 
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:  # pragma: nocover
+    h2 = None
 
-def connection_error(yes, timeout=10):
+import bench_cgwire_checks
+import cgwire_checks
+from cgwire_checks import (
+    AsyncCheckURL,
+    Check,
+    CheckURL,
+    History,
+    Metrics,
+    ResponseCache,
+    check_groups,
+    check_target,
+    default_checks,
+    read_targets,
+    report_fleet,
+    run_checks,
+    run_checks_async,
+    run_fleet,
+    run_suite,
+    serve_metrics,
+    watch,
+)
+
+
+def connection_error(yes, timeout=10, stream=False):
     raise requests.exceptions.ConnectionError()
 
 
@@ -26,28 +76,32 @@ class TestCheckURL(TestCase):
         assert t.base_url == "http://127.0.0.1:8080"
 
     def test_check_url_root(self):
-        with patch("requests.get") as mock_request:
+        with patch("requests.Session.get") as mock_request:
             mock_request.return_value.status_code = 200
             assert (self.t.check_url("/", self.msg_ok, self.msg_ko)) == self.msg_ok
             assert self.t.status == 0
-            mock_request.assert_called_once_with("http://127.0.0.1/", timeout=5)
+            mock_request.assert_called_once_with(
+                "http://127.0.0.1/", timeout=5, stream=True
+            )
 
     def test_check_url_with_502(self):
-        with patch("requests.get") as mock_request:
+        with patch("requests.Session.get") as mock_request:
             mock_request.return_value.status_code = 502
             mock_request.return_value.text = "<html>502 Bad Gateway</html>"
             assert (
                 self.t.check_url("/api/ko", self.msg_ok, self.msg_ko)
             ) == self.msg_ko + "\n<html>502 Bad Gateway</html>"
             assert self.t.status == 1
-            mock_request.assert_called_once_with("http://127.0.0.1/api/ko", timeout=5)
+            mock_request.assert_called_once_with(
+                "http://127.0.0.1/api/ko", timeout=5, stream=True
+            )
 
     def test_check_url_with_502_and_json(self):
         def json_patch():
             raise requests.exceptions.JSONDecodeError("JSONDecodeError", "", 0)
 
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 502,
                 "return_value.text": "<html>502 Bad Gateway</html>",
@@ -70,7 +124,7 @@ class TestCheckURL(TestCase):
 
     def test_check_url_with_db_error(self):
         msg_db_ko = "{'error': True, 'login': False, 'message': \"Database doesn't seem reachable.\"}"
-        with patch("requests.get") as mock_request:
+        with patch("requests.Session.get") as mock_request:
             mock_request.return_value.status_code = 500
             mock_request.return_value.text = msg_db_ko
             assert (
@@ -78,16 +132,20 @@ class TestCheckURL(TestCase):
             ) == self.msg_ko + "\n" + msg_db_ko
             assert self.t.status == 1
             mock_request.assert_called_once_with(
-                "http://127.0.0.1/api/db_ko", timeout=5
+                "http://127.0.0.1/api/db_ko", timeout=5, stream=True
             )
 
     def test_check_url_with_http_error(self):
-        with patch("requests.get", **{"side_effect": connection_error}) as mock_request:
+        with patch(
+            "requests.Session.get", **{"side_effect": connection_error}
+        ) as mock_request:
             assert (self.t.check_url("/", self.msg_ok, self.msg_ko)) == self.msg_ko
             assert self.t.status == 1
-            mock_request.assert_called_once_with("http://127.0.0.1/", timeout=5)
+            mock_request.assert_called_once_with(
+                "http://127.0.0.1/", timeout=5, stream=True
+            )
 
-        with patch("requests.get") as mock_request:
+        with patch("requests.Session.get") as mock_request:
             mock_request.return_value.status_code = 200
             self.t.check_url("/", self.msg_ok, self.msg_ko)
             assert self.t.status == 1
@@ -96,7 +154,7 @@ class TestCheckURL(TestCase):
         self.msg_ok = "✅ 01b Check if it's really a Kitsu"
         self.msg_ko = "🔥 01b Check if it's really a Kitsu"
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": """<html>
@@ -117,7 +175,7 @@ class TestCheckURL(TestCase):
         self.msg_ok = "✅ 01b Check if it's really a Kitsu"
         self.msg_ko = "🔥 01b Check if it's really a Kitsu"
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": """<html>
@@ -143,7 +201,7 @@ class TestCheckURL(TestCase):
             return json.loads(msg_api_ok)
 
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": msg_api_ok,
@@ -167,7 +225,7 @@ class TestCheckURL(TestCase):
             return json.loads(msg_api_ko)
 
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": msg_api_ko,
@@ -191,7 +249,7 @@ class TestCheckURL(TestCase):
             return json.loads(msg_login_ok)
 
         with patch(
-            "requests.post",
+            "requests.Session.post",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": msg_login_ok,
@@ -211,6 +269,7 @@ class TestCheckURL(TestCase):
                 "http://127.0.0.1/api/auth/login",
                 json={"email": "toto@kitsu", "password": "pass"},
                 timeout=5,
+                stream=True,
             )
 
             # Check error status
@@ -256,7 +315,7 @@ class TestCheckURL(TestCase):
             return data
 
         with patch(
-            "requests.post",
+            "requests.Session.post",
             **{
                 "return_value.status_code": 400,
                 "return_value.text": msg_login_ko,
@@ -276,6 +335,7 @@ class TestCheckURL(TestCase):
                 "http://127.0.0.1/api/auth/login",
                 json={"email": "toto@kitsu", "password": "not_the_pass"},
                 timeout=5,
+                stream=True,
             )
 
             # Same but with the wrong login expected
@@ -400,7 +460,7 @@ class TestCheckURL(TestCase):
 
     def test_check_if_i_can_get_kitsu_version(self):
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": "0.17.30\n",
@@ -419,7 +479,7 @@ class TestCheckURL(TestCase):
 
     def test_check_if_i_can_get_bad_kitsu_version(self):
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": "0.17.30\n",
@@ -443,7 +503,7 @@ class TestCheckURL(TestCase):
             return json.loads(msg_api_ok)
 
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": msg_api_ok,
@@ -468,7 +528,7 @@ class TestCheckURL(TestCase):
             return json.loads(msg_api_ok)
 
         with patch(
-            "requests.get",
+            "requests.Session.get",
             **{
                 "return_value.status_code": 200,
                 "return_value.text": msg_api_ok,
@@ -488,7 +548,7 @@ class TestCheckURL(TestCase):
 
     def test_wait_success_first_try(self):
         """Test wait() method when connection succeeds on first try."""
-        with patch("requests.get") as mock_request:
+        with patch("requests.Session.get") as mock_request:
             mock_request.return_value.status_code = 200
             with patch("time.sleep") as mock_sleep:  # Mock sleep to speed up test
                 result = self.t.wait("/api")
@@ -498,7 +558,7 @@ class TestCheckURL(TestCase):
 
     def test_wait_success_after_retry(self):
         """Test wait() method when connection succeeds after a retry."""
-        # Create a mock that fails once then succeeds
+        # Create a mock that fails twice then succeeds
         mock_responses = [
             requests.exceptions.ConnectionError("Connection refused"),
             requests.exceptions.ReadTimeout(
@@ -507,50 +567,2485 @@ class TestCheckURL(TestCase):
             type("MockResponse", (), {"status_code": 200})(),
         ]
 
-        with patch("requests.get", side_effect=mock_responses) as mock_request:
+        with patch("requests.Session.get", side_effect=mock_responses) as mock_request:
             with patch("time.sleep") as mock_sleep:
                 with patch("builtins.print") as mock_print:
-                    self.t.retry = 5
                     result = self.t.wait("/api")
                     assert result is True
                     assert mock_request.call_count == 3
-                    mock_sleep.assert_has_calls(
-                        [call(1), call(1)]
-                    )  # Sleep should be called twice
+                    # Sleep backs off from poll_interval, with jitter
+                    first, second = [c.args[0] for c in mock_sleep.call_args_list]
+                    assert 0.05 <= first <= 0.1
+                    assert 0.1 <= second <= 0.2
                     # Check that dots were printed
                     mock_print.assert_any_call(".", end="", flush=True)
-                    mock_print.assert_any_call(".", end="", flush=True)
                     mock_print.assert_any_call("")  # Empty line after success
+                    assert set(self.t.ready_times) == {"/api"}
 
     def test_wait_always_fail(self):
-        """Test wait() method when connection never succeeds."""
-        # Create a mock that fails once then succeeds
-        mock_responses = [
-            requests.exceptions.ConnectionError("Connection refused"),
-            requests.exceptions.ConnectionError("Connection refused"),
-            requests.exceptions.ReadTimeout(
-                "Server did not respond within the specified timeout"
+        """Test wait() method when the api keeps answering 502."""
+        with patch("requests.Session.get") as mock_request:
+            mock_request.return_value.status_code = 502
+            with patch("builtins.print") as mock_print:
+                self.t.wait_deadline = 0.2
+                self.t.poll_interval = 0.01
+                self.t.sleep = 0.02
+                result = self.t.wait("/api")
+                assert result is None
+                assert mock_request.call_count > 3
+                mock_print.assert_any_call("🔥 /api not ready")
+                assert self.t.ready_times == {"/api": None}
+
+    def test_wait_components(self):
+        """Test wait() method probing every readiness url."""
+
+        def events_late(url, timeout):
+            assert timeout <= 5
+            response = MagicMock(status_code=200)
+            if "socket.io" in url and mock_request.call_count < 6:
+                response.status_code = 502
+            return response
+
+        with patch("requests.Session.get", side_effect=events_late) as mock_request:
+            with patch("time.sleep"), patch("builtins.print") as mock_print:
+                assert self.t.wait() is True
+        assert set(self.t.ready_times) == {"front", "api", "events"}
+        assert self.t.ready_times["events"] >= self.t.ready_times["api"]
+        assert mock_request.call_count >= 6
+        mock_print.assert_any_call(
+            f"✅ events ready in {self.t.ready_times['events']:.2f}s"
+        )
+
+    def test_wait_budget(self):
+        assert self.t.wait_budget() == 10 * (5 + 1)
+        self.t.wait_deadline = 30
+        assert self.t.wait_budget() == 30
+
+
+def fake_response(status_code=200, text="", data=None):
+    def json_patch():
+        if data is None:
+            raise requests.exceptions.JSONDecodeError("JSONDecodeError", "", 0)
+        return data
+
+    return MagicMock(
+        **{
+            "status_code": status_code,
+            "text": text,
+            "json.side_effect": json_patch,
+        }
+    )
+
+
+def fake_kitsu(url, json=None, timeout=10, stream=False):
+    if url.endswith("/api/auth/login"):
+        if json["password"] == "mysecretpassword":
+            return fake_response(200, '{"login": true}', {"login": True})
+        return fake_response(400, '{"login": false}', {"login": False})
+    if url.endswith("/api"):
+        return fake_response(200, "{}", {"api": "Zou", "version": "0.17.30"})
+    if url.endswith("/.version.txt"):
+        return fake_response(200, "0.17.30\n")
+    return fake_response(200, "<title>Kitsu</title>")
+
+
+class TestRunChecks(TestCase):
+    def setUp(self):
+        self.t = CheckURL("http://127.0.0.1")
+        self.t.kitsu_version = "0.17.30"
+        self.t.zou_version = "0.17.30"
+
+    def test_default_checks(self):
+        names = [check.name for check in default_checks(self.t)]
+        assert names[0] == "01a"
+        assert names[-1] == "07b"
+        assert "06b" in names
+
+        self.t.kitsu_version = None
+        self.t.zou_version = None
+        names = [check.name for check in default_checks(self.t)]
+        assert "06b" not in names
+        assert "07b" not in names
+
+    def test_run_checks_in_order(self):
+        checks = default_checks(self.t)
+        with (
+            patch("requests.Session.get", side_effect=fake_kitsu),
+            patch("requests.Session.post", side_effect=fake_kitsu),
+        ):
+            messages = list(run_checks(self.t, checks, workers=4))
+        assert [message[:5] for message in messages] == [
+            f"✅ {check.name}" for check in checks
+        ]
+        assert self.t.status == 0
+        assert self.t.request is None
+        assert self.t.responses["03a"].status_code == 200
+        assert self.t.responses["04a"].status_code == 400
+
+    def test_run_checks_skip_dependents(self):
+        def kitsu_down(url, json=None, timeout=10, stream=False):
+            if url == "http://127.0.0.1/":
+                raise requests.exceptions.ConnectionError()
+            return fake_kitsu(url, json, timeout, stream)
+
+        with (
+            patch("requests.Session.get", side_effect=kitsu_down) as mock_request,
+            patch("requests.Session.post", side_effect=fake_kitsu),
+        ):
+            messages = list(run_checks(self.t, default_checks(self.t)))
+        assert messages[0] == "🔥 01a Check Kitsu /"
+        assert (
+            messages[1] == "🔥 01b  Check if it's really a Kitsu (skipped, 01a failed)"
+        )
+        assert messages[2].startswith("✅ 02a Check Kitsu API /api (")
+        assert self.t.status == 1
+        assert mock_request.call_count == 3
+
+    def test_run_checks_unknown_requirement(self):
+        checks = [Check("01b", "✅", "🔥", assertion="check_login", requires=["01a"])]
+        with self.assertRaises(ValueError):
+            list(run_checks(self.t, checks))
+
+
+class KitsuHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = 65536
+
+    def send(self, status, body, content_type="application/json", headers=()):
+        self.server.hits.append((self.command, self.path, status))
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/":
+            etag = ("ETag", '"kitsu"')
+            if self.headers.get("If-None-Match") == etag[1]:
+                self.send(304, b"", "text/html", [etag])
+            else:
+                self.send(200, b"<title>Kitsu</title>", "text/html", [etag])
+        elif self.path == "/api":
+            self.send(200, b'{"api": "Zou", "version": "0.17.30"}')
+        elif self.path == "/.version.txt":
+            last_modified = ("Last-Modified", "Wed, 21 Oct 2026 07:28:00 GMT")
+            if self.headers.get("If-Modified-Since") == last_modified[1]:
+                self.send(304, b"", "text/plain", [last_modified])
+            else:
+                self.send(200, b"0.17.30\n", "text/plain", [last_modified])
+        elif self.path == "/large":
+            self.send(200, b"<title>Kitsu</title>" + 3000000 * b"x", "text/html")
+        elif self.path == "/large-etag":
+            body = b"<title>Kitsu</title>" + 3000000 * b"x"
+            self.send(200, body, "text/html", [("ETag", '"large"')])
+        elif self.path == "/error":
+            self.send(500, 5000 * b"e", "text/html")
+        elif self.path == "/short-error":
+            self.send(500, 200000 * b"e", "text/html")
+        elif self.path in AUTHENTICATED:
+            if self.headers.get("Authorization") != f"Bearer {self.server.token}":
+                self.send(401, b'{"msg": "Token has expired"}')
+            else:
+                self.send(200, AUTHENTICATED[self.path])
+        elif self.path == "/api/auth/refresh-token":
+            if self.headers.get("Authorization") != "Bearer refresh":
+                self.send(401, b'{"msg": "Bad refresh token"}')
+            else:
+                self.server.token = jwt(3600)
+                body = json.dumps({"access_token": self.server.token}).encode()
+                self.send(200, body)
+        elif self.path == "/stalled":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", "200000")
+            self.end_headers()
+            self.wfile.write(100000 * b"x")
+            self.wfile.flush()
+            time.sleep(1)
+            self.close_connection = True
+        elif self.path == "/unsized-error":
+            self.send_response(500)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(200000 * b"e")
+            self.close_connection = True
+        else:
+            self.send(404, b'{"error": true}')
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if data.get("password") == "mysecretpassword":
+            body = {
+                "login": True,
+                "access_token": self.server.token,
+                "refresh_token": "refresh",
+            }
+            cookie = ("Set-Cookie", "access_token_cookie=cookie; Path=/; HttpOnly")
+            self.send(200, json.dumps(body).encode(), headers=[cookie])
+        else:
+            self.send(400, b'{"login": false}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def jwt(expires_in):
+    claims = json.dumps({"exp": time.time() + expires_in}).encode()
+    payload = base64.urlsafe_b64encode(claims).rstrip(b"=").decode()
+    return f"header.{payload}.signature"
+
+
+def login(t):
+    t.check_url("/api/auth/login", "✅", "🔥", {"password": "mysecretpassword"})
+    assert t.check_login("✅", "🔥") == "✅"
+
+
+def probe_checker(url, transport="requests", **attributes):
+    t = CheckURL(url)
+    t.transport_name = transport
+    for name, value in attributes.items():
+        setattr(t, name, value)
+    return t
+
+
+def assert_probe_check(probe, name, assertion):
+    """Assert the probe attributes add the check name, requiring 03c."""
+    names = [check.name for check in default_checks(CheckURL("http://127.0.0.1"))]
+    assert name not in names
+    check = default_checks(probe_checker("http://127.0.0.1", **probe))[-1]
+    assert check.name == name
+    assert check.assertion == assertion
+    assert check.requires == ("03c",)
+
+
+def probe_metrics(probe):
+    """Run the suite with probe against a stand-in, return it and its metrics."""
+    metrics = Metrics()
+    with bench_cgwire_checks.StandIn() as stand_in:
+        t = probe_checker(stand_in.url, **probe)
+        list(run_suite(t, metrics=metrics))
+    return t, metrics.render()
+
+
+AUTHENTICATED = {
+    "/api/auth/authenticated": b'{"authenticated": true}',
+    "/api/data/user/context": b'{"projects": []}',
+    "/api/data/projects/open": b"[" + b",".join(100 * [b'{"name": "p"}']) + b"]",
+    "/api/data/persons": b'[{"first_name": "Admin"}]',
+}
+
+
+class LocalServer:
+    def __init__(self, handler=KitsuHandler):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        # The checker closes connections of bodies it stops reading
+        self.server.handle_error = lambda request, client_address: None
+        self.server.hits = []
+        self.server.token = jwt(3600)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestSession(TestCase):
+    def test_session_config(self):
+        t = CheckURL("http://127.0.0.1")
+        t.pool_size = 3
+        t.max_retries = 2
+        t.keep_alive = False
+        assert t.connection_stats() == {"requests": 0, "opened": 0, "reused": 0}
+        assert t.session is t.session
+        adapter = t.session.get_adapter("https://127.0.0.1")
+        assert adapter._pool_maxsize == 3
+        assert adapter.max_retries.total == 2
+        assert t.session.headers["Connection"] == "close"
+
+    def test_connection_reused(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            assert t.wait("/api") is True
+            assert t.check_url("/api", "✅", "🔥") == "✅"
+            assert t.check_url("/api", "✅", "🔥") == "✅"
+        assert t.connection_stats() == {"requests": 2, "opened": 1, "reused": 1}
+        assert t.cache.hits == 1
+
+    def test_timings(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.check_url("/api", "✅", "🔥", name="02a")
+            t.check_url("/", "✅", "🔥", name="01a")
+        first = t.responses["02a"].timings
+        assert set(first) == {"dns", "connect", "ttfb", "total"}
+        assert first["total"] >= first["ttfb"] >= first["connect"] > 0
+        assert set(t.responses["01a"].timings) == {"ttfb", "total"}
+        assert t.with_timings("✅ 01a", "01a").startswith("✅ 01a (ttfb ")
+        assert t.with_timings("🔥 01a\nbody", "01a").endswith(" ms)\nbody")
+        assert t.with_timings("🔥 01b", "01b") == "🔥 01b"
+
+    def test_timings_resolution(self):
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, port, *args):
+            if host == "localhost":
+                return [
+                    (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.2", port)),
+                    (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port)),
+                ]
+            return getaddrinfo(host, port, *args)
+
+        with LocalServer() as server:
+            t = CheckURL(server.url.replace("127.0.0.1", "localhost"))
+            with patch("socket.getaddrinfo", side_effect=resolve):
+                assert t.check_url("/api", "✅", "🔥") == "✅"
+
+            t = CheckURL(server.url)
+            with patch("socket.getaddrinfo", side_effect=socket.gaierror):
+                assert t.check_url("/api", "✅", "🔥") == "🔥"
+
+    def test_timings_tls(self):
+        getaddrinfo = socket.getaddrinfo
+
+        def slow_getaddrinfo(*args):
+            time.sleep(0.2)
+            return getaddrinfo(*args)
+
+        connection_class = cgwire_checks.timed_requests_classes()[1]
+        with LocalServer() as server:
+            connection = connection_class("127.0.0.1", server.server.server_port)
+            # The handshake is skipped, the dns time must not be counted in it
+            with (
+                patch("socket.getaddrinfo", side_effect=slow_getaddrinfo),
+                patch(
+                    "urllib3.connection._ssl_wrap_socket_and_match_hostname",
+                    side_effect=lambda sock, **kwargs: (sock, True),
+                ),
+            ):
+                cgwire_checks._timings.current = timings = {}
+                connection.connect()
+            connection.close()
+        cgwire_checks._timings.current = None
+        assert timings["dns"] >= 200
+        assert timings["tls"] < 50
+
+    def test_slo(self):
+        t = CheckURL("http://127.0.0.1")
+        with patch("requests.Session.get") as mock_request:
+            mock_request.return_value.status_code = 200
+            mock_request.return_value.elapsed = datetime.timedelta(seconds=2)
+            assert t.check_url("/api", "✅", "🔥", slo_ms=5000) == "✅"
+            assert t.status == 0
+            assert t.request.timings["ttfb"] == 2000
+            with patch("time.perf_counter", side_effect=[0, 3]):
+                assert (
+                    t.check_url("/", "✅", "🔥", slo_ms=1000)
+                    == "🔥\nslower than 1000 ms"
+                )
+            assert t.status == 1
+
+    def test_default_checks_slo(self):
+        t = CheckURL("http://127.0.0.1")
+        t.slo_ms = {"login": 500, "api": 100}
+        slo_ms = {check.name: check.slo_ms for check in default_checks(t)}
+        assert slo_ms["01a"] is None
+        assert slo_ms["02a"] == slo_ms["07a"] == 100
+        assert slo_ms["03a"] == slo_ms["04a"] == slo_ms["05a"] == 500
+
+
+class TestDeadline(TestCase):
+    def test_timeouts(self):
+        t = CheckURL("http://127.0.0.1")
+        assert t.timeouts() == 5
+        t.connect_timeout = 2
+        assert t.timeouts() == (2, 5)
+        assert t.timeouts(3) == 3
+        assert t.timeouts((1, 8), budget=4) == (1, 4)
+        t.run_deadline = 0.5
+        t.start_deadline()
+        assert t.timeouts() <= 0.5
+        assert t.wait_budget() <= 0.5
+        t.reset()
+        assert t.remaining() is None
+
+    def test_split_timeouts(self):
+        t = CheckURL("http://127.0.0.1")
+        t.read_timeout = 8
+        t.check_timeouts = {"02a": (1, 2)}
+        checks = default_checks(t)
+        assert checks[2].timeout == (1, 2)
+        assert checks[0].timeout is None
+        with patch("requests.Session.get") as mock_request:
+            mock_request.return_value.status_code = 200
+            checks[0].run(t)
+            checks[2].run(t)
+        assert mock_request.call_args_list == [
+            call("http://127.0.0.1/", timeout=(5, 8), stream=True),
+            call("http://127.0.0.1/api", timeout=(1, 2), stream=True),
+        ]
+
+    def test_stdlib_split_timeouts(self):
+        with bench_cgwire_checks.StandIn(latency=0.2) as stand_in:
+            t = CheckURL(stand_in.url)
+            t.transport_name = "stdlib"
+            t.read_timeout = 0.05
+            assert t.check_url("/api", "✅", "🔥") == "🔥"
+            assert t.check_url("/", "✅", "🔥", timeout=(1, 1)) == "✅"
+            assert t.status == 1
+
+    def test_run_deadline(self):
+        send = CheckURL.send
+
+        def slow_api(self, url, data=None, timeout=None):
+            if url.endswith("/api"):
+                time.sleep(1)
+            return send(self, url, data, timeout)
+
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.run_deadline = 0.2
+            with patch.object(CheckURL, "send", slow_api):
+                start = time.monotonic()
+                messages = list(run_checks(t, default_checks(t)))
+            assert time.monotonic() - start < 0.6
+        assert messages[1].startswith("✅ 01b")
+        assert messages[2] == "🔥 02a Check Kitsu API /api (timed out)"
+        assert messages[-1] == "🔥 07a Zou version (timed out)"
+        assert t.status == 1
+
+    def test_run_budget(self):
+        t = CheckURL("http://127.0.0.1")
+        checks = default_checks(t)
+        assert cgwire_checks.run_budget(t, checks, 2) is None
+        t.deadline = time.monotonic() + 8
+        assert 1.9 < cgwire_checks.run_budget(t, checks, 2) <= 2
+        assert 7.9 < cgwire_checks.run_budget(t, checks[-1:], 2) <= 8
+
+
+class H2Server:
+    """Clear text HTTP/2 server answering the default checks."""
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.connections = 0
+        self.streams = 0
+
+    def __enter__(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.sock.close()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(
+                target=self.handle, args=(connection,), daemon=True
+            ).start()
+
+    def handle(self, sock):
+        config = h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        connection = h2.connection.H2Connection(config=config)
+        connection.initiate_connection()
+        sock.sendall(connection.data_to_send())
+        headers = {}
+        bodies = {}
+        with sock:
+            while data := sock.recv(65535):
+                for event in connection.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        headers[event.stream_id] = dict(event.headers)
+                        bodies[event.stream_id] = b""
+                    elif isinstance(event, h2.events.DataReceived):
+                        bodies[event.stream_id] += event.data
+                        connection.acknowledge_received_data(
+                            event.flow_controlled_length, event.stream_id
+                        )
+                    elif isinstance(event, h2.events.StreamEnded):
+                        self.respond(
+                            connection,
+                            event.stream_id,
+                            headers.pop(event.stream_id),
+                            bodies.pop(event.stream_id),
+                        )
+                sock.sendall(connection.data_to_send())
+
+    def respond(self, connection, stream_id, headers, body):
+        self.streams += 1
+        path = headers[":path"]
+        if headers[":method"] == "POST":
+            login = json.loads(body).get("password") == "mysecretpassword"
+            status, body = (200 if login else 400), json.dumps({"login": login})
+        elif path == "/":
+            status, body = 200, "<title>Kitsu</title>"
+        elif path == "/api":
+            status, body = 200, '{"api": "Zou", "version": "0.17.30"}'
+        elif path == "/.version.txt":
+            status, body = 200, "0.17.30\n"
+        else:
+            status, body = 404, '{"error": true}'
+        body = body.encode()
+        connection.send_headers(
+            stream_id, [(":status", str(status)), ("content-length", str(len(body)))]
+        )
+        connection.send_data(stream_id, body, end_stream=True)
+
+
+@skipIf(httpx is None or h2 is None, "httpx[http2] is not installed")
+class TestHttp2(TestCase):
+    def checker(self, url):
+        t = CheckURL(url)
+        t.transport_name = "http2"
+        t.kitsu_version = t.zou_version = "0.17.30"
+        return t
+
+    def test_multiplexed(self):
+        with H2Server() as server:
+            t = self.checker(server.url)
+            t.h2c = True
+            checks = default_checks(t)
+            messages = list(run_checks(t, checks))
+            assert [message[:5] for message in messages] == [
+                f"✅ {check.name}" for check in checks
+            ]
+            assert "connect" in t.responses["01a"].timings
+            assert t.protocols() == {"HTTP/2": 6}
+            assert t.connection_stats() == {"requests": 6, "opened": 1, "reused": 5}
+            assert server.connections == 1
+            assert server.streams == 6
+            t.close()
+
+    def test_missing_library(self):
+        for module in ("httpx", "h2"):
+            with patch.dict(sys.modules, {module: None}):
+                with self.assertRaises(RuntimeError) as raised:
+                    self.checker("http://127.0.0.1").transport
+            assert str(raised.exception) == (
+                f"{module} is missing, install the http2 extra of cgwire-checks"
+            )
+
+    def test_http1_fallback(self):
+        with LocalServer() as server:
+            t = self.checker(server.url)
+            t.keep_alive = False
+            t.max_body = 100000
+            assert t.check_url("/large", "✅", "🔥") == "✅"
+            assert len(t.request.text) == 100000
+            assert t.request.truncated
+            with patch("builtins.print"):
+                assert t.wait("/api") is True
+            login(t)
+            assert t.cookies == {"access_token_cookie": "cookie"}
+        assert t.protocols() == {"HTTP/1.1": 3}
+        assert self.checker(server.url).check_url("/api", "✅", "🔥") == "🔥"
+
+    def test_protocols(self):
+        assert CheckURL("http://127.0.0.1").protocols() == {}
+        for transport in ("requests", "stdlib"):
+            with LocalServer() as server:
+                t = CheckURL(server.url)
+                t.transport_name = transport
+                list(run_checks(t, default_checks(t)))
+            assert t.protocols() == {"HTTP/1.1": 6}
+
+    def test_report_fleet(self):
+        results = [
+            {"url": "https://a", "status": 0, "failed": [], "protocols": {"HTTP/2": 6}},
+            {
+                "url": "https://b",
+                "status": 0,
+                "failed": [],
+                "protocols": {"HTTP/1.1": 6},
+            },
+            {"url": "https://c", "status": 0, "failed": [], "protocols": {"HTTP/2": 6}},
+        ]
+        with patch("builtins.print") as mock_print:
+            assert report_fleet(results) == 0
+        mock_print.assert_any_call("HTTP/1.1: 1/3 targets")
+        mock_print.assert_any_call("HTTP/2: 2/3 targets")
+
+
+class TestDeepProbes(TestCase):
+    probe = {"deep_probes": True}
+
+    def test_default_checks(self):
+        t = CheckURL("http://127.0.0.1")
+        assert "08a" not in [check.name for check in default_checks(t)]
+        t.deep_probes = True
+        t.slo_ms = {"data": 300}
+        checks = default_checks(t)[-4:]
+        assert [check.name for check in checks] == ["08a", "08b", "08c", "08d"]
+        assert checks[2].message_ok == (
+            "✅ 08c Check open projects /api/data/projects/open"
+        )
+        assert all(check.auth and check.requires == ("03c",) for check in checks)
+        assert checks[0].slo_ms == 300
+        groups = check_groups(default_checks(t))
+        assert [check.name for check in groups[2]][-1] == "08d"
+
+    def test_probes(self):
+        for transport in cgwire_checks.TRANSPORTS:
+            with LocalServer() as server:
+                t = probe_checker(server.url, transport, **self.probe)
+                messages = list(run_checks(t, default_checks(t)))
+            assert t.status == 0, messages
+            assert t.tokens == {
+                "access_token": server.server.token,
+                "refresh_token": "refresh",
+            }
+            assert t.cookies == {"access_token_cookie": "cookie"}
+            size = len(AUTHENTICATED["/api/data/projects/open"])
+            assert t.responses["08c"].size == size
+            assert messages[-2].startswith("✅ 08c Check open projects")
+            assert messages[-2].endswith(f" ms, {size} bytes)")
+
+    def test_probes_without_login(self):
+        with LocalServer() as server:
+            t = probe_checker(server.url, **self.probe)
+            assert t.check_url("/api/data/persons", "✅", "🔥", auth=True) == (
+                '🔥\n{"msg": "Token has expired"}'
+            )
+        assert t.refreshes == 0
+
+    def test_refresh_token(self):
+        with LocalServer() as server:
+            t = probe_checker(server.url, **self.probe)
+            login(t)
+            # The server rejects the token, then it expires
+            server.server.token = jwt(3600)
+            assert t.check_url("/api/data/persons", "✅", "🔥", auth=True) == "✅"
+            assert t.refreshes == 1
+            t.tokens["access_token"] = server.server.token = jwt(-60)
+            assert t.check_url("/api/data/user/context", "✅", "🔥", auth=True) == "✅"
+            assert t.refreshes == 2
+            t.tokens["refresh_token"] = "revoked"
+            server.server.token = jwt(3600)
+            assert t.check_url("/api/auth/authenticated", "✅", "🔥", auth=True) == (
+                '🔥\n{"msg": "Token has expired"}'
+            )
+        paths = [path for _, path, _ in server.server.hits]
+        assert paths.count("/api/auth/refresh-token") == 3
+
+    def test_token_expired(self):
+        assert cgwire_checks.token_expired(jwt(5))
+        assert not cgwire_checks.token_expired(jwt(60))
+        assert not cgwire_checks.token_expired("not a jwt")
+
+    def test_metrics(self):
+        metrics = Metrics()
+        with LocalServer() as server:
+            t = probe_checker(server.url, **self.probe)
+            list(run_suite(t, metrics=metrics))
+        size = len(AUTHENTICATED["/api/data/persons"])
+        labels = f'target="{server.url}",check="08d"'
+        assert f"kitsu_check_response_bytes{{{labels}}} {size}\n" in metrics.render()
+
+
+class TestEvents(TestCase):
+    probe = {"events_probe": True, "events_samples": 3, "events_timeout": 1}
+
+    def test_default_checks(self):
+        assert_probe_check(self.probe, "09a", "check_events")
+
+    def test_events(self):
+        for transport in cgwire_checks.TRANSPORTS:
+            with bench_cgwire_checks.StandIn(event_delay=0.02) as stand_in:
+                t = probe_checker(stand_in.url, transport, **self.probe)
+                messages = list(run_checks(t, default_checks(t)))
+                t.close()
+            assert t.status == 0, messages
+            assert messages[-1].startswith("✅ 09a Check events /socket.io (connect ")
+            assert messages[-1].endswith(" ms, 0/3 dropped)")
+            assert t.user == bench_cgwire_checks.USER
+            assert t.events["connect_ms"] > 0
+            assert len(t.events["latencies_ms"]) == 3
+            assert min(t.events["latencies_ms"]) >= 20
+            assert stand_in.server.sessions == {}
+
+    def test_dropped(self):
+        with bench_cgwire_checks.StandIn(drop_rate=1) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            t.events_timeout = 0.1
+            login(t)
+            message = t.check_events("✅", "🔥")
+        assert message.startswith("🔥 (connect ")
+        assert message.endswith(" ms, 3/3 dropped)")
+        assert t.events["latencies_ms"] == []
+        assert t.status == 1
+
+    def test_slo(self):
+        with bench_cgwire_checks.StandIn(event_delay=0.05) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            t.slo_ms = {"events": 10}
+            login(t)
+            message = t.check_events("✅", "🔥")
+        assert message.startswith("🔥 (connect ")
+        assert message.endswith("\np95 slower than 10 ms")
+        assert t.status == 1
+
+    def test_refused(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            message = t.check_events("✅", "🔥")
+        assert message == '🔥\nevents connection refused: {"message": "Unauthorized"}'
+        assert t.status == 1
+
+    def test_pings(self):
+        with bench_cgwire_checks.StandIn(
+            event_delay=0.15, ping_interval=0.05
+        ) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            login(t)
+            assert t.check_events("✅", "🔥").startswith("✅ (connect ")
+        assert len(t.events["latencies_ms"]) == 3
+
+    def test_unavailable(self):
+        with bench_cgwire_checks.StandIn(error_rate=1) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            assert t.check_events("✅", "🔥") == "🔥\nevents service answered 502"
+
+    @skipIf(httpx is None, "httpx is not installed")
+    def test_async(self):
+        async def run(url):
+            async with AsyncCheckURL(url) as t:
+                t.events_probe = True
+                t.events_samples = 2
+                messages = [m async for m in run_checks_async(t, default_checks(t))]
+                t.close()
+            return t, messages
+
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t, messages = asyncio.run(run(stand_in.url))
+        assert t.status == 0, messages
+        assert messages[-1].endswith(" ms, 0/2 dropped)")
+
+    def test_metrics(self):
+        t, rendered = probe_metrics(self.probe)
+        labels = f'target="{t.base_url}"'
+        assert f"kitsu_events_dropped{{{labels}}} 0\n" in rendered
+        assert f"kitsu_events_latency_seconds_count{{{labels}}} 3\n" in rendered
+        assert f'kitsu_events_latency_seconds{{{labels},quantile="0.95"}}' in rendered
+        t.reset()
+        assert t.events is None
+
+    def test_percentile(self):
+        assert cgwire_checks.percentile([3, 1, 2, 4], 0.5) == 2
+        assert cgwire_checks.percentile([3, 1, 2, 4], 0.95) == 4
+        assert cgwire_checks.percentile([5], 0.5) == 5
+
+
+class TestStorage(TestCase):
+    probe = {"storage_task": "task-1", "storage_size": 3 * 1048576 + 5}
+
+    def test_default_checks(self):
+        assert_probe_check(self.probe, "10a", "check_storage")
+
+    def test_generated_file(self):
+        generated = cgwire_checks.GeneratedFile(2 * 1048576 + 10, seed=1)
+        content = b"".join(generated.chunks())
+        assert len(content) == generated.size
+        assert content[:1048576] != content[1048576 : 2 * 1048576]
+        assert b"".join(generated.chunks(1048570, 1048590)) == (
+            content[1048570:1048590]
+        )
+        assert generated.digest(5, 2000000) == (
+            hashlib.sha256(content[5:2000000]).hexdigest()
+        )
+
+    def test_multipart_body(self):
+        body = cgwire_checks.MultipartBody("file", "f.bin", [b"abc", b"def"], 6)
+        content = body.read(10) + b"".join(body)
+        assert len(content) == len(body)
+        assert content.startswith(f"--{body.boundary}\r\n".encode())
+        assert b'name="file"; filename="f.bin"' in content
+        assert content.endswith(f"\r\n\r\nabcdef\r\n--{body.boundary}--\r\n".encode())
+        assert body.read(10) == b""
+
+    def test_storage(self):
+        for transport in cgwire_checks.TRANSPORTS:
+            with bench_cgwire_checks.StandIn() as stand_in:
+                t = probe_checker(stand_in.url, transport, **self.probe)
+                messages = list(run_checks(t, default_checks(t)))
+                t.close()
+            assert t.status == 0, messages
+            assert messages[-1].startswith(
+                "✅ 10a Check storage /api/pictures/preview-files (3.1 MB, upload "
+            )
+            assert messages[-1].endswith(" MB/s)")
+            assert t.storage["size"] == t.storage_size
+            assert stand_in.server.comments == stand_in.server.previews == {}
+
+    def test_memory(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, "stdlib", **self.probe)
+            t.storage_size = 32 * 1048576
+            login(t)
+            tracemalloc.start()
+            message = t.check_storage("✅", "🔥")
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        assert message.startswith("✅ (33.6 MB, upload ")
+        assert peak < 8 * 1048576
+
+    def test_checksum_mismatch(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            login(t)
+            with patch.object(cgwire_checks.GeneratedFile, "digest", return_value=""):
+                message = t.check_storage("✅", "🔥")
+        assert message == (
+            f"🔥\ndownload answered 200, {t.storage_size} bytes not matching the upload"
+        )
+        assert t.status == 1
+        assert stand_in.server.comments == {}
+
+    def test_errors(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            assert t.check_storage("✅", "🔥") == (
+                "🔥\nGET /api/data/tasks/task-1 answered 401\n"
+                '{"msg": "Missing Authorization Header"}'
+            )
+            login(t)
+            with patch.object(t, "download", side_effect=ValueError("broken")):
+                assert t.check_storage("✅", "🔥") == "🔥\nbroken"
+            assert stand_in.server.comments == {}
+            call_api = t.call_api
+
+            def undeletable(path, data=None, method=None):
+                if method == "DELETE":
+                    raise ValueError("DELETE answered 403")
+                return call_api(path, data, method)
+
+            with (
+                patch("builtins.print") as mock_print,
+                patch.object(t, "call_api", side_effect=undeletable),
+            ):
+                assert t.check_storage("✅", "🔥").startswith("✅ (3.1 MB")
+            assert len(stand_in.server.comments) == 1
+        comment = list(stand_in.server.comments)[0]
+        mock_print.assert_called_once_with(
+            f"🔥 Comment {comment} of task task-1 not deleted: DELETE answered 403"
+        )
+
+    def test_metrics(self):
+        t, rendered = probe_metrics(self.probe)
+        labels = f'target="{t.base_url}",direction="upload"'
+        assert f"kitsu_storage_throughput_bytes_per_second{{{labels}}} " in rendered
+
+
+class TestProcessing(TestCase):
+    probe = {"processing_task": "task-1", "poll_interval": 0.01, "sleep": 0.02}
+
+    def test_default_checks(self):
+        assert_probe_check(self.probe, "11a", "check_processing")
+
+    def test_generate_avi(self):
+        video = cgwire_checks.generate_avi(width=10, height=4, frames=3, fps=5)
+        assert video[:4] == b"RIFF"
+        assert int.from_bytes(video[4:8], "little") == len(video) - 8
+        assert video[8:12] == b"AVI "
+        avih = video.index(b"avih") + 8
+        assert struct.unpack("<14I", video[avih : avih + 56])[4] == 3
+        assert struct.unpack("<14I", video[avih : avih + 56])[8:10] == (10, 4)
+        movi = video.index(b"movi")
+        idx1 = video.index(b"idx1") + 8
+        # Index offsets are relative to the movi list
+        offsets = [
+            struct.unpack("<4s3I", video[idx1 + 16 * i : idx1 + 16 * (i + 1)])[2]
+            for i in range(3)
+        ]
+        assert [video[movi + offset : movi + offset + 4] for offset in offsets] == (
+            3 * [b"00db"]
+        )
+        # Rows of 30 bytes are padded to 32
+        assert int.from_bytes(video[movi + 8 : movi + 12], "little") == 4 * 32
+
+    def test_processing(self):
+        with bench_cgwire_checks.StandIn(
+            queue_delay=0.05, processing_delay=0.1
+        ) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            messages = list(run_checks(t, default_checks(t)))
+        assert t.status == 0, messages
+        assert messages[-1].startswith(
+            "✅ 11a Check preview processing /api/data/preview-files (upload "
+        )
+        assert messages[-1].endswith(" ms)")
+        assert t.processing["queue_ms"] >= 50
+        assert t.processing["queue_ms"] + t.processing["processing_ms"] >= 150
+        self.assertAlmostEqual(
+            t.processing["total_ms"],
+            t.processing["upload_ms"]
+            + t.processing["queue_ms"]
+            + t.processing["processing_ms"],
+        )
+        assert stand_in.server.comments == stand_in.server.previews == {}
+
+    def test_slo(self):
+        with bench_cgwire_checks.StandIn(processing_delay=0.1) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            t.slo_ms = {"processing": 50}
+            login(t)
+            message = t.check_processing("✅", "🔥")
+        assert message.startswith("🔥 (upload ")
+        assert message.endswith(" ms)\nslower than 50 ms")
+        assert t.status == 1
+
+    def test_deadline(self):
+        with bench_cgwire_checks.StandIn(processing_delay=5) as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            t.processing_deadline = 0.1
+            login(t)
+            start = time.monotonic()
+            message = t.check_processing("✅", "🔥")
+            assert time.monotonic() - start < 1
+            assert stand_in.server.comments == {}
+        assert message == "🔥\nstill processing after 0.1s"
+        assert t.processing is None
+        assert t.status == 1
+
+    def test_broken(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            login(t)
+            with patch("cgwire_checks.generate_avi", return_value=b"not a video"):
+                message = t.check_processing("✅", "🔥")
+        assert message.startswith("🔥 (upload ")
+        assert message.endswith(" ms)\npreview broken")
+
+    def test_metrics(self):
+        t, rendered = probe_metrics(self.probe)
+        labels = f'target="{t.base_url}",phase="queue"'
+        assert f"kitsu_preview_processing_seconds{{{labels}}} " in rendered
+
+
+class TestHealth(TestCase):
+    probe = {"health_probe": True}
+
+    def test_default_checks(self):
+        t = CheckURL("http://127.0.0.1")
+        assert "12a" not in [check.name for check in default_checks(t)]
+        t.health_probe = True
+        checks = default_checks(t)[-4:]
+        assert [check.name for check in checks] == ["12a", "12b", "13a", "13b"]
+        assert checks[1].requires == ("12a",)
+        assert checks[3].requires == ("13a",)
+
+    def test_health(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            t.resource_limits = {"cpu": 90, "memory": 90}
+            messages = list(run_checks(t, default_checks(t)))
+        assert t.status == 0, messages
+        assert messages[-4].startswith("✅ 12a Check status /api/status (")
+        assert messages[-3] == (
+            "✅ 12b  Check components (database up, event-stream up, indexer up,"
+            " job-queue up, key-value-store up)"
+        )
+        assert messages[-2].startswith("✅ 13a Check resources /api/status/resources (")
+        assert messages[-1] == (
+            "✅ 13b  Check resource usage (cpu 20.0%, memory 40.0%, load 0.5)"
+        )
+
+    def test_component_down(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            stand_in.server.components["indexer"] = False
+            t = probe_checker(stand_in.url, **self.probe)
+            t.check_url("/api/status", "✅", "🔥", name="12a")
+            message = t.check_components("✅", "🔥", name="12a")
+        assert message.startswith("🔥 (database up")
+        assert "indexer down" in message
+        assert t.components["indexer"] is False
+        assert t.status == 1
+
+    def test_limits(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            stand_in.server.resources["memory"]["percent"] = 95.5
+            t = probe_checker(stand_in.url, **self.probe)
+            t.resource_limits = {"memory": 90, "load": 0.2, "cpu": None}
+            t.check_url("/api/status/resources", "✅", "🔥", name="13a")
+            message = t.check_resources("✅", "🔥", name="13a")
+        assert message == (
+            "🔥 (cpu 20.0%, memory 95.5%, load 0.5)\nmemory above 90%\nload above 0.2"
+        )
+        assert t.status == 1
+
+    def test_unexpected_answers(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            stand_in.server.resources = {"cpu": "busy"}
+            t = probe_checker(stand_in.url, **self.probe)
+            t.check_url("/api/status/resources", "✅", "🔥", name="13a")
+            assert t.check_resources("✅", "🔥", name="13a") == '🔥\n{"cpu": "busy"}'
+            t.check_url("/", "✅", "🔥", name="12a")
+            assert t.check_components("✅", "🔥", name="12a").startswith(
+                "🔥\n<title>Kitsu</title>"
+            )
+        assert t.check_components("✅", "🔥", name="unknown") == "🔥"
+        assert t.check_resources("✅", "🔥", name="unknown") == "🔥"
+
+    def test_resource_usage(self):
+        assert cgwire_checks.resource_usage(
+            {"cpu": {"percent": 12, "loadavg": [1.5, 1, 0.5]}, "memory": {}}
+        ) == {"cpu": 12, "load": 1.5}
+        assert cgwire_checks.resource_usage({"cpu": {"percent": []}}) == {}
+
+    def test_metrics(self):
+        metrics = Metrics()
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            list(run_suite(t, metrics=metrics))
+        rendered = metrics.render()
+        labels = f'target="{stand_in.url}"'
+        assert f'kitsu_component_up{{{labels},component="indexer"}} 1\n' in rendered
+        assert f'kitsu_resource_usage{{{labels},resource="cpu"}} 20.0\n' in rendered
+        t.reset()
+        assert t.components == t.resources == {}
+
+
+class TestCapacity(TestCase):
+    def test_ramp(self):
+        # Two workers answering in 30 ms saturate beyond two logins at once
+        with bench_cgwire_checks.StandIn(latency=0.03, workers=2) as stand_in:
+            t = CheckURL(stand_in.url)
+            steps = list(
+                cgwire_checks.find_capacity(t, [1, 2, 8, 16], 0.3, max_p95_ms=80)
+            )
+        assert [step["concurrency"] for step in steps] == [1, 2, 8]
+        assert [step["sustainable"] for step in steps] == [True, True, False]
+        assert steps[0]["error_rate"] == 0
+        assert 30 <= steps[0]["p50_ms"] <= steps[0]["p95_ms"] <= steps[0]["max_ms"]
+        assert steps[2]["p95_ms"] > 80
+        assert 15 < steps[1]["throughput"] < 80
+        assert t.tokens["access_token"] == bench_cgwire_checks.TOKEN
+        assert t.responses == {}
+        assert cgwire_checks.format_capacity_step(steps[0]).startswith(
+            "✅ Concurrency 1: "
+        )
+        assert "🔥 Concurrency 8: " in cgwire_checks.format_capacity_step(steps[2])
+
+    def test_errors(self):
+        with bench_cgwire_checks.StandIn(error_rate=1) as stand_in:
+            t = CheckURL(stand_in.url)
+            steps = list(cgwire_checks.find_capacity(t, [1, 2], 0.1))
+        assert len(steps) == 1
+        assert steps[0]["error_rate"] == 1
+        assert steps[0]["p95_ms"] is None
+        assert steps[0]["sustainable"] is False
+        assert cgwire_checks.format_capacity_step(steps[0]) == (
+            "🔥 Concurrency 1: 0.0 logins/s, 100.0% errors"
+        )
+
+    def test_pool_grown(self):
+        for transport in cgwire_checks.TRANSPORTS:
+            with bench_cgwire_checks.StandIn() as stand_in:
+                t = CheckURL(stand_in.url)
+                t.transport_name = transport
+                # A transport built with the default pool of 10 is replaced
+                t.transport
+                steps = list(cgwire_checks.find_capacity(t, [12, 16], 0.3))
+                stats = t.connection_stats()
+                t.close()
+            assert [step["error_rate"] for step in steps] == [0, 0], transport
+            assert t.pool_size == 16
+            assert stats["opened"] <= 16, (transport, stats)
+            assert stats["reused"] > stats["opened"], (transport, stats)
+
+    def test_connection_error(self):
+        t = CheckURL("http://127.0.0.1:1")
+        latencies, failed, elapsed = cgwire_checks.login_step(t, 2, 0.05)
+        assert latencies == []
+        assert failed >= 2
+        assert elapsed >= 0.05
+
+
+class TestSoak(TestCase):
+    def test_histogram(self):
+        histogram = cgwire_checks.Histogram()
+        first, second = cgwire_checks.Histogram(), cgwire_checks.Histogram()
+        for value in range(1, 100001):
+            histogram.add(value / 10)
+            (first if value % 2 else second).add(value / 10)
+        assert len(histogram.buckets) < 1200
+        self.assertAlmostEqual(histogram.quantile(0.5), 5000, delta=50)
+        self.assertAlmostEqual(histogram.quantile(0.95), 9500, delta=95)
+        assert histogram.quantile(1) == histogram.max == 10000
+        first.merge(second)
+        assert first.buckets == histogram.buckets
+        assert first.count == histogram.count == 100000
+        assert cgwire_checks.Histogram().quantile(0.5) is None
+
+    def test_steady(self):
+        with bench_cgwire_checks.StandIn(latency=0.02) as stand_in:
+            t = CheckURL(stand_in.url)
+            # 6 requests per cycle as 07a is cached, a cycle every 0.043 s
+            soak = cgwire_checks.Soak(t, 0.5, rate=140, window=0.1)
+            windows = list(soak.run())
+            messages = soak.report()
+        assert t.status == 0, messages
+        assert windows == soak.windows
+        assert 4 <= len(windows) <= 6
+        checks = sum(window.checks for window in windows)
+        assert 5 * 13 <= checks <= 12 * 13
+        # 07a shares the response of 02a, so it is timed once
+        for window in windows:
+            assert window.latency.count == window.checks // 13 * 6
+        assert windows[1].start == windows[0].start + windows[0].length
+        assert windows[0].usage() == {"cpu": 20, "memory": 40, "load": 0.5}
+        assert messages[0].startswith("✅ Soak latency p95 ")
+        assert "✅ Soak memory 40.0% → 40.0% (+0.0)" in messages
+        assert messages[-1] == f"✅ Soak checks: 0 failed out of {checks}"
+        assert cgwire_checks.format_soak_window(windows[0]).startswith(
+            f"✅ Soak 0:00:00 +0s: {windows[0].checks} checks, 0 failed, p50 "
+        )
+
+    def test_drift(self):
+        with bench_cgwire_checks.StandIn(latency=0.01) as stand_in:
+            t = CheckURL(stand_in.url)
+            soak = cgwire_checks.Soak(t, 1.2, rate=140, window=0.05, max_windows=8)
+            memory = stand_in.server.resources["memory"]
+            threading.Timer(0.6, memory.__setitem__, ("percent", 50)).start()
+            threading.Timer(0.6, setattr, (stand_in.server, "latency", 0.1)).start()
+            for window in soak.run():
+                # Windows are merged in pairs, so they stay few
+                assert len(soak.windows) < 8
+            messages = soak.report()
+        assert soak.window > 0.05
+        assert soak.windows[0].length > 0.1
+        assert t.status == 1
+        assert messages[0].startswith("🔥 Soak latency p95 ")
+        assert "🔥 Soak memory 40.0% → 50.0% (+10.0)" in messages
+        assert "✅ Soak cpu 20.0% → 20.0% (+0.0)" in messages
+
+    def test_failures(self):
+        with bench_cgwire_checks.StandIn(error_rate=1) as stand_in:
+            t = CheckURL(stand_in.url)
+            soak = cgwire_checks.Soak(t, 0.1, rate=70, window=1)
+            windows = list(soak.run())
+            messages = soak.report()
+        assert len(windows) == 1
+        assert windows[0].resources == {}
+        assert windows[0].failed == windows[0].checks
+        # The 502 answers are timed as well
+        assert messages[0].startswith("✅ Soak latency p95 ")
+        assert messages[1:] == [
+            f"🔥 Soak checks: {windows[0].failed} failed out of {windows[0].checks}"
+        ]
+        assert t.status == 1
+        assert cgwire_checks.format_soak_window(windows[0]).startswith("🔥 Soak ")
+        unreachable = cgwire_checks.Soak(CheckURL("http://127.0.0.1:1"), 1)
+        assert unreachable.usage() == {}
+
+    def test_no_window(self):
+        t = CheckURL("http://127.0.0.1:1")
+        soak = cgwire_checks.Soak(t, 0)
+        assert soak.report() == ["🔥 Soak: no window recorded"]
+        assert t.status == 1
+
+
+class TestJourneys(TestCase):
+    def test_default_journey(self):
+        with bench_cgwire_checks.StandIn(latency=0.005) as stand_in:
+            t = CheckURL(stand_in.url)
+            steps = cgwire_checks.default_journey(t)
+            stats, elapsed = cgwire_checks.run_journeys(
+                t, steps, users=3, duration=0.5, think_time=(0, 0.01)
+            )
+            # Every comment of the journeys was deleted
+            assert stand_in.server.comments == {}
+        assert list(stats.steps) == [
+            "login",
+            "context",
+            "projects",
+            "tasks",
+            "comment",
+            "uncomment",
+            "logout",
+        ]
+        assert stats.failed_journeys == 0
+        assert stats.journeys.count >= 3
+        assert stats.steps["login"].count >= stats.journeys.count
+        assert stats.journeys.quantile(0.5) > stats.steps["login"].quantile(0.5)
+        assert elapsed >= 0.5
+        # The virtual users logged in on their own sessions
+        assert t.tokens == {}
+        assert t._transport is None
+        messages = stats.report(elapsed)
+        assert len(messages) == 8
+        assert messages[0].startswith("✅ Journey step login: ")
+        assert messages[-1].startswith(
+            f"✅ Journeys: {stats.journeys.count} passed, 0 failed, "
+        )
+        assert " ms, p95 " in messages[-1]
+
+    def test_no_task_to_check(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            stand_in.server.tasks_to_check = []
+            t = CheckURL(stand_in.url)
+            steps = cgwire_checks.default_journey(t)
+            stats, elapsed = cgwire_checks.run_journeys(
+                t, steps, users=2, duration=0.2, think_time=(0, 0.01)
+            )
+            assert stand_in.server.comments == {}
+        assert stats.failed_journeys == 0
+        assert stats.journeys.count >= 2
+        assert stats.steps["comment"].count == stats.steps["uncomment"].count == 0
+        assert stats.skipped["comment"] == stats.skipped["uncomment"]
+        assert stats.skipped["comment"] == stats.steps["logout"].count
+        messages = stats.report(elapsed)
+        assert messages[4].startswith(
+            f"✅ Journey step comment: 0 passed, 0 failed, "
+            f"{stats.skipped['comment']} skipped, 0.0/s"
+        )
+        assert messages[3].startswith("✅ Journey step tasks: ")
+        assert "skipped" not in messages[3]
+
+    def test_failed_step(self):
+        steps = [
+            cgwire_checks.Step(
+                "login",
+                "/api/auth/login",
+                "POST",
+                {"email": "admin@example.com", "password": "mysecretpassword"},
+                assertion="check_login",
+                auth=False,
             ),
-            requests.exceptions.ReadTimeout(
-                "Server did not respond within the specified timeout"
+            cgwire_checks.Step(
+                "projects", "/api/data/projects/open", keep={"task": "1.id"}
             ),
-            requests.exceptions.ReadTimeout(
-                "Server did not respond within the specified timeout"
+            cgwire_checks.Step("task", "/api/data/tasks/{task}"),
+        ]
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = CheckURL(stand_in.url)
+            stats, elapsed = cgwire_checks.run_journeys(
+                t, steps, users=2, duration=0.2, think_time=(0.01, 0.01)
+            )
+        assert stats.journeys.count == 0
+        assert stats.failed_journeys == stats.failed["projects"] > 0
+        assert stats.steps["task"].count == stats.failed["task"] == 0
+        messages = stats.report(elapsed)
+        assert messages[1].startswith("🔥 Journey step projects: 0 passed, ")
+        assert messages[-1].startswith("🔥 Journeys: 0 passed, ")
+
+    def test_step(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            user = cgwire_checks.virtual_user(CheckURL(stand_in.url))
+            values = {}
+            step = cgwire_checks.Step("task", "/api/data/tasks/{task}")
+            assert not step.run(user, values)
+            values["task"] = "stand-in-task"
+            # Not logged in
+            assert not step.run(user, values)
+            user.tokens = {"access_token": bench_cgwire_checks.TOKEN}
+            assert step.run(user, values)
+            step = cgwire_checks.Step("version", "/.version.txt", keep={"v": "v"})
+            assert not step.run(user, values)
+            step = cgwire_checks.Step(
+                "api", "/api", keep={"v": "v"}, auth=False, optional=True
+            )
+            assert step.run(user, values)
+            assert "v" not in values
+            step = cgwire_checks.Step("task", "/api/data/tasks/{v}", requires=["v"])
+            assert step.run(user, values) is None
+            user.close()
+        user = cgwire_checks.virtual_user(CheckURL("http://127.0.0.1:1"))
+        assert not cgwire_checks.Step("front", "/", auth=False).run(user, {})
+
+    def test_read_journey(self):
+        file = io.StringIO(
+            json.dumps(
+                [
+                    {"name": "api", "url": "/api", "auth": False},
+                    {
+                        "name": "comment",
+                        "url": "/api/actions/tasks/{task}/comment",
+                        "method": "POST",
+                        "data": {"comment": "Looks good"},
+                        "error_code": 201,
+                        "keep": {"comment": "id"},
+                    },
+                ]
+            )
+        )
+        api, comment = cgwire_checks.read_journey(file)
+        assert (api.name, api.url, api.method, api.auth) == (
+            "api",
+            "/api",
+            "GET",
+            False,
+        )
+        assert api.keep == {}
+        assert comment.method == "POST"
+        assert comment.error_code == 201
+        assert comment.keep == {"comment": "id"}
+
+    def test_json_path(self):
+        body = {"tasks": [{"id": "a"}, {"id": "b"}]}
+        assert cgwire_checks.json_path(body, "tasks.1.id") == "b"
+        with self.assertRaises(KeyError):
+            cgwire_checks.json_path(body, "projects")
+
+
+class TestWarmUp(TestCase):
+    def test_asset_paths(self):
+        html = """<!DOCTYPE html><html><head>
+            <link rel="icon" href="/favicon.ico">
+            <link rel="stylesheet" href="assets/index.css">
+            <link rel="modulepreload" href="/kitsu/assets/vendor.js?v=2">
+            <script type="module" src="https://kitsu.example/kitsu/assets/index.js">
+            </script>
+            <script src="https://cdn.example/analytics.js"></script>
+            <script>window.config = {}</script>
+            <link rel="stylesheet" href="assets/index.css">
+            </head></html>"""
+        assert cgwire_checks.asset_paths(html, "https://kitsu.example/kitsu") == [
+            "/assets/index.css",
+            "/assets/vendor.js?v=2",
+            "/assets/index.js",
+        ]
+        assert cgwire_checks.asset_paths(html, "https://other.example") == [
+            "/assets/index.css",
+            "/kitsu/assets/vendor.js?v=2",
+        ]
+
+    def test_warm_up(self):
+        with bench_cgwire_checks.StandIn(cold_hits=2, cold_latency=0.05) as stand_in:
+            t = CheckURL(stand_in.url)
+            routes = cgwire_checks.asset_paths(
+                t.send(f"{stand_in.url}/").text, t.base_url
+            )
+            assert routes == ["/assets/index.js", "/assets/index.css"]
+            routes += list(cgwire_checks.WARM_ROUTES) + ["/api/data/unknown"]
+            results = cgwire_checks.warm_up(t, routes)
+        assert list(results) == routes
+        for route in routes[:-1]:
+            result = results[route]
+            assert result["warm"], (route, result)
+            assert result["cold_ms"] >= 50
+            assert result["warm_ms"] < 50
+            assert result["rounds"] >= 5
+            message = cgwire_checks.format_warm_up(route, result)
+            assert message.startswith(f"✅ Warm-up {route}: cold ")
+            assert message.endswith(f" ms after {result['rounds']} rounds")
+        assert results["/api/data/unknown"]["rounds"] == 1
+        assert not results["/api/data/unknown"]["warm"]
+        assert cgwire_checks.format_warm_up(
+            "/api/data/unknown", results["/api/data/unknown"]
+        ) == ("🔥 Warm-up /api/data/unknown: answered 404")
+
+    def test_not_stable(self):
+        with bench_cgwire_checks.StandIn(cold_hits=1, cold_latency=0.1) as stand_in:
+            t = CheckURL(stand_in.url)
+            results = cgwire_checks.warm_up(t, ["/api"], max_rounds=2)
+        assert results["/api"]["rounds"] == 2
+        assert not results["/api"]["warm"]
+        assert cgwire_checks.format_warm_up("/api", results["/api"]).endswith(
+            " after 2 rounds, not stable"
+        )
+        t = CheckURL("http://127.0.0.1:1")
+        results = cgwire_checks.warm_up(t, ["/api"])
+        assert results["/api"] == {
+            "cold_ms": None,
+            "warm_ms": None,
+            "rounds": 1,
+            "status_code": None,
+            "size": None,
+            "warm": False,
+        }
+        assert cgwire_checks.format_warm_up("/api", results["/api"]) == (
+            "🔥 Warm-up /api: no answer"
+        )
+
+    def test_bodies_drained(self):
+        routes = list(bench_cgwire_checks.ASSETS)
+        for transport in cgwire_checks.TRANSPORTS:
+            with bench_cgwire_checks.StandIn() as stand_in:
+                t = CheckURL(stand_in.url)
+                t.transport_name = transport
+                # The bundles are larger than max_body, read past it
+                t.prefetch, t.max_body = 4096, 20000
+                results = cgwire_checks.warm_up(t, routes, max_rounds=2)
+                t.close()
+            for route, (body, _) in bench_cgwire_checks.ASSETS.items():
+                assert results[route]["size"] == len(body), (transport, route)
+                assert results[route]["rounds"] == 2
+
+    def test_is_warm(self):
+        assert not cgwire_checks.is_warm([10, 10], 3, 0.2)
+        assert cgwire_checks.is_warm([300, 100, 110, 120], 3, 0.2)
+        assert not cgwire_checks.is_warm([100, 110, 140], 3, 0.2)
+        # Spreads of a few ms are noise
+        assert cgwire_checks.is_warm([1, 5, 2], 3, 0.2)
+
+
+class TestAssets(TestCase):
+    probe = {"assets_probe": True}
+
+    def test_default_checks(self):
+        t = CheckURL("http://127.0.0.1")
+        assert "01c" not in [check.name for check in default_checks(t)]
+        t.assets_probe = True
+        checks = default_checks(t)
+        assert [check.name for check in checks[:4]] == ["01a", "01b", "01c", "02a"]
+        assert checks[0].read_body
+        assert checks[2].requires == ("01a",)
+
+    def test_assets(self):
+        transports = ["requests", "stdlib"] + (["http2"] if h2 else [])
+        for transport in transports:
+            with bench_cgwire_checks.StandIn() as stand_in:
+                t = probe_checker(stand_in.url, **self.probe)
+                t.transport_name = transport
+                messages = list(run_checks(t, default_checks(t)))
+            assert t.status == 0, messages
+            first, script, stylesheet = messages[2].split("\n")
+            assert first.startswith("✅ 01c  Check front assets (2 assets, ")
+            assert first.endswith(" kB on the wire, 54.6 kB decoded)")
+            assert script.startswith("✅ /assets/index.js: 0.1 kB gzip, 33.0 kB")
+            assert stylesheet.startswith("✅ /assets/index.css: ")
+            asset = t.assets["/assets/index.js"]
+            body, _ = bench_cgwire_checks.ASSETS["/assets/index.js"]
+            assert asset["decoded_bytes"] == len(body)
+            assert asset["wire_bytes"] == len(gzip.compress(body))
+            assert asset["encoding"] == "gzip"
+            assert asset["cache_control"] == bench_cgwire_checks.ASSET_CACHE_CONTROL
+            assert asset["etag"].startswith('"')
+
+    def test_large_index(self):
+        index_assets = 200000 * b" " + bench_cgwire_checks.INDEX_ASSETS
+        for transport in ("requests", "stdlib"):
+            with (
+                patch.object(bench_cgwire_checks, "INDEX_ASSETS", index_assets),
+                bench_cgwire_checks.StandIn() as stand_in,
+            ):
+                t = probe_checker(stand_in.url, **self.probe)
+                t.transport_name = transport
+                # 01b runs before 01c and stops reading at Kitsu
+                messages = list(run_checks(t, default_checks(t), workers=1))
+                assert messages[2].startswith("✅ 01c  Check front assets (2 assets")
+
+                t.cache.clear()
+                t.max_body = 100000
+                t.check_url("/", "✅", "🔥", name="01a")
+                assert t.check_assets("✅", "🔥", name="01a") == (
+                    "🔥\nno scripts or stylesheets referenced in the first 100000"
+                    " bytes, page truncated"
+                )
+
+    def test_misconfigured(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            stand_in.server.compress = False
+            stand_in.server.asset_headers = {
+                "Cache-Control": "max-age=60",
+                "ETag": None,
+            }
+            t = probe_checker(stand_in.url, **self.probe)
+            t.asset_budget = 30000
+            t.assets_budget = 50000
+            messages = list(run_checks(t, default_checks(t)))
+        assert t.status == 1
+        assert messages[2].split("\n") == [
+            "🔥 01c  Check front assets"
+            " (2 assets, 54.6 kB on the wire, 54.6 kB decoded)",
+            "🔥 /assets/index.js: 33.0 kB identity, 33.0 kB decoded,"
+            f" {t.assets['/assets/index.js']['ms']:.1f} ms, not compressed (identity),"
+            " Cache-Control max-age=60, no ETag, above 30000 bytes",
+            "🔥 /assets/index.css: 21.6 kB identity, 21.6 kB decoded,"
+            f" {t.assets['/assets/index.css']['ms']:.1f} ms, not compressed (identity),"
+            " Cache-Control max-age=60, no ETag",
+            "🔥 total above 50000 bytes",
+        ]
+
+    def test_errors(self):
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            t.check_url("/", "✅", "🔥", name="01a")
+            with patch.object(
+                t,
+                "fetch_asset",
+                side_effect=requests.exceptions.ConnectionError("refused"),
+            ):
+                message = t.check_assets("✅", "🔥", name="01a")
+            assert message.split("\n") == [
+                "🔥 (2 assets, 0.0 kB on the wire, 0.0 kB decoded)",
+                "🔥 /assets/index.js: refused",
+                "🔥 /assets/index.css: refused",
+            ]
+            t.check_url("/api", "✅", "🔥", name="02a")
+            assert t.check_assets("✅", "🔥", name="02a") == (
+                "🔥\nno scripts or stylesheets referenced"
+            )
+            assert t.check_assets("✅", "🔥", name="unknown") == "🔥"
+            with patch.dict(bench_cgwire_checks.ASSETS):
+                del bench_cgwire_checks.ASSETS["/assets/index.css"]
+                t.check_url("/", "✅", "🔥", name="01a")
+                message = t.check_assets("✅", "🔥", name="01a")
+            assert message.split("\n")[0].startswith("🔥 (2 assets, 0.1 kB on ")
+            assert message.split("\n")[2] == "🔥 /assets/index.css: answered 404"
+
+    def test_body_decoder(self):
+        body = 100 * b"Kitsu "
+        for encoding, encoded in (
+            ("gzip", gzip.compress(body)),
+            ("deflate", zlib.compress(body)),
+            ("identity", body),
+            ("", body),
+        ):
+            decompress = cgwire_checks.body_decoder(encoding)
+            assert decompress(encoded[:10]) + decompress(encoded[10:]) == body
+        assert cgwire_checks.body_decoder("zstd") is None
+        with patch.dict(sys.modules, {"brotli": None, "brotlicffi": None}):
+            assert cgwire_checks.body_decoder("br") is None
+
+        class Decompressor:
+            def process(self, chunk):
+                return chunk.upper()
+
+        brotli = MagicMock(spec=["Decompressor"], Decompressor=Decompressor)
+        with patch.dict(sys.modules, {"brotli": brotli}):
+            assert cgwire_checks.body_decoder("br")(b"kitsu") == b"KITSU"
+
+    def test_long_lived(self):
+        assert cgwire_checks.long_lived("public, max-age=31536000, immutable")
+        assert cgwire_checks.long_lived("immutable")
+        assert cgwire_checks.long_lived("Max-Age=86400")
+        assert not cgwire_checks.long_lived("max-age=3600")
+        assert not cgwire_checks.long_lived("no-cache, max-age=31536000")
+        assert not cgwire_checks.long_lived("")
+
+    def test_asset_problems(self):
+        asset = {
+            "status_code": 200,
+            "wire_bytes": 800,
+            "decoded_bytes": None,
+            "encoding": "br",
+            "cache_control": "immutable",
+            "etag": '"1"',
+        }
+        assert cgwire_checks.asset_problems(asset, 1000) == []
+        # Small bodies are not worth compressing
+        asset["encoding"] = "identity"
+        assert cgwire_checks.asset_problems(asset, 1000) == []
+        assert cgwire_checks.format_size(None) == "?"
+
+    def test_metrics(self):
+        metrics = Metrics()
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t = probe_checker(stand_in.url, **self.probe)
+            list(run_suite(t, metrics=metrics))
+        rendered = metrics.render()
+        labels = f'target="{stand_in.url}",asset="/assets/index.js"'
+        assert f'kitsu_asset_bytes{{{labels},kind="decoded"}} 33000\n' in rendered
+        assert f'kitsu_asset_bytes{{{labels},kind="wire"}} ' in rendered
+        t.reset()
+        assert t.assets is None
+
+    @skipIf(httpx is None, "httpx is not installed")
+    def test_async(self):
+        async def run(url):
+            async with AsyncCheckURL(url) as t:
+                t.assets_probe = True
+                messages = [m async for m in run_checks_async(t, default_checks(t))]
+                t.close()
+            return t, messages
+
+        with bench_cgwire_checks.StandIn() as stand_in:
+            t, messages = asyncio.run(run(stand_in.url))
+        assert t.status == 0, messages
+        assert messages[2].startswith("✅ 01c  Check front assets (2 assets, ")
+
+
+class TestStreaming(TestCase):
+    def test_marker_stops_reading(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.prefetch = 1024
+            assert t.check_url("/large", "✅", "🔥") == "✅"
+            assert t.check_if_last_request_is_a_kitsu("✅", "🔥") == "✅"
+            assert len(t.request._body) <= 2 * t.request.chunk_size
+            assert not t.request.truncated
+
+            assert t.check_url("/api", "✅", "🔥") == "✅"
+            assert t.check_if_last_request_is_a_kitsu("✅", "🔥") == "🔥"
+
+    def test_validated_body_stops_reading(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.prefetch = 1024
+            # Out of watch, an ETag does not make the body read in full
+            assert t.check_url("/large-etag", "✅", "🔥") == "✅"
+            assert t.check_if_last_request_is_a_kitsu("✅", "🔥") == "✅"
+            assert len(t.request._body) <= 2 * t.request.chunk_size
+            assert t.validators == {}
+
+            t.conditional = {"/large-etag"}
+            t.cache.clear()
+            assert t.check_url("/large-etag", "✅", "🔥") == "✅"
+            assert len(t.request._body) == t.max_body
+            assert list(t.validators) == [f"{server.url}/large-etag"]
+
+    def test_body_is_capped(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.max_body = 100000
+            assert t.check_url("/large", "✅", "🔥") == "✅"
+            assert len(t.request.text) == 100000
+            assert t.request.truncated
+            assert t.check_if_error("✅", "🔥").endswith("[... 2998996 bytes omitted]")
+
+    def test_error_excerpt(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            assert t.check_url("/error", "✅", "🔥") == (
+                "🔥\n" + 1024 * "e" + "\n[... 3976 bytes omitted]"
+            )
+            t.prefetch = 0
+            assert t.check_url("/short-error", "✅", "🔥") == (
+                "🔥\n" + 1024 * "e" + "\n[... 198976 bytes omitted]"
+            )
+            assert t.check_url("/unsized-error", "✅", "🔥") == (
+                "🔥\n" + 1024 * "e" + "\n[... more bytes omitted]"
+            )
+            assert t.status == 1
+
+    def test_stalled_body(self):
+        checks = [
+            Check("01a", "✅ 01a", "🔥 01a", "/stalled"),
+            Check(
+                "01b",
+                "✅ 01b",
+                "🔥 01b",
+                assertion="check_if_last_request_is_a_kitsu",
+                requires=["01a"],
             ),
         ]
+        for transport in ("requests", "stdlib"):
+            with LocalServer() as server:
+                t = CheckURL(server.url)
+                t.transport_name = transport
+                t.timeout = 0.2
+                messages = list(run_checks(t, checks))
+            assert messages[0].startswith("✅ 01a")
+            assert messages[1].startswith("🔥 01b\nbody read failed: ")
+            assert t.responses["01a"].truncated
+            assert t.status == 1
 
-        with patch("requests.get", side_effect=mock_responses) as mock_request:
-            with patch("time.sleep") as mock_sleep:
-                with patch("builtins.print") as mock_print:
-                    self.t.retry = 3
-                    self.t.sleep = 2
-                    result = self.t.wait("/api")
-                    assert result is None
-                    assert mock_request.call_count == 3
-                    mock_sleep.assert_has_calls(
-                        [call(2), call(2), call(2)]
-                    )  # Sleep should be called three times for 2 seconds
-                    # Check that dots were printed
-                    mock_print.assert_any_call(".", end="", flush=True)
-                    mock_print.assert_any_call(".", end="", flush=True)
-                    mock_print.assert_any_call(".", end="", flush=True)
+    def test_check_raising(self):
+        t = CheckURL("http://127.0.0.1")
+        checks = [
+            Check("01a", "✅ 01a", "🔥 01a", "/"),
+            Check(
+                "01b",
+                "✅ 01b",
+                "🔥 01b",
+                assertion="check_if_last_request_is_a_zou",
+                requires=["01a"],
+            ),
+            Check("02a", "✅ 02a", "🔥 02a", "/api"),
+        ]
+        response = fake_response(200, "<title>Kitsu</title>")
+        with patch("requests.Session.get", return_value=response):
+            messages = list(run_checks(t, checks))
+        assert messages[0].startswith("✅ 01a")
+        assert messages[1].startswith("🔥 01b\nJSONDecodeError(")
+        assert messages[2].startswith("✅ 02a")
+        assert t.status == 1
+
+    def test_mocked_excerpt(self):
+        t = CheckURL("http://127.0.0.1")
+        t.excerpt_size = 10
+        with patch("requests.Session.get") as mock_request:
+            mock_request.return_value.status_code = 502
+            mock_request.return_value.text = "<html>502 Bad Gateway</html>"
+            assert (
+                t.check_url("/", "✅", "🔥") == "🔥\n<html>502 \n[... 18 bytes omitted]"
+            )
+
+
+class TestStdlibTransport(TestCase):
+    def checker(self, url):
+        t = CheckURL(url)
+        t.transport_name = "stdlib"
+        return t
+
+    def test_default_checks(self):
+        with LocalServer() as server:
+            t = self.checker(server.url)
+            t.kitsu_version = t.zou_version = "0.17.30"
+            checks = default_checks(t)
+            messages = list(run_checks(t, checks, workers=4))
+        assert [message[:5] for message in messages] == [
+            f"✅ {check.name}" for check in checks
+        ]
+        assert t.status == 0
+        stats = t.connection_stats()
+        assert stats["requests"] == 6
+        assert stats["reused"] == stats["requests"] - stats["opened"] > 0
+        assert set(t.responses["02a"].timings) >= {"dns", "connect", "ttfb", "total"}
+        t.close()
+        assert t.connection_stats()["requests"] == 0
+
+    def test_streaming(self):
+        with LocalServer() as server:
+            t = self.checker(server.url)
+            t.prefetch = 1024
+            assert t.check_url("/large", "✅", "🔥") == "✅"
+            assert t.check_if_last_request_is_a_kitsu("✅", "🔥") == "✅"
+            assert not t.request.truncated
+            assert t.check_url("/unsized-error", "✅", "🔥") == (
+                "🔥\n" + 1024 * "e" + "\n[... more bytes omitted]"
+            )
+            assert t.check_url("/api", "✅", "🔥") == "✅"
+        assert t.connection_stats()["opened"] == 3
+
+    def test_conditional_requests(self):
+        with LocalServer() as server:
+            t = self.checker(server.url)
+            t.keep_alive = False
+            t.conditional = set(cgwire_checks.CONDITIONAL)
+            assert t.check_url("/", "✅", "🔥", name="01a") == "✅"
+            t.cache.clear()
+            assert t.check_url("/", "✅", "🔥", name="01a") == "✅"
+            assert t.responses["01a"].not_modified
+            assert t.check_if_last_request_is_a_kitsu("✅", "🔥", "01a") == "✅"
+        assert [hit[2] for hit in server.server.hits] == [200, 304]
+        assert t.connection_stats() == {"requests": 2, "opened": 2, "reused": 0}
+
+    def test_connection_error(self):
+        with LocalServer() as server:
+            url = server.url
+        t = self.checker(url)
+        t.max_retries = 2
+        with patch("time.sleep") as mock_sleep:
+            assert t.check_url("/api", "✅", "🔥") == "🔥"
+        assert mock_sleep.call_count == 2
+        assert t.status == 1
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror):
+            assert self.checker(url).check_url("/api", "✅", "🔥") == "🔥"
+
+        t.sleep = 0
+        t.wait_deadline = 0.1
+        with patch("builtins.print"):
+            assert t.wait("/api") is None
+
+    def test_wait(self):
+        with LocalServer() as server:
+            t = self.checker(server.url)
+            with patch("builtins.print"):
+                assert t.wait("/api") is True
+            assert t.check_url("/api", "✅", "🔥") == "✅"
+            # Idle connections closed under the pool are replaced
+            for connections in t.transport._idle.values():
+                for connection in connections:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+            assert t.check_url("/", "✅", "🔥") == "✅"
+        assert t.connection_stats() == {"requests": 3, "opened": 2, "reused": 1}
+
+    def test_sent_request_is_not_retried(self):
+        class SlowHandler(KitsuHandler):
+            def do_POST(self):
+                self.server.hits.append((self.command, self.path, None))
+                time.sleep(0.5)
+                super().do_POST()
+
+        with LocalServer(SlowHandler) as server:
+            t = self.checker(server.url)
+            t.max_retries = 2
+            assert t.check_url("/api", "✅", "🔥") == "✅"
+            data = {"email": "admin@example.com", "password": "mysecretpassword"}
+            assert t.check_url("/api/auth/login", "✅", "🔥", data, timeout=0.2) == (
+                "🔥"
+            )
+        assert [hit for hit in server.server.hits if hit[0] == "POST"] == [
+            ("POST", "/api/auth/login", None)
+        ]
+
+    def test_import_is_lean(self):
+        modules = "{'requests', 'urllib3', 'httpx', 'asyncio'}"
+        code = f"import sys, cgwire_checks; print(sorted({modules} & set(sys.modules)))"
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        assert output == "[]\n"
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.t = CheckURL("http://127.0.0.1")
+
+    def test_get_is_cached(self):
+        response = fake_response(200, "{}", {"api": "Zou", "version": "0.17.30"})
+        with patch("requests.Session.get", return_value=response) as mock_request:
+            self.t.check_url("/api", "✅", "🔥", name="02a")
+            self.t.check_url("/api", "✅", "🔥", name="07a")
+            assert mock_request.call_count == 1
+        assert self.t.responses["02a"] is self.t.responses["07a"]
+        assert self.t.cache.hits == 1
+        assert self.t.cache.misses == 1
+
+    def test_json_decoded_once(self):
+        response = fake_response(200, "{}", {"api": "Zou", "version": "0.17.41"})
+        self.t.zou_version = "0.17.30"
+        with patch("requests.Session.get", return_value=response):
+            self.t.check_url("/api", "✅", "🔥")
+        assert self.t.check_if_last_request_is_a_zou("✅", "🔥") == "✅"
+        assert self.t.check_if_error("✅", "🔥") == "✅"
+        assert self.t.check_zou_version("✅", "🔥") == "🔥\n0.17.41"
+        response.json.assert_called_once_with()
+
+    def test_json_error_decoded_once(self):
+        response = fake_response(502, "<html>502 Bad Gateway</html>")
+        with patch("requests.Session.get", return_value=response):
+            self.t.check_url("/api", "✅", "🔥")
+        assert self.t.check_if_error("✅", "🔥") == "🔥\n<html>502 Bad Gateway</html>"
+        assert self.t.check_login("✅", "🔥") == "🔥\n<html>502 Bad Gateway</html>"
+        response.json.assert_called_once_with()
+
+    def test_post_is_not_cached(self):
+        response = fake_response(200, '{"login": true}', {"login": True})
+        data = {"email": "admin@example.com", "password": "mysecretpassword"}
+        with patch("requests.Session.post", return_value=response) as mock_request:
+            self.t.check_url("/api/auth/login", "✅", "🔥", data)
+            self.t.check_url("/api/auth/login", "✅", "🔥", data)
+            assert mock_request.call_count == 2
+
+    def test_ttl_and_size(self):
+        cache = ResponseCache(ttl=0)
+        fetch = MagicMock(return_value="response")
+        cache.get(ResponseCache.key("GET", "/api"), fetch)
+        cache.get(ResponseCache.key("GET", "/api"), fetch)
+        assert fetch.call_count == 2
+
+        cache = ResponseCache(ttl=60, size=1)
+        cache.get(ResponseCache.key("GET", "/"), fetch)
+        cache.get(ResponseCache.key("GET", "/api"), fetch)
+        cache.get(ResponseCache.key("GET", "/"), fetch)
+        assert fetch.call_count == 5
+        assert cache.hits == 0
+
+        with patch("time.monotonic", side_effect=[0, 120, 120]):
+            cache = ResponseCache(ttl=60)
+            cache.get(ResponseCache.key("GET", "/"), fetch)
+            cache.get(ResponseCache.key("GET", "/"), fetch)
+        assert fetch.call_count == 7
+
+        assert ResponseCache.key("POST", "/", {"b": 1, "a": 2}) == (
+            "POST",
+            "/",
+            '{"a": 2, "b": 1}',
+        )
+        cache.clear()
+
+
+def httpx_kitsu(request):
+    path = request.url.path
+    if path == "/api/auth/login":
+        if json.loads(request.content)["password"] == "mysecretpassword":
+            return httpx.Response(200, json={"login": True})
+        return httpx.Response(400, json={"login": False})
+    if path == "/api":
+        return httpx.Response(200, json={"api": "Zou", "version": "0.17.30"})
+    if path == "/.version.txt":
+        return httpx.Response(200, text="0.17.30\n")
+    if path == "/":
+        return httpx.Response(200, text="<title>Kitsu</title>")
+    return httpx.Response(502, text="<html>502 Bad Gateway</html>")
+
+
+@skipIf(httpx is None, "httpx is not installed")
+class TestAsyncCheckURL(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.t = AsyncCheckURL("http://127.0.0.1")
+        self.msg_ok = "✅ 01 Check Kitsu /"
+        self.msg_ko = "🔥 01 Check Kitsu /"
+
+    async def asyncTearDown(self):
+        await self.t.aclose()
+
+    def mock(self, handler):
+        self.t.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def test_check_url_root(self):
+        self.mock(httpx_kitsu)
+        assert await self.t.check_url("/", self.msg_ok, self.msg_ko) == self.msg_ok
+        assert self.t.status == 0
+        assert (
+            self.t.check_if_last_request_is_a_kitsu(self.msg_ok, self.msg_ko)
+            == self.msg_ok
+        )
+
+    async def test_check_url_with_502(self):
+        self.mock(httpx_kitsu)
+        assert (
+            await self.t.check_url("/api/ko", self.msg_ok, self.msg_ko)
+        ) == self.msg_ko + "\n<html>502 Bad Gateway</html>"
+        assert self.t.status == 1
+        assert (
+            self.t.check_if_error(self.msg_ok, self.msg_ko)
+            == self.msg_ko + "\n<html>502 Bad Gateway</html>"
+        )
+        assert self.t.check_if_last_request_is_a_zou(self.msg_ok, self.msg_ko) == (
+            self.msg_ko
+        )
+
+    async def test_check_url_with_http_error(self):
+        def handler(request):
+            raise httpx.ConnectError("Connection refused")
+
+        self.mock(handler)
+        assert await self.t.check_url("/", self.msg_ok, self.msg_ko) == self.msg_ko
+        assert self.t.status == 1
+
+    async def test_check_url_timeout(self):
+        async def handler(request):
+            await asyncio.sleep(1)
+
+        self.mock(handler)
+        self.t.timeout = 0.01
+        assert await self.t.check_url("/", self.msg_ok, self.msg_ko) == self.msg_ko
+        assert self.t.status == 1
+
+    async def test_check_url_with_login(self):
+        self.mock(httpx_kitsu)
+        data = {"email": "toto@kitsu", "password": "mysecretpassword"}
+        assert (
+            await self.t.check_url("/api/auth/login", self.msg_ok, self.msg_ko, data)
+            == self.msg_ok
+        )
+        assert self.t.check_if_error(self.msg_ok, self.msg_ko) == self.msg_ok
+        assert self.t.check_login(self.msg_ok, self.msg_ko) == self.msg_ok
+        assert self.t.check_bad_login(self.msg_ok, self.msg_ko) == self.msg_ko
+
+        data["password"] = "not_the_pass"
+        assert (
+            await self.t.check_url(
+                "/api/auth/login", self.msg_ok, self.msg_ko, data, 400, name="04a"
+            )
+            == self.msg_ok
+        )
+        assert self.t.check_bad_login(self.msg_ok, self.msg_ko, "04a") == self.msg_ok
+
+    async def test_wait(self):
+        responses = [httpx.ConnectError("Connection refused"), httpx.Response(200)]
+
+        def handler(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.mock(handler)
+        with patch("asyncio.sleep") as mock_sleep, patch("builtins.print"):
+            assert await self.t.wait("/api") is True
+            (delay,), _ = mock_sleep.call_args
+            assert 0.05 <= delay <= 0.1
+
+        self.mock(httpx_kitsu)
+        with patch("builtins.print"):
+            assert await self.t.wait({"front": "/", "api": "/api"}) is True
+        assert set(self.t.ready_times) == {"front", "api"}
+
+        def down(request):
+            raise httpx.ConnectError("Connection refused")
+
+        self.mock(down)
+        self.t.wait_deadline = 0.1
+        self.t.poll_interval = 0.01
+        with patch("builtins.print"):
+            assert await self.t.wait("/api") is None
+
+    async def test_semaphore(self):
+        running = []
+        peak = []
+
+        async def handler(request):
+            running.append(request)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+            return httpx.Response(200)
+
+        self.mock(handler)
+        self.t.concurrency = 2
+        await asyncio.gather(
+            *(self.t.check_url("/", self.msg_ok, self.msg_ko) for _ in range(6))
+        )
+        assert max(peak) == 2
+
+    async def test_run_checks_async(self):
+        self.mock(httpx_kitsu)
+        self.t.kitsu_version = "0.17.30"
+        self.t.zou_version = "0.17.30"
+        checks = default_checks(self.t)
+        messages = [m async for m in run_checks_async(self.t, checks)]
+        assert [message[:5] for message in messages] == [
+            f"✅ {check.name}" for check in checks
+        ]
+        assert self.t.status == 0
+
+        def kitsu_down(request):
+            if request.url.path == "/":
+                raise httpx.ConnectError("Connection refused")
+            return httpx_kitsu(request)
+
+        self.mock(kitsu_down)
+        messages = [m async for m in run_checks_async(self.t, checks)]
+        assert (
+            messages[1] == "🔥 01b  Check if it's really a Kitsu (skipped, 01a failed)"
+        )
+        assert self.t.status == 1
+
+    async def test_run_checks_async_deadline(self):
+        get = self.t.get
+
+        async def slow_api(url, data=None, timeout=None):
+            if url.endswith("/api"):
+                await asyncio.sleep(1)
+            return await get(url, data, timeout)
+
+        self.mock(httpx_kitsu)
+        self.t.run_deadline = 0.1
+        with patch.object(self.t, "get", side_effect=slow_api):
+            start = time.monotonic()
+            messages = [
+                m async for m in run_checks_async(self.t, default_checks(self.t))
+            ]
+        assert time.monotonic() - start < 0.5
+        assert messages[1].startswith("✅ 01b")
+        assert messages[2] == "🔥 02a Check Kitsu API /api (timed out)"
+        assert messages[-1] == "🔥 07a Zou version (timed out)"
+        assert self.t.status == 1
+
+    async def test_deep_probes(self):
+        with LocalServer() as server:
+            async with AsyncCheckURL(server.url) as t:
+                t.deep_probes = True
+                messages = [m async for m in run_checks_async(t, default_checks(t))]
+                assert t.status == 0, messages
+                assert t.cookies == {"access_token_cookie": "cookie"}
+                server.server.token = jwt(3600)
+                t.tokens["access_token"] = jwt(-60)
+                assert await t.check_url(
+                    "/api/data/persons", "✅", "🔥", auth=True
+                ) == ("✅")
+                t.tokens["access_token"] = "rejected"
+                assert await t.check_url(
+                    "/api/data/persons", "✅", "🔥", auth=True
+                ) == ("✅")
+        assert t.refreshes == 2
+        assert t.responses["08b"].size == len(AUTHENTICATED["/api/data/user/context"])
+
+    async def test_local_server(self):
+        with LocalServer() as server:
+            async with AsyncCheckURL(server.url) as t:
+                assert await t.check_url("/api", "✅", "🔥") == "✅"
+                assert t.check_if_last_request_is_a_zou("✅", "🔥") == "✅"
+            assert t.client is None
+        assert set(t.request.timings) == {"connect", "ttfb", "total"}
+
+    async def test_body_is_capped(self):
+        self.mock(lambda request: httpx.Response(500, text=5000 * "e"))
+        self.t.max_body = 2000
+        assert (
+            await self.t.check_url("/", "✅", "🔥")
+            == "🔥\n" + 1024 * "e" + "\n[... 3976 bytes omitted]"
+        )
+        assert self.t.request.truncated
+        assert len(self.t.request.text) == 2000
+
+
+class TestFleet(TestCase):
+    def test_read_targets(self):
+        lines = [
+            "# tenants",
+            "",
+            "https://a.example.com",
+            "https://b.example.com 0.17.30 0.17.38",
+            '{"url": "https://c.example.com", "zou_version": "0.17.38"}',
+            '{"url": "https://d.example.com"',
+            '{"kitsu_version": "0.17.30"}',
+        ]
+        targets = list(read_targets(lines))
+        assert targets[-2]["url"] == '{"url": "https://d.example.com"'
+        assert targets[-2]["error"].startswith("invalid JSON: ")
+        assert targets[-1] == {"url": '{"kitsu_version": "0.17.30"}', "error": "no url"}
+        assert targets[:-2] == [
+            {"url": "https://a.example.com"},
+            {
+                "url": "https://b.example.com",
+                "kitsu_version": "0.17.30",
+                "zou_version": "0.17.38",
+            },
+            {"url": "https://c.example.com", "zou_version": "0.17.38"},
+        ]
+
+    def test_check_target(self):
+        with LocalServer() as server:
+            result = check_target(
+                {"url": server.url, "kitsu_version": "0.17.30"},
+                workers=2,
+                options={"timeout": 2},
+            )
+            assert result["url"] == server.url
+            assert result["status"] == 0
+            assert result["failed"] == []
+            assert result["messages"][-1].startswith("✅ 07a Zou version (")
+
+            result = check_target({"url": server.url, "zou_version": "0.17.41"})
+            assert result["status"] == 0
+            assert result["failed"] == ["07b"]
+
+        result = check_target({"url": "not-an-url"})
+        assert result["status"] == 1
+        assert result["failed"][0] == "01a"
+        assert "MissingSchema" in result["messages"][0]
+
+        result = check_target({"url": "{", "error": "invalid JSON"})
+        assert result["failed"] == ["error"]
+        assert result["messages"] == ["🔥 { invalid JSON"]
+        result = check_target({"kitsu_version": "0.17.30"})
+        assert result["failed"] == ["error"]
+        assert result["messages"] == ["🔥 None KeyError('url')"]
+
+    def test_run_fleet(self):
+        read = []
+
+        def targets(url):
+            for version in ("0.17.30", "0.17.41", "0.17.30", "0.17.30"):
+                read.append(version)
+                yield {"url": url, "kitsu_version": version}
+
+        with LocalServer() as server:
+            results = run_fleet(targets(server.url), processes=2, concurrency=2)
+            first = next(results)
+            assert len(read) <= 3
+            results = [first] + list(results)
+        assert len(read) == 4
+        assert len(results) == 4
+        assert sorted(len(result["failed"]) for result in results) == [0, 0, 0, 1]
+
+        # Malformed lines are failed targets, not the end of the fleet
+        with LocalServer() as server:
+            lines = ["{bad", f"{server.url} 0.17.30", '{"version": 1}']
+            results = list(run_fleet(read_targets(lines), processes=2))
+        assert sorted(result["failed"] for result in results) == [
+            [],
+            ["error"],
+            ["error"],
+        ]
+
+    def test_report_fleet(self):
+        results = [
+            {"url": "https://a", "status": 0, "failed": []},
+            {"url": "https://b", "status": 1, "failed": ["03a", "03c"]},
+        ]
+        with patch("builtins.print") as mock_print:
+            assert report_fleet(results) == 1
+        mock_print.assert_any_call("✅ https://a", flush=True)
+        mock_print.assert_any_call("Failed targets: 1/2")
+        mock_print.assert_called_with("🔥 https://b 03a, 03c")
+
+
+class TestMetrics(TestCase):
+    def test_observe(self):
+        metrics = Metrics()
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.zou_version = "0.17.41"
+            messages = list(run_suite(t, metrics=metrics))
+            t.ready_times = {"api": 0.5, "events": None}
+            metrics.observe_wait(t)
+        assert messages[-1].startswith("🔥 07b")
+        text = metrics.render()
+        labels = f'target="{server.url}"'
+        assert f'kitsu_check_success{{{labels},check="01a"}} 1' in text
+        assert f'kitsu_check_success{{{labels},check="07b"}} 0' in text
+        assert f'kitsu_check_duration_seconds_count{{{labels},check="02a"}} 1' in text
+        assert (
+            'check="07a"'
+            not in text.split("# HELP kitsu_component_ready ")[0].split(
+                "kitsu_check_duration_seconds histogram"
+            )[1]
+        )
+        assert (
+            f'kitsu_check_duration_seconds_bucket{{{labels},check="01a",le="+Inf"}} 1'
+            in text
+        )
+        assert f'kitsu_component_ready{{{labels},component="events"}} 0' in text
+        assert f'kitsu_component_ready_seconds{{{labels},component="api"}} 0.5' in text
+        assert (
+            f'kitsu_info{{{labels},kitsu_version="0.17.30",zou_version="0.17.30"}} 1'
+            in text
+        )
+        assert f"kitsu_checker_status{{{labels}}} 0" in text
+
+        t.reset()
+        assert t.status == 0
+        assert t.responses == {}
+        assert t.cache.misses == 3
+        with LocalServer() as server:
+            t.base_url = server.url
+            list(run_suite(t, metrics=metrics))
+        assert t.cache.misses == 6
+
+    def test_observe_duration(self):
+        metrics = Metrics()
+        metrics.observe_duration(("t", "01a"), 30)
+        metrics.observe_duration(("t", "01a"), 3000)
+        histogram = metrics.durations[("t", "01a")]
+        assert histogram["buckets"] == [0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 2]
+        assert histogram["count"] == 2
+        assert histogram["sum"] == 3.03
+
+    def test_no_versions(self):
+        metrics = Metrics()
+        t = CheckURL("http://127.0.0.1")
+        with patch("requests.Session.get") as mock_request:
+            mock_request.return_value.status_code = 200
+            mock_request.return_value.text = "<html>Not Kitsu</html>"
+            mock_request.return_value.json.side_effect = ValueError
+            t.check_url("/.version.txt", "✅", "🔥", name="06a")
+            t.check_url("/api", "✅", "🔥", name="07a")
+        metrics.observe(t, [], [])
+        assert 'kitsu_version="<html>Not Kitsu</html>",zou_version=""' in (
+            metrics.render()
+        )
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.status['http://a"b'] = 1
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "kitsu.prom")
+            metrics.write(path)
+            with open(path) as f:
+                assert 'kitsu_checker_status{target="http://a\\"b"} 1' in f.read()
+            assert os.listdir(directory) == ["kitsu.prom"]
+
+    def test_serve_metrics(self):
+        metrics = Metrics()
+        collect = MagicMock(
+            side_effect=lambda: metrics.status.update({"http://127.0.0.1": 1})
+        )
+        server = serve_metrics(metrics, 0, "127.0.0.1", collect)
+        try:
+            url = f"http://127.0.0.1:{server.server_port}"
+            response = requests.get(f"{url}/metrics")
+            assert response.status_code == 200
+            assert 'kitsu_checker_status{target="http://127.0.0.1"} 1' in response.text
+            assert requests.get(f"{url}/").status_code == 404
+            collect.assert_called_once_with()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestWatch(TestCase):
+    def test_conditional_requests(self):
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.conditional = {*cgwire_checks.CONDITIONAL, "/api"}
+            for _ in range(2):
+                t.reset()
+                assert t.check_url("/", "✅", "🔥") == "✅"
+                assert t.check_if_last_request_is_a_kitsu("✅", "🔥") == "✅"
+                t.kitsu_version = "0.17.30"
+                assert t.check_url("/.version.txt", "✅", "🔥") == "✅"
+                assert t.check_kitsu_version("✅", "🔥") == "✅0.17.30"
+                assert t.check_url("/api", "✅", "🔥") == "✅"
+            assert t.request.not_modified is False
+            assert t.not_modified == 2
+            assert t.responses == {}
+            assert set(t.validators) == {f"{server.url}/", f"{server.url}/.version.txt"}
+            assert [status for _, _, status in server.server.hits] == [
+                200,
+                200,
+                200,
+                304,
+                304,
+                200,
+            ]
+
+    def test_check_groups(self):
+        t = CheckURL("http://127.0.0.1")
+        t.kitsu_version = "0.17.30"
+        groups = check_groups(default_checks(t))
+        assert [[check.name for check in group] for group in groups] == [
+            ["01a", "01b"],
+            ["02a", "02b"],
+            ["03a", "03b", "03c"],
+            ["04a", "04b"],
+            ["05a", "05b"],
+            ["06a", "06b"],
+            ["07a"],
+        ]
+
+    def test_watch(self):
+        metrics = Metrics()
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            t.zou_version = "0.17.41"
+            cycles = list(islice(watch(t, 5, 0.01, metrics=metrics), 3))
+            assert t.status == 1
+            assert t.conditional == cgwire_checks.CONDITIONAL
+        assert len(cycles[0]) == 14
+        assert [message[:5] for message in cycles[1]] == ["✅ 07a", "🔥 07b"]
+        assert [message[:5] for message in cycles[2]] == ["✅ 07a", "🔥 07b"]
+        assert metrics.success[(server.url, "07b")] == 0
+        assert t.connection_stats()["opened"] <= 8
+
+
+class TestBenchmark(TestCase):
+    def test_suite(self):
+        results = bench_cgwire_checks.suite(
+            2, "stdlib", ["sequential", "concurrent"], payload=4096, ready_after=0.05
+        )
+        assert list(results) == ["sequential", "concurrent"]
+        for result in results.values():
+            assert result["failed_checks"] == 0
+            assert result["suite_ms"]["min"] <= result["suite_ms"]["median"]
+            assert result["requests_per_second"] > 0
+            assert result["wait_convergence_ms"] is not None
+            assert result["memory_peak_kb"] > 0
+
+    def test_stand_in(self):
+        with bench_cgwire_checks.StandIn(error_rate=1) as stand_in:
+            t = CheckURL(stand_in.url)
+            assert t.check_url("/api", "✅", "🔥").startswith("🔥\n<html>502")
+        assert stand_in.hits == 1
+        with bench_cgwire_checks.StandIn(payload=4096) as stand_in:
+            t = CheckURL(stand_in.url)
+            assert t.check_url("/", "✅", "🔥", name="01a") == "✅"
+        assert len(t.responses["01a"].text) == 4096
+
+    def test_compare(self):
+        old = {"commit": "a", "suite": {"pooled": {"suite_ms": 10, "failed": 0}}}
+        new = {"commit": "b", "suite": {"pooled": {"suite_ms": 15, "failed": 0}}}
+        assert list(bench_cgwire_checks.compare(old, new)) == [
+            ("suite.pooled.suite_ms", 10, 15, 50.0),
+            ("suite.pooled.failed", 0, 0, None),
+        ]
+
+
+class TestHistory(TestCase):
+    def setUp(self):
+        self.history = History(":memory:", window=10)
+        self.addCleanup(self.history.close)
+        self.checks = [
+            Check("02a", "✅ 02a", "🔥 02a", url="/api"),
+            Check("07a", "✅ 07a", "🔥 07a", url="/api"),
+        ]
+
+    def run_on(self, zou_version, total, passed=True):
+        t = CheckURL("http://127.0.0.1")
+        request = MagicMock(timings={"total": total})
+        t.responses = {"02a": request, "07a": request}
+        message = "✅ 02a" if passed else "🔥 02a"
+        versions = ("0.17.30", zou_version)
+        with patch("cgwire_checks.detected_versions", return_value=versions):
+            return self.history.record(t, self.checks, [message, "✅ 07a"])
+
+    def test_regression(self):
+        base = [100, 102, 98, 101, 99]
+        assert cgwire_checks.regression([150], base) > 3
+        assert cgwire_checks.regression([110], base) is None
+        assert cgwire_checks.regression([150], base[:4]) is None
+        assert cgwire_checks.regression([], base) is None
+        assert cgwire_checks.regression([103], 5 * [80]) > 3
+        noisy = [50, 150, 80, 120, 100]
+        assert cgwire_checks.regression([130], noisy) is None
+        assert cgwire_checks.regression(3 * [130], noisy) is None
+        assert cgwire_checks.regression(10 * [130], noisy) > 3
+
+    def test_record(self):
+        run = self.run_on("0.17.30", 80)
+        assert self.run_on("0.17.30", 90, passed=False) == run + 1
+        rows = self.history.db.execute("SELECT * FROM results ORDER BY run").fetchall()
+        assert rows == [
+            (run, "02a", 1, 80),
+            (run, "07a", 1, None),
+            (run + 1, "02a", 0, 90),
+            (run + 1, "07a", 1, None),
+        ]
+        assert self.history.latencies([run, run + 1]) == {"02a": [80]}
+
+    def test_regressions(self):
+        assert self.history.regressions("http://127.0.0.1") == []
+        for total in (100, 102, 98, 101, 99, 100):
+            self.run_on("0.17.30", total)
+        # Same versions, no baseline to compare with
+        self.run_on("0.17.30", 300)
+        assert self.history.regressions("http://127.0.0.1") == []
+
+        self.run_on("0.17.31", 104)
+        assert self.history.regressions("http://127.0.0.1") == []
+        self.run_on("0.17.32", 150)
+        assert self.history.regressions("http://127.0.0.1") == []
+        for total in (100, 102, 98, 101, 99):
+            self.run_on("0.17.33", total)
+        self.run_on("0.17.34", 150)
+        [regression] = self.history.regressions("http://127.0.0.1")
+        assert regression[:5] == (
+            "02a",
+            ("0.17.30", "0.17.34"),
+            150,
+            ("0.17.30", "0.17.33"),
+            100,
+        )
+        assert cgwire_checks.format_regression(regression) == (
+            "🐢 02a slower on Kitsu 0.17.30 / Zou 0.17.34: 150.0 ms,"
+            " was 100.0 ms on Kitsu 0.17.30 / Zou 0.17.33 (z 33.7)"
+        )
+
+    def test_run_suite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = History(os.path.join(directory, "history.db"))
+            with LocalServer() as server:
+                t = CheckURL(server.url)
+                for _ in range(2):
+                    t.reset()
+                    messages = list(run_suite(t, history=history))
+                    assert len(messages) == 13
+                    assert t.status == 0
+            assert history.db.execute("SELECT COUNT(*) FROM runs").fetchone() == (2,)
+            with patch(
+                "cgwire_checks.History.regressions",
+                return_value=[
+                    ("02a", (None, "0.17.30"), 150, (None, "0.17.29"), 100, 3.1)
+                ],
+            ):
+                t.reset()
+                with LocalServer() as server:
+                    t.base_url = server.url
+                    messages = list(run_suite(t, history=history))
+            assert messages[-1].startswith("🐢 02a slower")
+            assert t.status == cgwire_checks.REGRESSION
+            history.close()
+
+    def test_watch(self):
+        regression = ("02a", (None, "0.17.30"), 150, (None, "0.17.29"), 100, 3.1)
+        with LocalServer() as server:
+            t = CheckURL(server.url)
+            with patch.object(self.history, "regressions", return_value=[regression]):
+                [messages] = islice(watch(t, 5, 0.01, history=self.history), 1)
+        assert messages[-1].startswith("🐢 02a slower")
+        assert t.status == cgwire_checks.REGRESSION
+        runs = self.history.db.execute("SELECT COUNT(*) FROM runs").fetchone()
+        assert runs == (1,)